@@ -1,3 +1,9 @@
 """Imports functions from mdb_tools"""
 
 from .mdb_tools import NelsonMDB, get_entity_type
+from .async_mdb import AsyncNelsonMDB, bounded_gather
+from .link_journal import LinkJournal
+from .link_plan import LinkPlan, apply_parallel, compile_link_plan
+from .memory_mdb import MemoryGraph, MemoryMDB
+from .query_stats import QueryStats
+from .similarity import CharNgramBackend, SimilarityBackend, SpacyBackend, StringDistanceBackend
@@ -0,0 +1,346 @@
+"""
+Asyncio client for the MDB built on the neo4j async driver.
+
+AsyncNelsonMDB mirrors the public NelsonMDB API with coroutines, reusing the
+same parameterized query templates (see queries.py), so services can overlap
+MDB round trips instead of waiting on each one.
+"""
+
+import asyncio
+
+from bento_meta.entity import Entity
+from bento_meta.objects import Concept, Predicate
+from neo4j import AsyncGraphDatabase
+
+from .mdb_tools import NelsonMDB, resolve_concept_merges
+from .nano_cache import NanoCache, lookup_key
+from .queries import (MERGE_CONCEPTS_QRY, PREDICATE_RELATIONSHIP_QRY, check_extra_handles,
+                      checked_relationship_statement, concepts_bulk_query, edge_nano_statement,
+                      entity_attrs, entity_statement, get_entity_type, link_synonyms_statement,
+                      merge_entities_bulk_query, merge_relationships_bulk_query,
+                      prop_nano_statement)
+
+
+async def bounded_gather(awaitables, limit: int = 10, return_exceptions: bool = False) -> list:
+    """
+    Like asyncio.gather, but runs at most limit of the awaitables at a time.
+
+    Results are returned in the order of awaitables.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(
+        *(run(awaitable) for awaitable in awaitables), return_exceptions=return_exceptions)
+
+
+async def _fetch(tx, qry: str, parms: dict) -> list:
+    """Runs query in transaction tx and returns its records as dicts"""
+    result = await tx.run(qry, parms)
+    return await result.data()
+
+
+class AsyncNelsonMDB:
+    """
+    Async counterpart of NelsonMDB.
+
+    Connects with neo4j.AsyncGraphDatabase, or uses the given driver, which
+    only needs session() returning an async context manager whose
+    execute_read/execute_write(work, *args) await work(tx, *args), with
+    tx.run(qry, parms) returning a result with an async data() (e.g. a fake
+    driver in tests). An injected driver isn't closed by close().
+
+    Lookups can be overlapped with gather, which runs at most max_concurrency
+    of them at a time:
+
+        nanos = await mdbn.gather(mdbn.get_or_make_nano(term) for term in terms)
+
+    Unlike NelsonMDB there's no batch() buffer or term synonym search.
+    """
+    # helpers that don't touch the database are shared with NelsonMDB
+    get_entity_attrs = NelsonMDB.get_entity_attrs
+    make_nano = NelsonMDB.make_nano
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        uri: str = None,
+        user: str = None,
+        password: str = None,
+        driver=None,
+        database: str = None,
+        max_concurrency: int = 10,
+        nano_cache_size: int = 100000
+        ):
+        if driver is None:
+            if not uri:
+                raise RuntimeError("AsyncNelsonMDB needs a uri or a driver")
+            driver = AsyncGraphDatabase.driver(uri, auth=(user, password))
+            self._owns_driver = True
+        else:
+            self._owns_driver = False
+        self.driver = driver
+        self.database = database
+        self.max_concurrency = max_concurrency
+        self.nano_cache = NanoCache(max_size=nano_cache_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self) -> None:
+        """Closes driver if it was created by this client"""
+        if self._owns_driver:
+            await self.driver.close()
+
+    def _session(self):
+        if self.database:
+            return self.driver.session(database=self.database)
+        return self.driver.session()
+
+    async def read(self, qry: str, parms: dict = None) -> list:
+        """Runs read query in a managed transaction and returns records as dicts"""
+        async with self._session() as session:
+            return await session.execute_read(_fetch, qry, parms or {})
+
+    async def write(self, qry: str, parms: dict = None) -> list:
+        """Runs write query in a managed transaction and returns records as dicts"""
+        async with self._session() as session:
+            return await session.execute_write(_fetch, qry, parms or {})
+
+    async def read_values(self, qry: str, parms: dict, key: str) -> list:
+        """Runs read query and returns list of the given key's values"""
+        return [record[key] for record in await self.read(qry, parms)]
+
+    async def gather(self, awaitables, limit: int = None) -> list:
+        """Awaits awaitables with at most limit (default max_concurrency) running at once"""
+        return await bounded_gather(awaitables, limit or self.max_concurrency)
+
+    async def detach_delete_entity(self, entity: Entity) -> list:
+        """Remove given Entity node from the database."""
+        self.nano_cache.invalidate(
+            get_entity_type(entity), self.get_entity_attrs(entity, output_str=False))
+        return await self.write(*entity_statement("detach_delete", entity))
+
+    async def get_entity_count(self, entity: Entity) -> list:
+        """Returns count of given entity (w/ its properties) found in MDB."""
+        qry, parms = entity_statement("count", entity)
+        return await self.read_values(qry, parms, "entity_count")
+
+    async def create_entity(self, entity: Entity) -> list:
+        """Adds given Entity node to database"""
+        if not entity.nanoid:
+            raise RuntimeError(
+                "Entity needs a nanoid before creating - please set valid entity nanoid. "
+                "entity_name.nanoid = mdb_name.get_or_make_nano(entity_name) AFTER "
+                "declaring some other entity properties is a good way to do this.")
+        self.nano_cache.invalidate(
+            get_entity_type(entity), self.get_entity_attrs(entity, output_str=False))
+        return await self.write(*entity_statement("merge", entity))
+
+    async def get_concepts(self, entity: Entity) -> list:
+        """Returns list of concepts represented by given entity"""
+        template = "term_concepts" if get_entity_type(entity) == "term" else "concepts"
+        qry, parms = entity_statement(template, entity)
+        return await self.read_values(qry, parms, "concept")
+
+    async def create_relationship(
+        self,
+        src_entity: Entity,
+        dst_entity: Entity,
+        relationship: str
+        ) -> None:
+        """Adds relationship between given entities in MDB (see NelsonMDB.create_relationship)"""
+        for entity in (src_entity, dst_entity):
+            self.nano_cache.invalidate_linked(get_entity_type(entity), entity_attrs(entity))
+        qry, parms = checked_relationship_statement(src_entity, dst_entity, relationship)
+        result = (await self.write(qry, parms))[0]
+        if (result["src_count"] > 1 or result["dst_count"] > 1):
+            raise RuntimeError(
+                "Given entities must uniquely identify nodes in the MDB. Please add "
+                "necessary properties to the entity so that it can be uniquely identified.")
+        if (result["src_count"] < 1 or result["dst_count"] < 1):
+            raise RuntimeError(
+                "One or more of the given entities aren't in the MDB.")
+
+    async def get_concepts_bulk(self, entity_type: str, nanoids: list) -> list:
+        """Returns records of (nanoid, concepts) for entities of given type and nanoids"""
+        return await self.read(concepts_bulk_query(entity_type), {"nanoids": nanoids})
+
+    async def merge_entities_bulk(self, entity_type: str, rows: list) -> list:
+        """Ensures entities of given type (attribute dicts with nanoids) exist in MDB"""
+        return await self.write(merge_entities_bulk_query(entity_type), {"rows": rows})
+
+    async def merge_relationships_bulk(
+        self,
+        src_type: str,
+        relationship: str,
+        dst_type: str,
+        pairs: list
+        ) -> list:
+        """Ensures relationship exists for each [src_nanoid, dst_nanoid] pair"""
+        qry = merge_relationships_bulk_query(src_type, relationship, dst_type)
+        return await self.write(qry, {"pairs": pairs})
+
+    async def link_synonyms(
+        self,
+        entity_1: Entity,
+        entity_2: Entity,
+        add_missing_ent: bool = False
+        ) -> str:
+        """
+        Link two synonymous entities in the MDB via a Concept node, in one statement.
+
+        Raises the same errors as NelsonMDB.link_synonyms. Returns nanoid of
+        the Concept linking both entities.
+        """
+        qry, parms = link_synonyms_statement(
+            entity_1, entity_2, add_missing_ent, self.make_nano())
+        result = (await self.write(qry, parms))[0]
+        if (result["count_1"] > 1 or result["count_2"] > 1):
+            raise RuntimeError(
+                "Given entities must uniquely identify nodes in the MDB. Please add "
+                "necessary properties to the entity so that it can be uniquely identified.")
+        if ((result["count_1"] < 1 or result["count_2"] < 1) and not add_missing_ent):
+            raise RuntimeError(
+                "One or more of the given entities aren't in the MDB and add_missing_ent is False."
+                "Please add the missing entities to the MDB or set add_missing_ent to True.")
+        if not result["ok"]:
+            raise RuntimeError(
+                "Entity needs a nanoid before creating - please set valid entity nanoid. "
+                "entity_name.nanoid = mdb_name.get_or_make_nano(entity_name) AFTER "
+                "declaring some other entity properties is a good way to do this.")
+        for entity, ent_count in [(entity_1, result["count_1"]), (entity_2, result["count_2"])]:
+            if not ent_count:
+                self.nano_cache.invalidate(
+                    get_entity_type(entity), self.get_entity_attrs(entity, output_str=False))
+        return result["concept"]
+
+    async def get_entity_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> list:
+        """
+        Takes an entity and returns its nanoid (see NelsonMDB.get_entity_nano).
+
+        Unique results are cached in nano_cache, so repeat lookups skip the database.
+        """
+        key = lookup_key(
+            get_entity_type(entity), entity_attrs(entity), extra_handle_1, extra_handle_2)
+        if key is not None:
+            nano = self.nano_cache.get(key)
+            if nano is not None:
+                return [nano]
+        ent_type = get_entity_type(entity)
+        check_extra_handles(ent_type, extra_handle_1, extra_handle_2)
+        if ent_type == "property":
+            nano_list = await self.read_values(
+                *prop_nano_statement(prop=entity, node_handle=extra_handle_1))
+        elif ent_type == "relationship":
+            nano_list = await self.read_values(*edge_nano_statement(
+                edge=entity, src_handle=extra_handle_1, dst_handle=extra_handle_2))
+        else:
+            if (await self.get_entity_count(entity))[0] > 1:
+                raise RuntimeError(
+                    "Given entities must uniquely identify nodes in the MDB. Please add "
+                    "necesary properties to the entity so that it can be uniquely identified.")
+            qry, parms = entity_statement("nanoid", entity)
+            nano_list = await self.read_values(qry, parms, "ent_nano")
+        if len(nano_list) == 1:
+            self.nano_cache.put(key, nano_list[0])
+        return nano_list
+
+    async def resolve_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> tuple:
+        """Returns (nanoid, found) for given entity (see NelsonMDB.resolve_nano)"""
+        nano_list = await self.get_entity_nano(entity, extra_handle_1, extra_handle_2)
+        if len(nano_list) > 1:
+            raise RuntimeError(
+                "More than one entity exists with these properties. Please "
+                "add more properties of the desired entity to uniquely ID.")
+        elif nano_list and not nano_list[0]:
+            raise RuntimeError(
+                "An entity with these properties exists in the MDB but doesn't "
+                "have an assigned nanoid for some reason.")
+        elif nano_list:
+            return (nano_list[0], True)
+        return (self.make_nano(), False)
+
+    async def get_or_make_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> str:
+        """Obtains existing entity's nanoid or creates one for new entity."""
+        return (await self.resolve_nano(entity, extra_handle_1, extra_handle_2))[0]
+
+    async def get_term_nanos(self, concept: Concept) -> list:
+        """Returns list of term nanoids representing given concept"""
+        if not concept.nanoid:
+            raise RuntimeError("arg 'concept' must have nanoid")
+        qry, parms = entity_statement("concept_terms", concept)
+        return await self.read_values(qry, parms, "term_nano")
+
+    async def get_predicate_nanos(self, concept: Concept) -> list:
+        """Returns list of predicate nanoids with relationship to given concept"""
+        if not concept.nanoid:
+            raise RuntimeError("arg 'concept' must have nanoid")
+        qry, parms = entity_statement("concept_predicates", concept)
+        return await self.read_values(qry, parms, "pred_nano")
+
+    async def get_predicate_relationship(self, concept: Concept, predicate: Predicate) -> list:
+        """Returns relationship type between given concept and predicate"""
+        if not concept.nanoid or not predicate.nanoid:
+            raise RuntimeError("args 'concept' and 'predicate' must have nanoid")
+        parms = {"pred_nano": predicate.nanoid, "con_nano": concept.nanoid}
+        return await self.read_values(PREDICATE_RELATIONSHIP_QRY, parms, "rel_type")
+
+    async def link_concepts_to_predicate(
+        self,
+        concept_1: Concept,
+        concept_2: Concept,
+        predicate_handle: str = "exactMatch"
+        ) -> None:
+        """Links two synonymous Concepts via a Predicate"""
+        if not (concept_1.nanoid and concept_2.nanoid):
+            raise RuntimeError("args 'concept_1' and 'concept_2' must have nanoid")
+        valid_predicate_handles = ['exactMatch', 'closeMatch', 'broader', 'narrower', 'related']
+        if predicate_handle not in valid_predicate_handles:
+            raise RuntimeError(
+                f"'handle' key must be one the following: {valid_predicate_handles}")
+        new_predicate = Predicate({"handle": predicate_handle, "nanoid": self.make_nano()})
+        await self.create_entity(new_predicate)
+        await self.create_relationship(new_predicate, concept_1, "has_subject")
+        await self.create_relationship(new_predicate, concept_2, "has_object")
+
+    async def merge_two_concepts(self, concept_1: Concept, concept_2: Concept) -> None:
+        """Combine two synonymous Concepts into concept_1, in one transaction."""
+        if not (concept_1.nanoid and concept_2.nanoid):
+            raise RuntimeError("args 'concept_1' and 'concept_2' must have nanoid")
+        await self.merge_concepts([(concept_1.nanoid, concept_2.nanoid)])
+
+    async def merge_concepts(self, pairs: list) -> list:
+        """
+        Merges each (keep, drop) pair of Concept nanoids, all in one transaction.
+
+        See NelsonMDB.merge_concepts. Returns list of [keep, drop] pairs merged.
+        """
+        resolved = resolve_concept_merges(pairs)
+        if not resolved:
+            return []
+        records = await self.write(MERGE_CONCEPTS_QRY, {"pairs": resolved})
+        if len(records) != len(resolved):
+            raise RuntimeError(
+                f"One or more Concepts in {resolved} aren't in the MDB. No Concepts were merged.")
+        return resolved
@@ -0,0 +1,370 @@
+"""
+Benchmarks of mdb_tools hot paths on synthetic in-memory MDBs.
+
+Each benchmark runs against a MemoryMDB filled by synthetic_mdb, so results
+measure mdb_tools itself (and the number of round trips it would make to
+Neo4j) rather than the database. Each one runs in a fresh process, so its
+peak RSS is its own. See the bench-mdb console script.
+"""
+
+import contextlib
+import csv
+import io
+import multiprocessing
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from bento_meta.objects import Concept, Property, Term
+
+from .memory_mdb import MemoryGraph, MemoryMDB
+from .similarity import SpacyBackend
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# benchmark names, in run order
+BENCHMARKS = [
+    "get_or_make_nano", "link_synonyms", "merge_two_concepts",
+    "get_term_synonyms", "link_ents_cli", "clean_cda_cli"
+]
+MODELS = ["GDC", "PDC", "ICDC"]
+ORIGINS = ["NCIt", "GDC", "PDC", "ICDC"]
+
+
+class HashingNLP:
+    """
+    Stand-in for a spaCy pipeline whose vectors are hashed character trigram counts.
+
+    Similar strings get similar vectors, which is enough to exercise the term
+    index without loading a spaCy model.
+    """
+    def __init__(self, dim: int = 300):
+        self.vocab = SimpleNamespace(vectors_length=dim)
+        self.meta = {"lang": "xx", "name": "hashing", "version": str(dim)}
+
+    def __call__(self, text: str):
+        vector = np.zeros(self.vocab.vectors_length, dtype=np.float32)
+        padded = f"  {text.lower()} "
+        for start in range(len(padded) - 2):
+            gram = padded[start:start + 3].encode()
+            vector[zlib.crc32(gram) % self.vocab.vectors_length] += 1.0
+        return SimpleNamespace(vector=vector)
+
+
+def random_word(rng: random.Random, min_len: int = 4, max_len: int = 10) -> str:
+    """Returns random lowercase word"""
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(min_len, max_len)))
+
+
+def synthetic_mdb(scale: int, seed: int = 0) -> MemoryMDB:
+    """
+    Returns MemoryMDB with about scale Terms and scale Properties.
+
+    Properties are spread over scale // 20 Nodes per model (at least 5), each
+    Term has an origin from ORIGINS and every other pair of Terms already
+    shares a Concept. The graph has no tracked changes.
+    """
+    rng = random.Random(seed)
+    graph = MemoryGraph()
+    nano = iter(range(10 ** 9))
+    nodes_per_model = max(5, scale // (20 * len(MODELS)))
+    node_ids = {}
+    for model in MODELS:
+        for num in range(nodes_per_model):
+            node_ids[(model, num)] = graph.create(
+                "node", {"handle": f"node_{num}", "model": model, "nanoid": f"n{next(nano)}"},
+                track=False)
+    for num in range(scale):
+        model = MODELS[num % len(MODELS)]
+        node_num = (num // len(MODELS)) % nodes_per_model
+        prop_id = graph.create(
+            "property",
+            {"handle": f"prop_{num}", "model": model, "nanoid": f"p{next(nano)}"},
+            track=False)
+        graph.merge_relationship(node_ids[(model, node_num)], "has_property", prop_id)
+    concept_id = None
+    for num in range(scale):
+        term_id = graph.create(
+            "term",
+            {"value": f"{random_word(rng)} {num}", "origin_name": ORIGINS[num % len(ORIGINS)],
+             "nanoid": f"t{next(nano)}"},
+            track=False)
+        if num % 4 == 0:
+            concept_id = graph.create("concept", {"nanoid": f"c{next(nano)}"}, track=False)
+        if num % 4 < 2:
+            graph.merge_relationship(term_id, "represents", concept_id)
+    graph.mark_synced()
+    return MemoryMDB(graph=graph)
+
+
+class RoundTripCounter:
+    """Counts calls of a MemoryMDB's QUERY_METHODS, each one Neo4j round trip"""
+    def __init__(self, mdbm: MemoryMDB):
+        self.count = 0
+        for name in mdbm.QUERY_METHODS:
+            setattr(mdbm, name, self._wrap(getattr(mdbm, name)))
+
+    def _wrap(self, method):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def peak_rss_mb():
+    """Returns peak resident set size of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name: str, scale: int, latencies: list, seconds: float, round_trips: int) -> dict:
+    """Returns result dict of a benchmark from per-op latencies (in seconds)"""
+    ops = len(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "benchmark": name,
+        "scale": scale,
+        "ops": ops,
+        "seconds": seconds,
+        "ops_per_second": ops / seconds if seconds else None,
+        "p50_ms": float(np.percentile(latencies_ms, 50)) if ops else None,
+        "p99_ms": float(np.percentile(latencies_ms, 99)) if ops else None,
+        "round_trips_per_op": round_trips / ops if ops else None,
+        "peak_rss_mb": None
+    }
+
+
+def time_ops(name: str, scale: int, mdbm: MemoryMDB, func, args_list: list) -> dict:
+    """Calls func(*args) for each args in args_list, timing every call"""
+    counter = RoundTripCounter(mdbm)
+    latencies = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in args_list:
+            op_start = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - op_start)
+    return summarize(name, scale, latencies, time.perf_counter() - start, counter.count)
+
+
+def bench_get_or_make_nano(scale: int, ops: int, rng: random.Random) -> dict:
+    """Looks up existing Properties (by node handle) and Terms, plus some new Terms"""
+    mdbm = synthetic_mdb(scale)
+    graph = mdbm.graph
+    props = list(graph.by_label["property"])
+    terms = list(graph.by_label["term"])
+    args_list = []
+    for num in range(ops):
+        if num % 3 == 0:
+            prop_id = rng.choice(props)
+            node_id = graph.neighbors(prop_id, "has_property", incoming=True)[0]
+            prop = Property({
+                "handle": graph.props[prop_id]["handle"], "model": graph.props[prop_id]["model"]})
+            args_list.append((prop, graph.props[node_id]["handle"]))
+        elif num % 3 == 1:
+            props_ = graph.props[rng.choice(terms)]
+            args_list.append(
+                (Term({"value": props_["value"], "origin_name": props_["origin_name"]}),))
+        else:
+            args_list.append((Term({"value": random_word(rng), "origin_name": "new"}),))
+    return time_ops("get_or_make_nano", scale, mdbm, mdbm.get_or_make_nano, args_list)
+
+
+def bench_link_synonyms(scale: int, ops: int, rng: random.Random) -> dict:
+    """Links pairs of Terms, a quarter of them with one new Term"""
+    mdbm = synthetic_mdb(scale)
+    graph = mdbm.graph
+    terms = list(graph.by_label["term"])
+    args_list = []
+    for num in range(ops):
+        term_1 = Term(graph.props[rng.choice(terms)])
+        if num % 4 == 0:
+            term_2 = Term({"value": random_word(rng), "origin_name": "new", "nanoid": f"x{num}"})
+        else:
+            term_2 = Term(graph.props[rng.choice(terms)])
+        args_list.append((term_1, term_2, True))
+    return time_ops("link_synonyms", scale, mdbm, mdbm.link_synonyms, args_list)
+
+
+def bench_merge_two_concepts(scale: int, ops: int, rng: random.Random) -> dict:
+    """Merges disjoint pairs of Concepts"""
+    mdbm = synthetic_mdb(scale)
+    concepts = [mdbm.graph.props[node_id]["nanoid"] for node_id in mdbm.graph.by_label["concept"]]
+    rng.shuffle(concepts)
+    pairs = list(zip(concepts[0::2], concepts[1::2]))[:ops]
+    args_list = [(Concept({"nanoid": keep}), Concept({"nanoid": drop})) for keep, drop in pairs]
+    return time_ops("merge_two_concepts", scale, mdbm, mdbm.merge_two_concepts, args_list)
+
+
+def bench_get_term_synonyms(scale: int, ops: int, rng: random.Random) -> list:
+    """Builds the term index, then queries synonyms of existing Term values"""
+    mdbm = synthetic_mdb(scale)
+    mdbm.set_similarity(SpacyBackend(nlp=HashingNLP()))
+    results = [time_ops("build_term_index", scale, mdbm, mdbm.build_term_index, [()])]
+    terms = list(mdbm.graph.by_label["term"])
+    args_list = [(Term(mdbm.graph.props[rng.choice(terms)]), 0.8, 10) for _ in range(ops)]
+    results.append(
+        time_ops("get_term_synonyms", scale, mdbm, mdbm.get_term_synonyms, args_list))
+    return results
+
+
+def bench_link_ents_cli(scale: int, ops: int, rng: random.Random, workdir: Path) -> dict:
+    """Runs link-ents on an in-memory snapshot with ops Property rows"""
+    from .scripts.link_synonym_ents_csv import main  # pylint: disable=import-outside-toplevel
+    mdbm = synthetic_mdb(scale)
+    graph = mdbm.graph
+    snapshot_path = workdir / f"mdb_{scale}.json.gz"
+    mdbm.dump(snapshot_path)
+    csv_path = workdir / f"link_{scale}.csv"
+    props = list(graph.by_label["property"])
+    with open(csv_path, "w", encoding="UTF-8", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow([
+            "ent_1_model", "ent_1_handle", "ent_1_extra_handles",
+            "ent_2_model", "ent_2_handle", "ent_2_extra_handles"])
+        for _ in range(ops):
+            row = []
+            for prop_id in rng.sample(props, 2):
+                node_id = graph.neighbors(prop_id, "has_property", incoming=True)[0]
+                row.extend([
+                    graph.props[prop_id]["model"], graph.props[prop_id]["handle"],
+                    str([graph.props[node_id]["handle"]])])
+            writer.writerow(row)
+    args = [
+        "--csv_filepath", str(csv_path), "--mdb_uri", f"memory:{snapshot_path}",
+        "--mdb_user", "", "--mdb_pass", "", "--entity_type", "property",
+        "--add_missing_ent", "false"]
+    return time_cli("link_ents_cli", scale, ops, main, args)
+
+
+def bench_clean_cda_cli(scale: int, ops: int, rng: random.Random, workdir: Path) -> dict:
+    """Runs clean-cda on a synthetic mapping workbook with ops fields over six sheets"""
+    from .scripts.clean_cda_map_excel import main  # pylint: disable=import-outside-toplevel
+    endpoints = ["subject", "researchsubject", "diagnosis", "treatment", "specimen", "file"]
+    excel_path = workdir / f"cda_{scale}.xlsx"
+    with pd.ExcelWriter(excel_path) as writer:
+        for endpoint in endpoints:
+            fields = [f"{random_word(rng)}_{num}" for num in range(max(1, ops // len(endpoints)))]
+            sheet = {"field": fields}
+            for model in MODELS:
+                sheet[model] = [
+                    rng.choice(["NOT CURRENTLY MAPPED", f"cases.{random_word(rng)}",
+                                f"cases.demographics.{random_word(rng)}"])
+                    for _ in fields]
+            pd.DataFrame(sheet).to_excel(writer, sheet_name=f"{endpoint} mappings", index=False)
+    args = ["--input_filepath", str(excel_path)]
+    return time_cli("clean_cda_cli", scale, ops, main, args)
+
+
+def time_cli(name: str, scale: int, rows: int, command, args: list) -> dict:
+    """Runs click command once with args; reports its rows per second"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        command.main(args, standalone_mode=False)
+    seconds = time.perf_counter() - start
+    result = summarize(name, scale, [], seconds, 0)
+    result.update({"ops": rows, "ops_per_second": rows / seconds if seconds else None})
+    return result
+
+
+API_BENCHMARKS = {
+    "get_or_make_nano": bench_get_or_make_nano,
+    "link_synonyms": bench_link_synonyms,
+    "merge_two_concepts": bench_merge_two_concepts,
+    "get_term_synonyms": bench_get_term_synonyms,
+}
+CLI_BENCHMARKS = {
+    "link_ents_cli": bench_link_ents_cli,
+    "clean_cda_cli": bench_clean_cda_cli,
+}
+
+
+def run_benchmark(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    name: str,
+    scale: int,
+    ops: int,
+    seed: int,
+    workdir: str,
+    measure_rss: bool = False
+    ) -> list:
+    """
+    Runs one benchmark at one scale; returns its results.
+
+    If measure_rss is set, each result's peak_rss_mb is the peak RSS of this
+    process, so only set it when the process runs nothing else (see
+    run_benchmarks).
+    """
+    rng = random.Random(seed)
+    if name in CLI_BENCHMARKS:
+        result = CLI_BENCHMARKS[name](scale, ops, rng, Path(workdir))
+    else:
+        result = API_BENCHMARKS[name](scale, ops, rng)
+    results = result if isinstance(result, list) else [result]
+    if measure_rss:
+        for result in results:
+            result["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_benchmarks(
+    scales: list,
+    benchmarks: list = None,
+    ops: int = 1000,
+    seed: int = 0,
+    isolate: bool = True
+    ) -> dict:
+    """
+    Runs benchmarks (default all of BENCHMARKS) at each scale; returns JSON-serializable report.
+
+    Each benchmark runs ops operations (rows, for the CLIs) on a fresh
+    synthetic MDB of the given scale. With isolate set, each benchmark runs
+    in a new (spawned) process and reports that process's peak RSS, which
+    includes the interpreter and the synthetic MDB (from a script, call this
+    under if __name__ == "__main__"). Otherwise all run in this process and
+    peak_rss_mb is None, as the process peak only grows.
+    """
+    benchmarks = benchmarks or BENCHMARKS
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise RuntimeError(f"Unknown benchmarks {sorted(unknown)}; choose from {BENCHMARKS}")
+    try:
+        version = metadata.version("mdb_tools")
+    except metadata.PackageNotFoundError:
+        version = None
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in scales:
+            for name in benchmarks:
+                if not isolate:
+                    results.extend(run_benchmark(name, scale, ops, seed, workdir))
+                    continue
+                with ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    results.extend(executor.submit(
+                        run_benchmark, name, scale, ops, seed, workdir, True).result())
+    return {
+        "mdb_tools_version": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "ops": ops,
+        "seed": seed,
+        "results": results
+    }
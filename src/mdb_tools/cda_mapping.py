@@ -0,0 +1,343 @@
+"""
+Cleans Cancer Data Aggregator (CDA) mapping workbooks into CSVs for link-ents.
+
+Each workbook sheet maps the fields of one CDA endpoint (the first word of
+the sheet name) to a handle path like "cases.demographics.ethnicity" in each
+model column. Sheets are reshaped and cleaned with vectorized pandas string
+ops, so each can be cleaned on its own and the fragments concatenated once.
+
+With a SheetCache, cleaned fragments are kept per sheet content hash, so
+re-issued workbooks only recompute the sheets that changed, and _added and
+_removed CSVs list the mapping rows added or removed since the last run.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import pickle
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from pathlib import Path
+
+import pandas as pd
+
+MAPPING_COLUMNS = [
+    "ent_1_model", "ent_1_handle", "ent_1_extra_handles",
+    "ent_2_model", "ent_2_handle", "ent_2_extra_handles"
+]
+# mapping cells that don't name a handle
+UNMAPPED_VALUES = ["NOT CURRENTLY MAPPED", "NOT APPLICABLE"]
+# CDA endpoint -> MDB node handle
+ENDPOINT_HANDLES = {
+    "subject": "Subject", "researchsubject": "ResearchSubject", "diagnosis": "Diagnosis",
+    "treatment": "Treatment", "specimen": "Specimen", "file": "File"
+}
+# plural handle path segment -> MDB node handle
+NODE_HANDLES = {
+    "files": "file", "cases": "case", "demographics": "demographic", "projects": "project",
+    "diagnoses": "diagnosis", "treatments": "treatment", "samples": "sample"
+}
+WORKBOOK_SUFFIXES = [".xlsx", ".xlsm", ".xls"]
+# bump when clean_sheet output changes, so cached fragments aren't reused
+CACHE_VERSION = 1
+
+
+def sheet_endpoint(sheet_name: str) -> str:
+    """Returns CDA endpoint of sheet, the first word of its name"""
+    return str(sheet_name).split(" ", maxsplit=1)[0]
+
+
+def sheet_models(sheet_df: pd.DataFrame) -> list:
+    """Returns model columns of sheet, i.e. every column but field"""
+    return [col for col in sheet_df.columns if col != "field"]
+
+
+def clean_sheet(sheet_df: pd.DataFrame, endpoint: str, models: list) -> tuple:
+    """
+    Returns (clean, other) DataFrames of one sheet's mappings.
+
+    Each (field, model) cell becomes a row linking CDA field (first column)
+    to the property named by the cell's handle path. Unmapped and empty
+    cells are dropped. Cells whose path has no "." or has a "{" aren't 1-1
+    synonyms and go to other as is. In clean, extra handles are lists with
+    the MDB handle of the endpoint or of the node owning the property.
+    """
+    fields = sheet_df.iloc[:, 0]
+    paths = pd.concat([sheet_df[model] for model in models], ignore_index=True)
+    mapping_df = pd.DataFrame({
+        "ent_1_model": "CDA",
+        "ent_1_handle": pd.concat([fields] * len(models), ignore_index=True),
+        "ent_1_extra_handles": endpoint,
+        "ent_2_model": pd.Series(models).repeat(len(fields)).reset_index(drop=True),
+        "ent_2_handle": paths,
+        "ent_2_extra_handles": paths
+    }, columns=MAPPING_COLUMNS)
+    mapping_df = mapping_df[mapping_df["ent_2_extra_handles"].notna()]
+    mapping_df = mapping_df[~mapping_df["ent_2_extra_handles"].isin(UNMAPPED_VALUES)]
+    paths = mapping_df["ent_2_extra_handles"].astype(str)
+    # special cases (i.e., fields w/o 1-1 mapping) go to other df
+    is_other = ~paths.str.contains(".", regex=False) | paths.str.contains("{", regex=False)
+    other_df = mapping_df[is_other].reset_index(drop=True)
+    clean_df = mapping_df[~is_other].reset_index(drop=True)
+    segments = paths[~is_other].str.split(".").reset_index(drop=True)
+
+    clean_df["ent_1_handle"] = clean_df["ent_1_handle"].mask(
+        clean_df["ent_1_handle"] == "identifier.value", "identifier")
+    # property handle is the last path segment and the node owning it the one before
+    # (extra handles only need the handles that uniquely identify the property)
+    clean_df["ent_2_handle"] = segments.str[-1]
+    clean_df["ent_2_extra_handles"] = segments.str[-2].replace(NODE_HANDLES)
+    clean_df["ent_1_extra_handles"] = clean_df["ent_1_extra_handles"].replace(ENDPOINT_HANDLES)
+
+    # format extra handles for both entities to lists
+    # since ent could be relationship, 2 handles may be needed to uniquely id node
+    clean_df["ent_1_extra_handles"] = clean_df["ent_1_extra_handles"].map(lambda handle: [handle])
+    clean_df["ent_2_extra_handles"] = clean_df["ent_2_extra_handles"].map(lambda handle: [handle])
+    return (clean_df, other_df)
+
+
+def sheet_hash(sheet_df: pd.DataFrame, endpoint: str, models: list) -> str:
+    """
+    Returns content hash of a sheet and everything else its clean_sheet output depends on.
+
+    Covers endpoint, models, column names and cell values, plus CACHE_VERSION
+    and the pandas version (cached fragments are pickled DataFrames).
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([
+        CACHE_VERSION, pd.__version__, endpoint,
+        [str(model) for model in models], [str(col) for col in sheet_df.columns]
+    ]).encode())
+    digest.update(sheet_df.to_csv(index=False).encode())
+    return digest.hexdigest()
+
+
+class SheetCache:
+    """
+    Directory of cleaned (clean, other) fragments of sheets, keyed by sheet_hash.
+
+    Keys are content hashes, so one cache can be shared by every workbook
+    (and every re-issue of it). Files are written atomically; unreadable
+    files count as misses.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """Returns cached (clean, other) fragments for key, or None"""
+        try:
+            with open(self.path / f"{key}.pkl", "rb") as cache_file:
+                fragments = pickle.load(cache_file)
+        except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fragments
+
+    def put(self, key: str, fragments: tuple) -> None:
+        """Caches (clean, other) fragments for key"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / f"{key}.pkl.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as cache_file:
+            pickle.dump(fragments, cache_file)
+        os.replace(tmp_path, self.path / f"{key}.pkl")
+
+
+def read_workbook(input_path) -> dict:
+    """
+    Returns sheet name -> sheet DataFrame of every sheet, parsing the workbook once.
+
+    Sheets are keyed by their full name, so sheets of the same endpoint are all kept.
+    """
+    sheets = pd.read_excel(input_path, sheet_name=None)
+    if not sheets:
+        raise RuntimeError(f"Workbook {input_path} has no sheets.")
+    return sheets
+
+
+def clean_workbook(sheets: dict, cache: SheetCache = None) -> tuple:
+    """
+    Returns (clean, other) DataFrames of every sheet of a workbook (see clean_sheet).
+
+    sheets maps sheet names to DataFrames, as returned by read_workbook. Models
+    are the columns of the first sheet. With a cache, only sheets whose content
+    hash isn't cached are cleaned.
+    """
+    models = sheet_models(next(iter(sheets.values())))
+    fragments = []
+    for sheet, sheet_df in sheets.items():
+        endpoint = sheet_endpoint(sheet)
+        if cache is None:
+            fragments.append(clean_sheet(sheet_df, endpoint, models))
+            continue
+        key = sheet_hash(sheet_df, endpoint, models)
+        sheet_fragments = cache.get(key)
+        if sheet_fragments is None:
+            sheet_fragments = clean_sheet(sheet_df, endpoint, models)
+            cache.put(key, sheet_fragments)
+        fragments.append(sheet_fragments)
+    return (
+        pd.concat([clean_df for clean_df, _ in fragments], ignore_index=True),
+        pd.concat([other_df for _, other_df in fragments], ignore_index=True)
+    )
+
+
+def output_paths(input_path: Path) -> tuple:
+    """Returns paths of _clean, _other, _added and _removed CSVs of a workbook, next to it"""
+    return (
+        input_path.with_name(f"{input_path.stem}_clean.csv"),
+        input_path.with_name(f"{input_path.stem}_other.csv"),
+        input_path.with_name(f"{input_path.stem}_added.csv"),
+        input_path.with_name(f"{input_path.stem}_removed.csv")
+    )
+
+
+def mapping_delta(old_csv: str, new_csv: str) -> tuple:
+    """
+    Returns (added, removed) rows between two mapping CSVs.
+
+    Rows are compared as CSV text, counting duplicates. Each list starts with
+    the header and keeps file order, so added rows can be linked with
+    link-ents as they are.
+    """
+    old_rows = list(csv.reader(io.StringIO(old_csv)))
+    new_rows = list(csv.reader(io.StringIO(new_csv)))
+    header = new_rows[0] if new_rows else old_rows[0]
+    old_counts = Counter(map(tuple, old_rows[1:]))
+    new_counts = Counter(map(tuple, new_rows[1:]))
+    added = new_counts - old_counts
+    removed = old_counts - new_counts
+    delta = ([header], [header])
+    for delta_rows, rows, counts in [(delta[0], new_rows, added), (delta[1], old_rows, removed)]:
+        for row in rows[1:]:
+            if counts[tuple(row)] > 0:
+                counts[tuple(row)] -= 1
+                delta_rows.append(row)
+    return delta
+
+
+def write_outputs(df: pd.DataFrame, csv_path: Path, parquet: bool = False) -> bool:
+    """
+    Writes df to csv_path and, if parquet, to a .parquet file next to it.
+
+    Files whose content wouldn't change are left alone (so their modification
+    time too). Returns True if the CSV was written.
+    """
+    csv_text = df.to_csv(index=False, lineterminator="\n")
+    changed = not csv_path.exists() or csv_path.read_text(encoding="UTF-8") != csv_text
+    if changed:
+        csv_path.write_text(csv_text, encoding="UTF-8")
+    if parquet and (changed or not csv_path.with_suffix(".parquet").exists()):
+        try:
+            df.to_parquet(csv_path.with_suffix(".parquet"), index=False)
+        except ImportError as err:
+            raise RuntimeError(
+                "Parquet output needs pyarrow or fastparquet. Please install one "
+                "of them or run without parquet.") from err
+    return changed
+
+
+def process_workbook(
+    input_path,
+    parquet: bool = False,
+    incremental: bool = False,
+    cache_dir: str = None
+    ) -> dict:
+    """
+    Cleans workbook at input_path and writes its CSVs.
+
+    If incremental, cleaned sheets are cached in cache_dir (by default
+    .clean_cda_cache next to the workbook, see SheetCache) and the rows added
+    to and removed from the _clean CSV are written to _added and _removed
+    CSVs. Only the _added CSV is meant for link-ents.
+
+    Returns dict of output paths ('clean', 'other', and 'added' and 'removed',
+    None unless incremental) and counts of 'sheets' and 'recomputed' sheets,
+    plus 'added_rows' and 'removed_rows' if incremental.
+    """
+    input_path = Path(input_path)
+    output_path, other_path, added_path, removed_path = output_paths(input_path)
+    sheets = read_workbook(input_path)
+    cache = None
+    if incremental:
+        cache = SheetCache(cache_dir or input_path.with_name(".clean_cda_cache"))
+    clean_df, other_df = clean_workbook(sheets, cache)
+    summary = {
+        "clean": output_path,
+        "other": other_path,
+        "added": None,
+        "removed": None,
+        "sheets": len(sheets),
+        "recomputed": len(sheets) if cache is None else cache.misses
+    }
+    if cache is not None:
+        old_csv = output_path.read_text(encoding="UTF-8") if output_path.exists() else ""
+        added, removed = mapping_delta(
+            old_csv, clean_df.to_csv(index=False, lineterminator="\n"))
+        for delta_path, delta_rows in [(added_path, added), (removed_path, removed)]:
+            with open(delta_path, "w", encoding="UTF-8", newline="") as delta_file:
+                csv.writer(delta_file).writerows(delta_rows)
+        summary.update({
+            "added": added_path,
+            "removed": removed_path,
+            "added_rows": len(added) - 1,
+            "removed_rows": len(removed) - 1
+        })
+    write_outputs(clean_df, output_path, parquet)
+    write_outputs(other_df, other_path, parquet)
+    return summary
+
+
+def find_workbooks(input_filepath: str) -> list:
+    """
+    Returns sorted workbook paths of a workbook file, a directory or a glob pattern.
+
+    Only files with WORKBOOK_SUFFIXES are kept, so CSV outputs of earlier runs
+    are skipped, as are Excel lock files (~$...).
+    """
+    input_path = Path(input_filepath)
+    if input_path.is_file():
+        return [input_path]
+    if input_path.is_dir():
+        paths = input_path.iterdir()
+    else:
+        paths = (Path(path) for path in glob(input_filepath, recursive=True))
+    workbooks = sorted(
+        path for path in paths
+        if path.is_file() and path.suffix.lower() in WORKBOOK_SUFFIXES
+        and not path.name.startswith("~$")
+    )
+    if not workbooks:
+        raise RuntimeError(f"No workbooks found at {input_filepath}.")
+    return workbooks
+
+
+def process_workbooks(
+    workbooks: list,
+    parquet: bool = False,
+    workers: int = 1,
+    incremental: bool = False,
+    cache_dir: str = None
+    ):
+    """
+    Yields (workbook, process_workbook summary) for each workbook as it's processed.
+
+    With workers > 1, workbooks are processed on a pool of that many processes
+    and yielded in the order they finish.
+    """
+    if workers <= 1 or len(workbooks) <= 1:
+        for workbook in workbooks:
+            yield (workbook, process_workbook(workbook, parquet, incremental, cache_dir))
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(workbooks))) as executor:
+        futures = {
+            executor.submit(process_workbook, workbook, parquet, incremental, cache_dir): workbook
+            for workbook in workbooks
+        }
+        for future in as_completed(futures):
+            yield (futures[future], future.result())
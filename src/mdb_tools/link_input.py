@@ -0,0 +1,182 @@
+"""
+Reads link-ents mapping files (CSV or Parquet) in chunks of typed columns.
+
+Chunks are DataFrames of the mapping columns indexed by row number (from 1),
+with models and handles as strings. Extra handle lists are parsed a column
+at a time, each distinct value once. validate_link_file checks a whole file
+against the entity type before anything is linked and iter_link_batches
+then hands the rows to compile_link_plan a batch at a time, so memory use
+depends on the chunk size rather than the size of the file.
+"""
+
+from ast import literal_eval
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cda_mapping import MAPPING_COLUMNS
+from .link_plan import EXTRA_HANDLES, normalize_entity_type
+
+ENTITIES = ("ent_1", "ent_2")
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def check_columns(path: Path, columns) -> None:
+    """Raises if any mapping column is missing from columns of file at path"""
+    missing = [column for column in MAPPING_COLUMNS if column not in columns]
+    if missing:
+        raise RuntimeError(
+            f"{path} is missing mapping columns {missing}. "
+            f"Expected columns: {MAPPING_COLUMNS}")
+
+
+def read_link_chunks(path, chunk_rows: int = 100000):
+    """
+    Yields mapping file at path (CSV, or Parquet by suffix) in DataFrames of chunk_rows rows.
+
+    Only the mapping columns are kept. Models and handles are strings (empty
+    if missing) and extra handles are left as read: strings from a CSV, or
+    tuples from a Parquet list column. Rows are indexed by row number.
+    """
+    path = Path(path)
+    if path.suffix.lower() in PARQUET_SUFFIXES:
+        chunks = _parquet_chunks(path, chunk_rows)
+    else:
+        check_columns(path, pd.read_csv(path, nrows=0, encoding="UTF-8").columns)
+        chunks = pd.read_csv(
+            path, usecols=MAPPING_COLUMNS, dtype=str, keep_default_na=False,
+            chunksize=chunk_rows, encoding="UTF-8")
+    start = 1
+    for chunk in chunks:
+        chunk = chunk[MAPPING_COLUMNS].copy()
+        chunk.index = pd.RangeIndex(start, start + len(chunk), name="row")
+        start += len(chunk)
+        for ent in ENTITIES:
+            for column in (f"{ent}_model", f"{ent}_handle"):
+                chunk[column] = chunk[column].fillna("").astype(str)
+        yield chunk
+
+
+def _parquet_chunks(path: Path, chunk_rows: int):
+    """Yields DataFrames of the mapping columns of Parquet file, with list columns as tuples"""
+    try:
+        import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+        import pyarrow.types as pa_types # pylint: disable=import-outside-toplevel
+    except ImportError as err:
+        raise RuntimeError(
+            "Parquet input needs pyarrow. Please install it or use a CSV.") from err
+    parquet_file = pq.ParquetFile(path)
+    check_columns(path, parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=MAPPING_COLUMNS):
+        chunk = batch.to_pandas()
+        for column in MAPPING_COLUMNS:
+            if pa_types.is_list(batch.schema.field(column).type):
+                chunk[column] = pd.Series(
+                    [None if handles is None else tuple(handles)
+                     for handles in batch.column(column).to_pylist()],
+                    index=chunk.index, dtype=object)
+        yield chunk
+
+
+def _parse_handles(value):
+    """Returns extra handles as a tuple, or None if value isn't a list of handles"""
+    if isinstance(value, str):
+        try:
+            value = literal_eval(value)
+        except (SyntaxError, ValueError):
+            return None
+    if isinstance(value, (list, tuple)) and all(isinstance(handle, str) for handle in value):
+        return tuple(value)
+    return None
+
+
+def parse_extra_handles(values: pd.Series) -> pd.Series:
+    """
+    Returns column of extra handle lists (e.g. "['node_handle']") parsed into tuples.
+
+    Each distinct value is parsed once. Values that aren't a list of handles
+    are None.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parsed = np.empty(len(uniques), dtype=object)
+    for i, value in enumerate(uniques):
+        parsed[i] = _parse_handles(value)
+    return pd.Series(parsed[codes], index=values.index, dtype=object)
+
+
+def parse_link_chunk(chunk: pd.DataFrame, entity_type: str) -> tuple:
+    """
+    Returns chunk with extra handles parsed, and the error of each invalid row.
+
+    Errors are a Series of messages indexed by row number, holding only the
+    rows that parse_link_row would reject: empty models or handles, extra
+    handles that aren't a list, or the wrong number of extra handles for
+    entity_type.
+    """
+    ent_type = normalize_entity_type(entity_type)
+    parsed = chunk.copy()
+    errors = pd.Series(None, index=chunk.index, dtype=object)
+    for ent in ENTITIES:
+        for column in (f"{ent}_model", f"{ent}_handle"):
+            errors = errors.mask(
+                errors.isna() & chunk[column].str.strip().eq(""), f"{column} is empty")
+        column = f"{ent}_extra_handles"
+        handles = parse_extra_handles(chunk[column])
+        unparsed = handles.isna()
+        errors = errors.mask(
+            errors.isna() & unparsed,
+            f"Couldn't parse {column} " + chunk.loc[unparsed, column].map(repr)
+            + ". Format: a list of handles, e.g. ['node_handle']")
+        if ent_type in EXTRA_HANDLES:
+            count, message = EXTRA_HANDLES[ent_type]
+            wrong_count = ~unparsed & handles.map(len, na_action="ignore").ne(count)
+            errors = errors.mask(errors.isna() & wrong_count, message)
+        parsed[column] = handles
+    return (parsed, errors.dropna())
+
+
+def validate_link_file(
+    path,
+    entity_type: str,
+    chunk_rows: int = 100000,
+    on_error=None
+    ) -> dict:
+    """
+    Checks every row of mapping file against entity_type, reading chunk_rows at a time.
+
+    Raises if the file lacks mapping columns. on_error(row_id, row, error) is
+    called for each invalid row. Returns dict with the number of 'rows', the
+    row numbers of 'invalid' rows and the 'models' named in the file.
+    """
+    summary = {"rows": 0, "invalid": set(), "models": set()}
+    for chunk in read_link_chunks(path, chunk_rows):
+        _, errors = parse_link_chunk(chunk, entity_type)
+        summary["rows"] += len(chunk)
+        summary["invalid"].update(errors.index.tolist())
+        for ent in ENTITIES:
+            summary["models"].update(chunk[f"{ent}_model"].unique().tolist())
+        if on_error is not None:
+            for row_id, message in errors.items():
+                on_error(int(row_id), chunk.loc[row_id].to_dict(), RuntimeError(message))
+    summary["models"].discard("")
+    return summary
+
+
+def iter_link_batches(path, entity_type: str, batch_rows: int = 100000, skip_rows=()):
+    """
+    Yields (row numbers, rows) of mapping file in batches of up to batch_rows rows.
+
+    Rows are dicts like those of csv.DictReader, with extra handles as lists,
+    ready for compile_link_plan(rows, ..., row_ids=row numbers). Rows whose
+    numbers are in skip_rows (e.g. the invalid ones found by
+    validate_link_file) are left out; batches may be empty.
+    """
+    for chunk in read_link_chunks(path, batch_rows):
+        parsed, _ = parse_link_chunk(chunk, entity_type)
+        if skip_rows:
+            parsed = parsed[[row_id not in skip_rows for row_id in parsed.index]]
+        for ent in ENTITIES:
+            column = f"{ent}_extra_handles"
+            parsed[column] = parsed[column].map(list, na_action="ignore")
+        yield (parsed.index.tolist(), parsed.to_dict("records"))
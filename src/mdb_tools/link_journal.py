@@ -0,0 +1,105 @@
+"""
+Journal of a link-ents run, used to resume it after a failure.
+
+The journal is a JSON lines file that is appended to as the run progresses.
+It holds one line describing the run, then one line per entity lookup, per
+rejected row and per group of rows written to the MDB.
+"""
+
+import json
+from pathlib import Path
+
+
+def key_to_json(key: tuple) -> list:
+    """Returns JSON-serializable form of a link_plan entity key"""
+    return [key[0], key[1], key[2], list(key[3])]
+
+
+def key_from_json(value: list) -> tuple:
+    """Returns link_plan entity key from its key_to_json form"""
+    return (value[0], value[1], value[2], tuple(value[3]))
+
+
+class LinkJournal:
+    """
+    Append-only record of entity lookups and per-row status of a link-ents run.
+
+    With resume set, an existing journal is read first: resolutions holds
+    entity key -> (nanoid, found) of every lookup, done_rows the rows already
+    written to the MDB and rejected_rows row -> error of rows that failed.
+    Raises an error if the journal was written for a different run (run_info).
+    A truncated last line, e.g. from a killed process, is ignored.
+    """
+    def __init__(self, path: str, resume: bool = False, run_info: dict = None):
+        self.path = Path(path)
+        self.run_info = run_info or {}
+        self.resolutions = {}
+        self.done_rows = set()
+        self.rejected_rows = {}
+        if resume and self.path.exists():
+            self._load()
+            self.file = open(self.path, "a", encoding="UTF-8", buffering=1)
+        else:
+            self.file = open(self.path, "w", encoding="UTF-8", buffering=1)
+            self._write({"run": self.run_info})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """Closes journal file"""
+        self.file.close()
+
+    def record_resolution(self, key: tuple, nanoid: str, found: bool) -> None:
+        """Records nanoid looked up (found) or generated (not found) for entity key"""
+        self.resolutions[key] = (nanoid, found)
+        self._write({"key": key_to_json(key), "nanoid": nanoid, "found": found})
+
+    def record_reject(self, row_id: int, error: str) -> None:
+        """Records that row failed with given error"""
+        self.rejected_rows[row_id] = error
+        self._write({"row": row_id, "status": "rejected", "error": error})
+
+    def record_done(self, row_ids: list) -> None:
+        """Records that rows have been written to the MDB"""
+        if not row_ids:
+            return
+        self.done_rows.update(row_ids)
+        for row_id in row_ids:
+            self.rejected_rows.pop(row_id, None)
+        self._write({"rows": sorted(row_ids), "status": "done"})
+
+    def _write(self, record: dict) -> None:
+        self.file.write(json.dumps(record) + "\n")
+
+    def _load(self) -> None:
+        with open(self.path, encoding="UTF-8") as journal_file:
+            lines = journal_file.read().splitlines()
+        for line_num, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as err:
+                if line_num == len(lines):
+                    # drop the partial line so appended records start on a new line
+                    self.path.write_text(
+                        "".join(f"{kept}\n" for kept in lines[:-1]), encoding="UTF-8")
+                    break
+                raise RuntimeError(
+                    f"Line {line_num} of journal {self.path} isn't valid JSON") from err
+            if "run" in record:
+                if record["run"] != self.run_info:
+                    raise RuntimeError(
+                        f"Journal {self.path} was written for a different run: {record['run']}. "
+                        "Please use a new journal file or rerun without resume.")
+            elif "key" in record:
+                self.resolutions[key_from_json(record["key"])] = (
+                    record["nanoid"], record["found"])
+            elif record.get("status") == "rejected":
+                self.rejected_rows[record["row"]] = record["error"]
+            elif record.get("status") == "done":
+                self.done_rows.update(record["rows"])
+                for row_id in record["rows"]:
+                    self.rejected_rows.pop(row_id, None)
@@ -0,0 +1,626 @@
+"""
+Compiles synonym mapping rows into a deduplicated plan of MDB writes.
+
+A LinkPlan lists the entities to create, the structural relationships
+(has_src, has_dst, has_property) to ensure and the Concept links to make for
+a whole mapping file. Entities are resolved once no matter how many rows
+they appear in and the plan is applied with a few UNWIND batches instead of
+several transactions per row. Large plans can be split into sub-plans over
+disjoint entities and applied by several worker threads (see apply_parallel).
+"""
+
+import heapq
+import time
+from ast import literal_eval
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bento_meta.objects import Edge, Node, Property, Term
+from neo4j.exceptions import TransientError
+
+ENTITY_TYPES = ["node", "property", "relationship", "term"]
+# number of extra handles that uniquely identify entities of a type, and error if it's wrong
+EXTRA_HANDLES = {
+    "property": (
+        1,
+        "Property entities must have one extra handle "
+        "for unique id. Format: [node_handle]"),
+    "relationship": (
+        2,
+        "Relationship entities must have two extra handles "
+        "for unique id. Format: [src_handle, dst_handle]")
+}
+
+
+def normalize_entity_type(entity_type: str) -> str:
+    """Returns entity type lowercased, with edge as relationship; raises if unknown"""
+    ent_type = entity_type.lower()
+    if ent_type == "edge":
+        ent_type = "relationship"
+    if ent_type not in ENTITY_TYPES:
+        raise RuntimeError(
+            "entity_type must be node, property, relationship, or term")
+    return ent_type
+
+
+def concept_relationship(entity_type: str) -> str:
+    """Returns relationship type linking entities of given type to a Concept"""
+    return "represents" if entity_type == "term" else "has_concept"
+
+
+def entity_key(entity_type: str, model: str, handle: str, extra_handles=()) -> tuple:
+    """
+    Returns hashable key that identifies an entity within a plan.
+
+    For terms, model is the origin_name and handle is the value.
+    """
+    return (entity_type, model, handle, tuple(extra_handles))
+
+
+def make_entity(key: tuple):
+    """Returns bento-meta entity (without nanoid) for given entity key"""
+    entity_type, model, handle, _ = key
+    if entity_type == "term":
+        return Term({"value": handle, "origin_name": model})
+    entity_class = {"node": Node, "property": Property, "relationship": Edge}[entity_type]
+    return entity_class({"handle": handle, "model": model})
+
+
+def parse_link_row(row: dict, entity_type: str) -> dict:
+    """
+    Returns entity keys and structural relationships needed to link one CSV row.
+
+    Result has 'pair' (keys of the two synonymous entities), 'extras' (keys of
+    nodes needed to identify them) and 'edges' ((src_key, relationship, dst_key)
+    tuples to ensure when missing entities are added).
+    """
+    ent_type = normalize_entity_type(entity_type)
+    pair = []
+    extras = []
+    edges = []
+    for ent in ["ent_1", "ent_2"]:
+        model = row[f"{ent}_model"]
+        handle = row[f"{ent}_handle"]
+        extra_handles = row[f"{ent}_extra_handles"]
+        if isinstance(extra_handles, str):
+            try:
+                extra_handles = literal_eval(extra_handles)
+            except (SyntaxError, ValueError) as err:
+                raise RuntimeError(
+                    f"Couldn't parse {ent}_extra_handles {extra_handles!r}. "
+                    "Format: a list of handles, e.g. ['node_handle']") from err
+        if ent_type in EXTRA_HANDLES and len(extra_handles) != EXTRA_HANDLES[ent_type][0]:
+            raise RuntimeError(EXTRA_HANDLES[ent_type][1])
+        if ent_type == "relationship":
+            key = entity_key(ent_type, model, handle, extra_handles)
+            src_key = entity_key("node", model, extra_handles[0])
+            dst_key = entity_key("node", model, extra_handles[1])
+            extras.extend([src_key, dst_key])
+            edges.extend([(key, "has_src", src_key), (key, "has_dst", dst_key)])
+        elif ent_type == "property":
+            key = entity_key(ent_type, model, handle, extra_handles)
+            node_key = entity_key("node", model, extra_handles[0])
+            extras.append(node_key)
+            edges.append((node_key, "has_property", key))
+        else:
+            key = entity_key(ent_type, model, handle)
+        pair.append(key)
+    return {"pair": tuple(pair), "extras": extras, "edges": edges}
+
+
+class UnionFind:
+    """Disjoint sets of hashable items with path halving and union by size"""
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        """Returns representative item of the set containing item, adding it if new"""
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+            return item
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, item_1, item_2) -> None:
+        """Joins the sets containing item_1 and item_2"""
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return
+        if self.size[root_1] < self.size[root_2]:
+            root_1, root_2 = root_2, root_1
+        self.parent[root_2] = root_1
+        self.size[root_1] += self.size[root_2]
+
+    def groups(self) -> list:
+        """Returns list of sets, one per connected component"""
+        groups = defaultdict(set)
+        for item in self.parent:
+            groups[self.find(item)].add(item)
+        return list(groups.values())
+
+
+def chunks(items: list, size: int):
+    """Yields successive lists of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LinkPlan:
+    """
+    Deduplicated mutation plan for linking synonymous entities via Concepts.
+
+    Attributes:
+        resolved: entity key -> (nanoid, found) of every lookup, including
+            lookups for rows that were rejected.
+        errors: entity key -> RuntimeError of lookups that failed.
+        nanoids: entity key -> resolved (or newly made) nanoid.
+        missing: keys of entities not yet in the MDB, created on apply.
+        edges: (src_key, relationship, dst_key) structural relationships.
+        pairs: synonymous entity key pairs, in input order.
+        row_ids: input row number of each pair.
+        concepts: linked entity key -> Concept nanoid chosen for its component.
+        new_concepts: nanoids of Concepts created on apply.
+        concept_links: (entity_key, concept_nanoid) links made on apply.
+        concept_merges: (keep, drop) existing Concepts merged on apply
+            (only if merge_existing is set).
+    """
+    def __init__(
+        self,
+        entity_type: str,
+        add_missing_ent: bool = False,
+        merge_existing: bool = False
+        ):
+        self.entity_type = entity_type.lower()
+        self.add_missing_ent = add_missing_ent
+        self.merge_existing = merge_existing
+        self.rows = 0
+        self.resolved = {}
+        self.errors = {}
+        self.journal = None
+        self.unconfirmed = set()
+        self.nanoids = {}
+        self.missing = set()
+        self.edges = set()
+        self.pairs = []
+        self.row_ids = []
+        self.components = 0
+        self.concepts = {}
+        self.new_concepts = []
+        self.concept_links = []
+        self.concept_merges = []
+
+    def use_journal(self, journal) -> None:
+        """
+        Records lookups in a LinkJournal and reuses the ones it already holds.
+
+        Entities a previous run didn't find may have been created by it before
+        it stopped, so their Concepts are looked up too (see assign_concepts).
+        """
+        self.journal = journal
+        for key, (nano, found) in journal.resolutions.items():
+            self.resolved[key] = (nano, found)
+            if not found:
+                self.unconfirmed.add(key)
+
+    def lookup(self, mdbn, key: tuple) -> tuple:
+        """Returns (nanoid, found) for entity key, looking it up in the MDB only the first time"""
+        if key in self.errors:
+            raise self.errors[key]
+        if key not in self.resolved:
+            try:
+                nano, found = mdbn.resolve_nano(make_entity(key), *key[3])
+            except RuntimeError as err:
+                self.errors[key] = err
+                raise
+            self._record(key, nano, found)
+        return self.resolved[key]
+
+    def resolve(self, mdbn, key: tuple) -> str:
+        """Returns nanoid for entity key, looking it up in the MDB only the first time"""
+        return self.lookup(mdbn, key)[0]
+
+    def resolve_all(self, mdbn, keys, workers: int = 1) -> None:
+        """
+        Looks up every not yet resolved entity key, using up to workers concurrent lookups.
+
+        Lookups only read the MDB, so they can share mdbn (and its driver and
+        nano_cache) across threads. Failed lookups are kept in errors and
+        raised when a row using the key is added.
+        """
+        new_keys = list(dict.fromkeys(
+            key for key in keys if key not in self.resolved and key not in self.errors))
+
+        def resolve_key(key):
+            try:
+                return mdbn.resolve_nano(make_entity(key), *key[3])
+            except RuntimeError as err:
+                return err
+
+        if workers <= 1:
+            results = map(resolve_key, new_keys)
+            for key, result in zip(new_keys, results):
+                self._record_result(key, result)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, result in zip(new_keys, executor.map(resolve_key, new_keys)):
+                self._record_result(key, result)
+
+    def _record_result(self, key: tuple, result) -> None:
+        if isinstance(result, RuntimeError):
+            self.errors[key] = result
+        else:
+            self._record(key, *result)
+
+    def _record(self, key: tuple, nano: str, found: bool) -> None:
+        self.resolved[key] = (nano, found)
+        if self.journal is not None:
+            self.journal.record_resolution(key, nano, found)
+
+    def add_row(self, parsed_row: dict, mdbn, row_id: int = None) -> None:
+        """
+        Adds row parsed by parse_link_row to the plan.
+
+        Raises an error (leaving the plan unchanged) if an entity lookup fails,
+        or if an entity is missing and add_missing_ent is False. That includes
+        the nodes identifying a Property or Edge, so without add_missing_ent
+        the plan never creates nodes.
+        """
+        if row_id is None:
+            row_id = self.rows + 1
+        lookups = {
+            key: self.lookup(mdbn, key)
+            for key in list(parsed_row["pair"]) + parsed_row["extras"]
+        }
+        if not self.add_missing_ent:
+            if any(not found for _, found in lookups.values()):
+                raise RuntimeError(
+                    f"Row {row_id}: One or more of the given entities aren't in the MDB and "
+                    "add_missing_ent is False. Please add the missing entities to the MDB or "
+                    "set add_missing_ent to True.")
+        else:
+            self.edges.update(parsed_row["edges"])
+        for key, (nano, found) in lookups.items():
+            self.nanoids[key] = nano
+            if not found:
+                self.missing.add(key)
+        self.rows += 1
+        self.pairs.append(parsed_row["pair"])
+        self.row_ids.append(row_id)
+
+    def assign_concepts(self, mdbn) -> None:
+        """
+        Groups linked entities into connected components and picks one Concept per component.
+
+        Existing Concepts of every entity are fetched in one query per entity
+        type and joined into the components with a union-find, so chains like
+        A~B, B~C, C~D end up on a single Concept whatever the row order.
+        As in NelsonMDB.link_synonyms, a component uses the first existing
+        Concept of ent_1, else of ent_2, of its first pair (in row order) that
+        has one, or a new Concept if it has none. Entities not yet linked to
+        that Concept get a link. If merge_existing is set, the component
+        instead uses its existing Concept with the lowest nanoid and every
+        other existing Concept in it is merged into that one on apply.
+        """
+        concepts = defaultdict(list)
+        found_by_type = defaultdict(set)
+        for pair in self.pairs:
+            for key in pair:
+                if key not in self.missing or key in self.unconfirmed:
+                    found_by_type[key[0]].add(self.nanoids[key])
+        for ent_type, nanos in found_by_type.items():
+            for record in mdbn.get_concepts_bulk(ent_type, sorted(nanos)):
+                concepts[(ent_type, record["nanoid"])] = list(record["concepts"])
+
+        components = UnionFind()
+        for key_1, key_2 in self.pairs:
+            components.union(("entity", key_1), ("entity", key_2))
+        for key in {key for pair in self.pairs for key in pair}:
+            for concept in concepts[(key[0], self.nanoids[key])]:
+                components.union(("entity", key), ("concept", concept))
+        first_concepts = {}
+        for pair in self.pairs:
+            root = components.find(("entity", pair[0]))
+            if root in first_concepts:
+                continue
+            for key in pair:
+                if concepts[(key[0], self.nanoids[key])]:
+                    first_concepts[root] = concepts[(key[0], self.nanoids[key])][0]
+                    break
+
+        self.concepts = {}
+        self.new_concepts = []
+        self.concept_links = []
+        self.concept_merges = []
+        self.components = 0
+        for members in sorted(components.groups(), key=min):
+            self.components += 1
+            keys = sorted(member[1] for member in members if member[0] == "entity")
+            existing = sorted(member[1] for member in members if member[0] == "concept")
+            if existing and self.merge_existing:
+                concept = existing[0]
+                self.concept_merges.extend((concept, other) for other in existing[1:])
+            elif existing:
+                concept = first_concepts[components.find(("entity", keys[0]))]
+            else:
+                concept = mdbn.make_nano()
+                self.new_concepts.append(concept)
+            for key in keys:
+                self.concepts[key] = concept
+                if concept not in concepts[(key[0], self.nanoids[key])]:
+                    self.concept_links.append((key, concept))
+
+    def write_count(self) -> int:
+        """Returns total number of entity, relationship and merge writes in the plan"""
+        return (
+            len(self.missing) + len(self.new_concepts) + len(self.edges)
+            + len(self.concept_links) + len(self.concept_merges)
+        )
+
+    def partition(self, parts: int) -> list:
+        """
+        Splits plan into at most parts sub-plans that touch disjoint entities and Concepts.
+
+        Entities and Concepts connected by the plan (synonym pair, structural
+        relationship, component Concept, Concept link or merge) end up in the
+        same sub-plan, so sub-plans can be applied concurrently without two
+        transactions writing to the same node. Components are handed out
+        largest first, each to the sub-plan with the fewest members so far.
+        """
+        groups = UnionFind()
+        for key in self.nanoids:
+            groups.find(("entity", key))
+        for concept in self.new_concepts:
+            groups.find(("concept", concept))
+        for key_1, key_2 in self.pairs:
+            groups.union(("entity", key_1), ("entity", key_2))
+        for src_key, _, dst_key in self.edges:
+            groups.union(("entity", src_key), ("entity", dst_key))
+        for key, concept in list(self.concepts.items()) + self.concept_links:
+            groups.union(("entity", key), ("concept", concept))
+        for keep, drop in self.concept_merges:
+            groups.union(("concept", keep), ("concept", drop))
+
+        members_list = sorted(groups.groups(), key=lambda members: (-len(members), min(members)))
+        plans = [
+            LinkPlan(self.entity_type, self.add_missing_ent, self.merge_existing)
+            for _ in range(max(1, min(parts, len(members_list))))
+        ]
+        loads = [(0, index) for index in range(len(plans))]
+        part_of = {}
+        for members in members_list:
+            load, index = heapq.heappop(loads)
+            for member in members:
+                part_of[member] = index
+            heapq.heappush(loads, (load + len(members), index))
+
+        for key, nano in self.nanoids.items():
+            sub_plan = plans[part_of[("entity", key)]]
+            sub_plan.nanoids[key] = nano
+            if key in self.missing:
+                sub_plan.missing.add(key)
+        for edge in self.edges:
+            plans[part_of[("entity", edge[0])]].edges.add(edge)
+        for pair, row_id in zip(self.pairs, self.row_ids):
+            sub_plan = plans[part_of[("entity", pair[0])]]
+            sub_plan.pairs.append(pair)
+            sub_plan.row_ids.append(row_id)
+            sub_plan.rows += 1
+        for key, concept in self.concepts.items():
+            plans[part_of[("entity", key)]].concepts[key] = concept
+        for concept in self.new_concepts:
+            plans[part_of[("concept", concept)]].new_concepts.append(concept)
+        for key, concept in self.concept_links:
+            plans[part_of[("entity", key)]].concept_links.append((key, concept))
+        for keep, drop in self.concept_merges:
+            plans[part_of[("concept", keep)]].concept_merges.append((keep, drop))
+        return plans
+
+    def size(self) -> dict:
+        """Returns number of each kind of write in the plan"""
+        return {
+            "rows": self.rows,
+            "entities": len(self.nanoids),
+            "new_entities": len(self.missing),
+            "structural_relationships": len(self.edges),
+            "components": self.components,
+            "new_concepts": len(self.new_concepts),
+            "concept_links": len(self.concept_links),
+            "concept_merges": len(self.concept_merges)
+        }
+
+    def describe(self) -> list:
+        """Returns list of str describing each write in the plan"""
+        lines = []
+        for key in sorted(self.missing):
+            lines.append(f"CREATE {key[0]} {self._key_str(key)} nanoid={self.nanoids[key]}")
+        for concept in self.new_concepts:
+            lines.append(f"CREATE concept nanoid={concept}")
+        for src_key, relationship, dst_key in sorted(self.edges):
+            lines.append(
+                f"MERGE {src_key[0]} {self._key_str(src_key)} -[:{relationship}]-> "
+                f"{dst_key[0]} {self._key_str(dst_key)}")
+        for key, concept in self.concept_links:
+            lines.append(
+                f"MERGE {key[0]} {self._key_str(key)} "
+                f"-[:{concept_relationship(key[0])}]-> concept {concept}")
+        for keep, drop in self.concept_merges:
+            lines.append(f"MERGE concept {drop} INTO concept {keep}")
+        return lines
+
+    @staticmethod
+    def _key_str(key: tuple) -> str:
+        entity_type, model, handle, extra_handles = key
+        if entity_type == "term":
+            return f"{{value: '{handle}', origin_name: '{model}'}}"
+        extra_str = f" via {list(extra_handles)}" if extra_handles else ""
+        return f"{{handle: '{handle}', model: '{model}'}}{extra_str}"
+
+    def apply(self, mdbn, batch_size: int = 1000) -> None:
+        """
+        Writes plan to MDB with parameterized UNWIND batches of at most batch_size rows.
+
+        Entities and Concepts are created first, then structural relationships,
+        then Concept links, so every MATCH in a later batch finds its nodes.
+        Existing Concepts to merge are merged last, in one transaction.
+        Rows are then marked done in the journal, if the plan has one.
+        """
+        entity_rows = defaultdict(list)
+        for key in sorted(self.missing):
+            entity = make_entity(key)
+            entity.nanoid = self.nanoids[key]
+            entity_rows[key[0]].append(mdbn.get_entity_attrs(entity, output_str=False))
+        entity_rows["concept"].extend({"nanoid": nano} for nano in self.new_concepts)
+        for ent_type, rows in entity_rows.items():
+            for batch in chunks(rows, batch_size):
+                mdbn.merge_entities_bulk(ent_type, batch)
+
+        relationship_pairs = defaultdict(list)
+        for src_key, relationship, dst_key in sorted(self.edges):
+            relationship_pairs[(src_key[0], relationship, dst_key[0])].append(
+                [self.nanoids[src_key], self.nanoids[dst_key]])
+        for key, concept in self.concept_links:
+            relationship_pairs[(key[0], concept_relationship(key[0]), "concept")].append(
+                [self.nanoids[key], concept])
+        for (src_type, relationship, dst_type), pairs in relationship_pairs.items():
+            for batch in chunks(pairs, batch_size):
+                mdbn.merge_relationships_bulk(src_type, relationship, dst_type, batch)
+        if self.concept_merges:
+            mdbn.merge_concepts(self.concept_merges)
+        if self.journal is not None:
+            self.journal.record_done(self.row_ids)
+
+
+def compile_link_plan(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    rows,
+    entity_type: str,
+    mdbn,
+    add_missing_ent: bool = False,
+    merge_existing: bool = False,
+    workers: int = 1,
+    journal=None,
+    on_error=None,
+    row_ids=None
+    ) -> LinkPlan:
+    """
+    Compiles mapping CSV rows (dicts as read by csv.DictReader) into a LinkPlan.
+
+    With workers > 1, all rows are parsed first and their entities are
+    resolved by that many concurrent lookups.
+
+    If a LinkJournal is given, lookups are recorded in it, rows it has as
+    done are skipped and lookups it holds are reused. If on_error is given,
+    a row that can't be parsed or resolved is left out of the plan and
+    on_error(row_id, row, error) is called instead of raising. Rows are
+    numbered from 1 unless row_ids (an iterable of row numbers parallel to
+    rows, e.g. for one batch of a larger file) is given.
+    """
+    plan = LinkPlan(entity_type, add_missing_ent, merge_existing)
+    if journal is not None:
+        plan.use_journal(journal)
+
+    def reject(row_id, row, err):
+        if on_error is None:
+            raise err
+        if journal is not None:
+            journal.record_reject(row_id, str(err))
+        on_error(row_id, row, err)
+
+    def parse_rows():
+        numbered_rows = enumerate(rows, start=1) if row_ids is None else zip(row_ids, rows)
+        for row_id, row in numbered_rows:
+            if journal is not None and row_id in journal.done_rows:
+                continue
+            try:
+                yield row_id, row, parse_link_row(row, entity_type)
+            except RuntimeError as err:
+                reject(row_id, row, err)
+
+    parsed_rows = parse_rows()
+    if workers > 1:
+        parsed_rows = list(parsed_rows)
+        plan.resolve_all(
+            mdbn,
+            (key for *_, parsed in parsed_rows for key in list(parsed["pair"]) + parsed["extras"]),
+            workers=workers)
+    for row_id, row, parsed in parsed_rows:
+        try:
+            plan.add_row(parsed, mdbn, row_id)
+        except RuntimeError as err:
+            reject(row_id, row, err)
+    plan.assign_concepts(mdbn)
+    return plan
+
+
+def apply_with_retry(
+    plan: LinkPlan,
+    mdbn,
+    batch_size: int = 1000,
+    retries: int = 5,
+    backoff: float = 0.5
+    ) -> int:
+    """
+    Applies plan, reapplying it when Neo4j reports a transient error such as a deadlock.
+
+    Every write in a plan is a MERGE, so reapplying a partly applied plan is
+    safe. Waits backoff seconds before the first retry, doubling each time.
+    Returns number of retries needed; reraises after retries failed attempts.
+    """
+    for attempt in range(retries + 1):
+        try:
+            plan.apply(mdbn, batch_size=batch_size)
+            return attempt
+        except TransientError:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+    return retries
+
+
+def apply_parallel(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    plan: LinkPlan,
+    mdbn,
+    workers: int = 4,
+    batch_size: int = 1000,
+    retries: int = 5,
+    progress=None
+    ) -> dict:
+    """
+    Applies plan with a pool of worker threads sharing mdbn's driver.
+
+    The plan is partitioned into up to four sub-plans per worker over
+    disjoint entities and Concepts (see LinkPlan.partition), and each is
+    applied with apply_with_retry. Rows of each applied sub-plan are marked
+    done in the plan's journal, if it has one. If given, progress is called as
+    progress(done_rows, total_rows, elapsed_seconds) after each sub-plan.
+
+    Returns dict of rows, partitions, retries, seconds and rows_per_second.
+    """
+    start = time.perf_counter()
+    sub_plans = plan.partition(workers * 4)
+    done_rows = 0
+    total_retries = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(apply_with_retry, sub_plan, mdbn, batch_size, retries): sub_plan
+            for sub_plan in sub_plans
+        }
+        for future in as_completed(futures):
+            total_retries += future.result()
+            done_rows += futures[future].rows
+            if plan.journal is not None:
+                plan.journal.record_done(futures[future].row_ids)
+            if progress:
+                progress(done_rows, plan.rows, time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+    return {
+        "rows": plan.rows,
+        "partitions": len(sub_plans),
+        "retries": total_retries,
+        "seconds": seconds,
+        "rows_per_second": plan.rows / seconds if seconds else 0.0
+    }
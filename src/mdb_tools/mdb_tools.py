@@ -3,41 +3,138 @@ module docstring goes here
 """
 
 import csv
+import logging
+from contextlib import contextmanager
 
-import en_ner_bionlp13cg_md  # en_core_sci_lg another potential option
 from bento_meta.entity import Entity
 from bento_meta.mdb import read_txn, read_txn_value
 from bento_meta.mdb.writeable import WriteableMDB, write_txn
-from bento_meta.objects import Concept, Predicate, Term
+from bento_meta.objects import Concept, Edge, Node, Predicate, Property, Term
 from nanoid import generate
+from neo4j.exceptions import Neo4jError
 
-# pylint: disable=consider-using-f-string
+from .nano_cache import NanoCache, lookup_key
+from .query_stats import InstrumentedDriver, QueryStats
+from .queries import (LOOKUP_INDEXES, MERGE_CONCEPTS_QRY, PREDICATE_RELATIONSHIP_QRY,
+                      SCAN_OPERATORS, check_extra_handles, checked_relationship_statement,
+                      concepts_bulk_query, edge_nano_statement, entity_attrs,
+                      entity_page_query, entity_statement, get_entity_type, index_name,
+                      index_statement, link_synonyms_statement, merge_entities_bulk_query,
+                      merge_relationships_bulk_query, plan_operators, prop_nano_statement,
+                      query_parms, template_cache_stats)
+from .similarity import SimilarityBackend, SpacyBackend, load_spacy_model
+from .term_blocking import LexicalBlocker
+from .term_index import SYNONYM_FIELDS, TermVectorIndex, heap_top_k, iter_similar_pairs
+from .term_store import TermEmbeddingStore
+from .write_buffer import WriteBuffer
 
-def get_entity_type(entity: Entity):
-    """returns type of entity"""
-    if entity.__class__.__name__.lower() == "edge":
-        return "relationship"
-    return entity.__class__.__name__.lower()
+logger = logging.getLogger(__name__)
+
+def resolve_concept_merges(pairs) -> list:
+    """
+    Returns [keep, drop] nanoid pairs merging each dropped Concept straight into its final Concept.
+
+    Chains like [(A, B), (B, C)] become [[A, B], [A, C]], and pairs whose
+    Concepts were already merged are dropped, so the rows are independent.
+    """
+    merged_into = {}
+
+    def find(nano):
+        while nano in merged_into:
+            nano = merged_into[nano]
+        return nano
+
+    for keep, drop in pairs:
+        if not (keep and drop):
+            raise RuntimeError("each pair must have keep and drop Concept nanoids")
+        keep, drop = find(keep), find(drop)
+        if keep != drop:
+            merged_into[drop] = keep
+    return [[find(drop), drop] for drop in merged_into]
 
 class NelsonMDB(WriteableMDB):
-    """Adds mdb-tools to WriteableMDB"""
-    def __init__(self, uri, user, password):
+    """
+    Adds mdb-tools to WriteableMDB
+
+    If term_store_path is given, Term vectors used by get_term_synonyms are kept
+    in a memory-mapped TermEmbeddingStore at that path and shared across processes.
+    Term similarity is scored by the given SimilarityBackend, by default spaCy
+    vectors of a model loaded on first use (see similarity.SpacyBackend).
+
+    Resolved nanoids are kept in an LRU NanoCache of up to nano_cache_size
+    entries (0 disables it), which can be filled for a whole model with preload.
+
+    Progress is logged to the mdb_tools.mdb_tools logger: bulk writes at INFO
+    and per-entity writes at DEBUG. enable_stats records per-method and
+    per-query counts, time and rows.
+    """
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        uri,
+        user,
+        password,
+        term_store_path: str = None,
+        nano_cache_size: int = 100000,
+        similarity: SimilarityBackend = None
+        ):
         WriteableMDB.__init__(self, uri, user, password)
+        self._init_tools(term_store_path, nano_cache_size, similarity)
+
+    def _init_tools(
+        self,
+        term_store_path: str = None,
+        nano_cache_size: int = 100000,
+        similarity: SimilarityBackend = None
+        ):
+        """Sets up caches, write buffer slot, similarity backend and term index state"""
+        self.nano_cache = NanoCache(max_size=nano_cache_size)
+        self._write_buffer = None
+        self.similarity = similarity or SpacyBackend()
+        self._term_index = None
+        self._term_index_stale = False
+        self._term_blocker = None
+        self.term_store = TermEmbeddingStore(term_store_path) if term_store_path else None
+        self.stats = None
+
+    def enable_stats(self, profile: bool = False) -> QueryStats:
+        """
+        Starts recording calls, wall time and rows per method and per Cypher template.
+
+        Returns the QueryStats object (also at self.stats), which keeps filling
+        until disable_stats. With profile set, every query is run with PROFILE
+        so its db hits are recorded too; this slows queries down, so only use
+        it to investigate. Restarts recording if stats were already enabled.
+        """
+        self.disable_stats()
+        self.stats = QueryStats(profile=profile)
+        if getattr(self, "driver", None) is not None:
+            self.driver = InstrumentedDriver(self.driver, self.stats)
+        self.stats.instrument(self)
+        return self.stats
+
+    def disable_stats(self) -> QueryStats:
+        """Stops recording stats; returns what was recorded, or None if not enabled"""
+        stats = self.stats
+        if stats is None:
+            return None
+        if isinstance(getattr(self, "driver", None), InstrumentedDriver):
+            self.driver = self.driver.driver
+        QueryStats.uninstrument(self)
+        self.stats = None
+        return stats
 
     def get_entity_attrs(self, entity: Entity, output_str: bool = True):
         """
         Returns attributes as str or dict for given entity.
 
         Param output_as_str parm defaults to True and returns a string
-        that is usable in Cypher query as node properties.
+        of node properties for display. Queries don't use it; values are
+        passed as parameters instead (see queries.entity_statement).
 
         If output_as_str = False, return dict of attributes instead,
         which is used as params of function with write_txn decorator.
         """
-        attr_dict = {}
-        for key, val in vars(entity).items():
-            if val and val is not None and key != "pvt":
-                attr_dict[key] = val
+        attr_dict = entity_attrs(entity)
 
         attr_str = "{"
         for key, val in attr_dict.items():
@@ -49,8 +146,147 @@ class NelsonMDB(WriteableMDB):
             return attr_dict
         return attr_str
 
-    @write_txn
-    def detach_delete_entity(self, entity: Entity) -> tuple:
+    def query_template_stats(self) -> dict:
+        """Returns hit rate of the query template cache (see queries.template_cache_stats)"""
+        return template_cache_stats()
+
+    def ensure_indexes(self, await_seconds: int = 300) -> list:
+        """
+        Creates the indexes and uniqueness constraints in queries.LOOKUP_INDEXES if missing.
+
+        Every statement is idempotent, so this can be run on each deploy. If a
+        uniqueness constraint can't be created (e.g. the MDB already holds
+        duplicate nanoids), a plain index is created instead. Waits up to
+        await_seconds for new indexes to come online.
+
+        Returns a dict per index with its name, statement and status: created,
+        exists or fallback (plain index instead of constraint).
+        """
+        report = []
+        with self.driver.session() as session:
+            existing = set(session.run("SHOW INDEXES YIELD name RETURN name").value("name"))
+            for label, properties, unique in LOOKUP_INDEXES:
+                name = index_name(label, properties, unique)
+                qry = index_statement(label, properties, unique)
+                status = "exists" if name in existing else "created"
+                try:
+                    session.run(qry).consume()
+                except Neo4jError as err:
+                    if not unique:
+                        raise
+                    logger.warning(
+                        "Couldn't create constraint %s, creating index instead: %s",
+                        name, err.message)
+                    name = index_name(label, properties)
+                    qry = index_statement(label, properties)
+                    session.run(qry).consume()
+                    status = "fallback"
+                report.append({"name": name, "statement": qry, "status": status})
+            if any(index["status"] != "exists" for index in report):
+                session.run(
+                    "CALL db.awaitIndexes($seconds)", {"seconds": await_seconds}).consume()
+        return report
+
+    def explain_lookups(self) -> list:
+        """
+        Returns EXPLAIN plan summary of each kind of lookup and bulk query NelsonMDB runs.
+
+        Each dict has the lookup name, its query, the plan's operators and scans,
+        the operators that read every node of a label (queries.SCAN_OPERATORS)
+        because no index backs the lookup. Queries are planned, not executed.
+        """
+        report = []
+        with self.driver.session() as session:
+            for name, (qry, parms) in self._lookup_queries():
+                plan = session.run(f"EXPLAIN {qry}", parms).consume().plan
+                operators = plan_operators(plan)
+                report.append({
+                    "name": name,
+                    "query": qry,
+                    "operators": operators,
+                    "scans": [operator for operator in operators if operator in SCAN_OPERATORS]
+                })
+        return report
+
+    def _lookup_queries(self) -> list:
+        """Returns (name, (qry, parms)) of each query explained by explain_lookups"""
+        node = Node({"handle": "handle", "model": "model"})
+        prop = Property({"handle": "handle", "model": "model"})
+        edge = Edge({"handle": "handle", "model": "model"})
+        term = Term({"value": "value", "origin_name": "origin"})
+        term_2 = Term({"value": "value_2", "origin_name": "origin", "nanoid": "nanoid"})
+        concept = Concept({"nanoid": "nanoid"})
+        lookups = [
+            ("node count", entity_statement("count", node)),
+            ("node nanoid", entity_statement("nanoid", node)),
+            ("node concepts", entity_statement("concepts", node)),
+            ("property count", entity_statement("count", prop)),
+            ("property nanoid", prop_nano_statement(prop, "node")[:2]),
+            ("property concepts", entity_statement("concepts", prop)),
+            ("relationship count", entity_statement("count", edge)),
+            ("relationship nanoid", edge_nano_statement(edge, "src", "dst")[:2]),
+            ("relationship concepts", entity_statement("concepts", edge)),
+            ("term count", entity_statement("count", term)),
+            ("term nanoid", entity_statement("nanoid", term)),
+            ("term concepts", entity_statement("term_concepts", term)),
+            ("concept terms", entity_statement("concept_terms", concept)),
+            ("concept predicates", entity_statement("concept_predicates", concept)),
+            ("predicate relationship", (
+                PREDICATE_RELATIONSHIP_QRY, {"pred_nano": "nanoid", "con_nano": "nanoid"})),
+            ("create relationship", checked_relationship_statement(term, concept, "represents")),
+            ("link synonyms", link_synonyms_statement(term, term_2, True, self.make_nano())),
+            ("merge concepts", (MERGE_CONCEPTS_QRY, {"pairs": [["nanoid", "nanoid_2"]]})),
+            ("represents bulk", (
+                merge_relationships_bulk_query("term", "represents", "concept"),
+                {"pairs": [["nanoid", "nanoid_2"]]})),
+        ]
+        for entity_type in ["node", "property", "relationship", "term"]:
+            lookups.append((
+                f"{entity_type} concepts bulk",
+                (concepts_bulk_query(entity_type), {"nanoids": ["nanoid"]})))
+            lookups.append((
+                f"{entity_type} merge bulk",
+                (merge_entities_bulk_query(entity_type), {"rows": [{"nanoid": "nanoid"}]})))
+        return lookups
+
+    @contextmanager
+    def batch(self, flush_size: int = 1000):
+        """
+        Context manager that buffers create_entity, create_relationship and
+        detach_delete_entity writes and sends them in grouped transactions.
+
+        Writes are flushed every flush_size ops, on leaving the block and on
+        flush(). If the block raises, unflushed writes are discarded. Reads in
+        the block (get_entity_count, get_concepts, get_entity_nano) also see
+        pending creates and relationships, so link_synonyms works as usual.
+        Nested batch() calls share the outer buffer.
+
+        with mdbn.batch(flush_size=500):
+            for term_1, term_2 in pairs:
+                mdbn.link_synonyms(term_1, term_2)
+        """
+        if self._write_buffer is not None:
+            yield self._write_buffer
+            return
+        self._write_buffer = WriteBuffer(self, flush_size)
+        try:
+            yield self._write_buffer
+            self._write_buffer.flush()
+        finally:
+            self._write_buffer = None
+
+    def flush(self) -> int:
+        """Writes any writes pending in the current batch; returns number written"""
+        if self._write_buffer is None:
+            return 0
+        return self._write_buffer.flush()
+
+    def _flush_pending_deletes(self) -> None:
+        """Flushes batch if it holds deletes, which pending reads can't account for"""
+        if self._write_buffer is not None and self._write_buffer.has_deletes:
+            self._write_buffer.flush()
+
+    def detach_delete_entity(self, entity: Entity):
         """
         Remove given Entity node from the database.
 
@@ -58,45 +294,54 @@ class NelsonMDB(WriteableMDB):
             Concept, Node, Predicate, Property, Edge, Term
         """
         entity_type = get_entity_type(entity)
-        entity_attr_str = self.get_entity_attrs(entity)
         entity_attr_dict = self.get_entity_attrs(entity, output_str=False)
 
-        qry = (
-            f"MATCH (e:{entity_type} "
-            f"{entity_attr_str}) "
-            "DETACH DELETE e"
-        )
+        self.nano_cache.invalidate(entity_type, entity_attr_dict)
+        if entity_type == "term":
+            self._invalidate_term_index()
+        if self._write_buffer is not None:
+            self._write_buffer.add_delete(entity_type, query_parms(entity_attr_dict))
+            return []
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Removing %s node with properties: %s",
+                entity_type, self.get_entity_attrs(entity))
+        return self._detach_delete_entity(entity)
 
-        print(f"Removing {entity_type} node with with properties: {entity_attr_str}")
-        return (qry, entity_attr_dict)
+    @write_txn
+    def _detach_delete_entity(self, entity: Entity) -> tuple:
+        """Runs DETACH DELETE query for given entity"""
+        return entity_statement("detach_delete", entity)
 
-    @read_txn_value
-    def get_entity_count(self, entity: Entity) -> tuple:
+    def get_entity_count(self, entity: Entity) -> list:
         """
         Returns count of given entity (w/ its properties) found in MDB.
 
         If count = 0, entity with given properties not found in MDB.
         If count = 1, entity with given properties is unique in MDB
         If count > 1, more properties needed to uniquely id entity in MDB.
+
+        In a batch, an entity only created by pending writes counts as found.
         """
+        self._flush_pending_deletes()
+        counts = self._get_entity_count(entity)
+        if self._write_buffer is not None and not counts[0]:
+            pending = self._write_buffer.pending_entities(
+                get_entity_type(entity),
+                query_parms(self.get_entity_attrs(entity, output_str=False)))
+            counts = [len(pending)]
+        return counts
+
+    @read_txn_value
+    def _get_entity_count(self, entity: Entity) -> tuple:
+        """Queries MDB for count of given entity (see get_entity_count)"""
         # if not (term.origin_name and term.value):
         #     raise RuntimeError("arg 'term' must have both origin_name and value")
-        entity_type = get_entity_type(entity)
-        entity_attr_str = self.get_entity_attrs(entity)
-        entity_attr_dict = self.get_entity_attrs(entity, output_str=False)
+        qry, parms = entity_statement("count", entity)
 
-        qry = (
-            f"MATCH (e:{entity_type} {entity_attr_str}) "
-            "RETURN COUNT(e) as entity_count"
-        )
+        return (qry, parms, "entity_count")
 
-        return (qry, entity_attr_dict, "entity_count")
-
-    @write_txn
-    def create_entity(
-        self,
-        entity: Entity
-        ) -> tuple:
+    def create_entity(self, entity: Entity):
         """Adds given Entity node to database"""
         if not entity.nanoid:
             raise RuntimeError(
@@ -104,46 +349,85 @@ class NelsonMDB(WriteableMDB):
                 "entity_name.nanoid = mdb_name.get_or_make_nano(entity_name) AFTER "
                 "declaring some other entity properties is a good way to do this.")
         entity_type = get_entity_type(entity)
-        entity_attr_str = self.get_entity_attrs(entity)
         entity_attr_dict = self.get_entity_attrs(entity, output_str=False)
 
-        qry = (f"MERGE (e:{entity_type} {entity_attr_str})")
+        self.nano_cache.invalidate(entity_type, entity_attr_dict)
+        if entity_type == "term":
+            self._invalidate_term_index()
+        if self._write_buffer is not None:
+            self._write_buffer.add_entity(entity_type, query_parms(entity_attr_dict))
+            return []
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Creating new %s node with properties: %s",
+                entity_type, self.get_entity_attrs(entity))
+        return self._create_entity(entity)
+
+    @write_txn
+    def _create_entity(self, entity: Entity) -> tuple:
+        """Runs MERGE query for given entity"""
+        return entity_statement("merge", entity)
+
+    def get_concepts(self, entity: Entity) -> list:
+        """
+        Returns list of concepts represented by given entity
 
-        print(f"Creating new {entity_type} node with properties: {entity_attr_str}")
-        return (qry, entity_attr_dict)
+        In a batch, Concepts linked by pending relationships are included.
+        """
+        self._flush_pending_deletes()
+        concepts = self._get_concepts(entity)
+        if self._write_buffer is not None:
+            entity_type = get_entity_type(entity)
+            pending = self._write_buffer.pending_concepts(
+                entity_type,
+                query_parms(self.get_entity_attrs(entity, output_str=False)),
+                "represents" if entity_type == "term" else "has_concept")
+            concepts = concepts + [nano for nano in pending if nano not in concepts]
+        return concepts
 
     @read_txn_value
-    def get_concepts(self, entity: Entity):
-        """Returns list of concepts represented by given entity"""
+    def _get_concepts(self, entity: Entity):
+        """Queries MDB for concepts of given entity (see get_concepts)"""
         # if not (term.origin_name and term.value):
         #     raise RuntimeError("arg 'term' must have both origin_name and value")
-        entity_type = get_entity_type(entity)
-        entity_attr_str = self.get_entity_attrs(entity)
-        entity_attr_dict = self.get_entity_attrs(entity, output_str=False)
-
-        if entity_type == "term":
-            qry = (
-                f"MATCH (e:{entity_type} {entity_attr_str}) "
-                "-[:represents]->(c:concept) RETURN c.nanoid AS concept"
-            )
+        if get_entity_type(entity) == "term":
+            qry, parms = entity_statement("term_concepts", entity)
         else:
-            qry = (
-                f"MATCH (e:{entity_type} {entity_attr_str}) "
-                "-[:has_concept]->(c:concept) RETURN c.nanoid AS concept"
-            )
-        return (qry, entity_attr_dict, "concept")
+            qry, parms = entity_statement("concepts", entity)
+        return (qry, parms, "concept")
 
-    @write_txn
     def create_relationship(
         self,
         src_entity: Entity,
         dst_entity: Entity,
         relationship: str
         ):
-        """Adds relationship between given entities in MDB"""
-        # gets number of entities in MDB matching given entity (w/ given properties)
-        ent_1_count = self.get_entity_count(src_entity)[0]
-        ent_2_count = self.get_entity_count(dst_entity)[0]
+        """
+        Adds relationship between given entities in MDB
+
+        Uniqueness of both entities is checked in the same statement that merges
+        the relationship, so this is a single round trip. Nothing is written if
+        either entity is missing or not unique. In a batch, uniqueness is checked
+        up front (counting pending creates) and the relationship is queued.
+        """
+        src_entity_type = get_entity_type(src_entity)
+        dst_entity_type = get_entity_type(dst_entity)
+        for entity in (src_entity, dst_entity):
+            self.nano_cache.invalidate_linked(get_entity_type(entity), entity_attrs(entity))
+
+        if self._write_buffer is not None:
+            ent_1_count = self.get_entity_count(src_entity)[0]
+            ent_2_count = self.get_entity_count(dst_entity)[0]
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Ensuring %s relationship exists between src %s with properties: %s "
+                    "to dst %s with properties: %s",
+                    relationship, src_entity_type, self.get_entity_attrs(src_entity),
+                    dst_entity_type, self.get_entity_attrs(dst_entity))
+            result = self._merge_checked_relationship(src_entity, dst_entity, relationship)[0]
+            ent_1_count = result["src_count"]
+            ent_2_count = result["dst_count"]
         # at least one of the given entities doesn't uniquely id a node in the MDB.
         if (ent_1_count > 1 or ent_2_count > 1):
             raise RuntimeError(
@@ -153,36 +437,62 @@ class NelsonMDB(WriteableMDB):
         if (ent_1_count < 1 or ent_2_count < 1):
             raise RuntimeError(
                 "One or more of the given entities aren't in the MDB.")
-        src_entity_type = get_entity_type(src_entity)
-        dst_entity_type = get_entity_type(dst_entity)
+        if self._write_buffer is not None:
+            self._write_buffer.add_relationship(
+                src_entity_type,
+                query_parms(self.get_entity_attrs(src_entity, output_str=False)),
+                relationship,
+                dst_entity_type,
+                query_parms(self.get_entity_attrs(dst_entity, output_str=False))
+            )
 
-        src_attr_str = self.get_entity_attrs(src_entity)
-        dst_attr_str = self.get_entity_attrs(dst_entity)
+    @write_txn
+    def _merge_checked_relationship(
+        self,
+        src_entity: Entity,
+        dst_entity: Entity,
+        relationship: str
+        ) -> tuple:
+        """Merges relationship if both entities are unique; returns their counts"""
+        return checked_relationship_statement(src_entity, dst_entity, relationship)
 
-        qry = (
-            "MATCH (s:{src_type} {{nanoid: '{src_nano}'}}), "
-            "(d:{dst_type} {{nanoid: '{dst_nano}'}}) "
-            "MERGE (s)-[:{relationship}]->(d)".format(
-                src_type=src_entity_type,
-                src_nano=src_entity.nanoid,
-                dst_type=dst_entity_type,
-                dst_nano=dst_entity.nanoid,
-                relationship=relationship
-            )
-        )
+    @read_txn
+    def get_concepts_bulk(self, entity_type: str, nanoids: list):
+        """
+        Returns records of (nanoid, concepts) for entities of given type and nanoids.
 
-        parms = {
-            "src_type": src_entity_type,
-            "src_nano": src_entity.nanoid,
-            "dst_type": dst_entity_type,
-            "dst_nano": dst_entity.nanoid,
-            "relationship": relationship
-        }
-        print(
-            f"Ensuring {relationship} relationship exists between src {src_entity_type} with "
-            f"properties: {src_attr_str} to dst {dst_entity_type} with properties: {dst_attr_str}"
-        )
-        return(qry, parms)
+        concepts is the list of Concept nanoids each entity represents (terms)
+        or has (other entities); entities without a Concept aren't returned.
+        """
+        return (concepts_bulk_query(entity_type), {"nanoids": nanoids})
+
+    @write_txn
+    def merge_entities_bulk(self, entity_type: str, rows: list):
+        """
+        Ensures entities of given type exist in MDB, in one transaction.
+
+        rows is a list of attribute dicts (as from get_entity_attrs with
+        output_str=False) that must each include a nanoid.
+        """
+        logger.info("Ensuring %d %s nodes exist", len(rows), entity_type)
+        return (merge_entities_bulk_query(entity_type), {"rows": rows})
+
+    @write_txn
+    def merge_relationships_bulk(
+        self,
+        src_type: str,
+        relationship: str,
+        dst_type: str,
+        pairs: list
+        ):
+        """
+        Ensures relationship exists for each [src_nanoid, dst_nanoid] pair, in one transaction.
+        """
+        logger.info(
+            "Ensuring %d %s relationships exist between %s and %s nodes",
+            len(pairs), relationship, src_type, dst_type)
+        qry = merge_relationships_bulk_query(src_type, relationship, dst_type)
+        return (qry, {"pairs": pairs})
 
     def link_synonyms(
         self,
@@ -199,7 +509,57 @@ class NelsonMDB(WriteableMDB):
         If one or both doesn't exist in the MDB and add_missing_ent is True they will be added.
 
         If one or both doesn't uniquely identify a node in the MDB will give error.
+
+        Uniqueness checks, entity creation, picking or creating the Concept and
+        both relationships all happen in one statement (one round trip). In a
+        batch, the same steps run through the buffered reads and writes instead.
         """
+        if self._write_buffer is not None:
+            self._link_synonyms_stepwise(entity_1, entity_2, add_missing_ent)
+            return
+        result = self._link_synonyms_txn(entity_1, entity_2, add_missing_ent)[0]
+        ent_1_count = result["count_1"]
+        ent_2_count = result["count_2"]
+        # at least one of the given entities doesn't uniquely id a node in the MDB.
+        if (ent_1_count > 1 or ent_2_count > 1):
+            raise RuntimeError(
+                "Given entities must uniquely identify nodes in the MDB. Please add "
+                "necessary properties to the entity so that it can be uniquely identified.")
+        # at least one of given entities not found and shouldn't be added
+        if ((ent_1_count < 1 or ent_2_count < 1) and not add_missing_ent):
+            raise RuntimeError(
+                "One or more of the given entities aren't in the MDB and add_missing_ent is False."
+                "Please add the missing entities to the MDB or set add_missing_ent to True.")
+        # a missing entity couldn't be added because it has no nanoid
+        if not result["ok"]:
+            raise RuntimeError(
+                "Entity needs a nanoid before creating - please set valid entity nanoid. "
+                "entity_name.nanoid = mdb_name.get_or_make_nano(entity_name) AFTER "
+                "declaring some other entity properties is a good way to do this.")
+        for entity, ent_count in [(entity_1, ent_1_count), (entity_2, ent_2_count)]:
+            if not ent_count:
+                entity_type = get_entity_type(entity)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Created new %s node with properties: %s",
+                        entity_type, self.get_entity_attrs(entity))
+                self.nano_cache.invalidate(
+                    entity_type, self.get_entity_attrs(entity, output_str=False))
+                if entity_type == "term":
+                    self._invalidate_term_index()
+        # entities are already connected by a concept
+        if result["already_linked"]:
+            logger.debug("Both entities are already connected via Concept %s", result["concept"])
+            return
+        logger.debug("Linked both entities via Concept %s", result["concept"])
+
+    def _link_synonyms_stepwise(
+        self,
+        entity_1: Entity,
+        entity_2: Entity,
+        add_missing_ent: bool = False
+        ):
+        """Runs link_synonyms one read/write at a time, e.g. on a write buffer"""
         # gets number of entities in MDB matching given entity (w/ given properties)
         ent_1_count = self.get_entity_count(entity_1)[0]
         ent_2_count = self.get_entity_count(entity_2)[0]
@@ -222,6 +582,11 @@ class NelsonMDB(WriteableMDB):
         # get any existing concepts and create new concept if none found
         ent_1_concepts = self.get_concepts(entity_1)
         ent_2_concepts = self.get_concepts(entity_2)
+        # entities are already connected by a concept
+        if not set(ent_1_concepts).isdisjoint(set(ent_2_concepts)):
+            concept = set(ent_1_concepts).intersection(set(ent_2_concepts))
+            logger.debug("Both entities are already connected via Concept %s", list(concept)[0])
+            return
         if ent_1_concepts:
             concept = Concept({"nanoid": ent_1_concepts[0]})
         elif ent_2_concepts:
@@ -229,11 +594,6 @@ class NelsonMDB(WriteableMDB):
         else:
             concept = Concept({"nanoid": self.make_nano()})
             self.create_entity(concept)
-        # entities are already connected by a concept
-        if not set(ent_1_concepts).isdisjoint(set(ent_2_concepts)):
-            concept = set(ent_1_concepts).intersection(set(ent_2_concepts))
-            print(f"Both entities are already connected via Concept {list(concept)[0]}")
-            return
         # create specified relationship between each entity and a concept
         if get_entity_type(entity_1) == "term":
             self.create_relationship(entity_1, concept, "represents")
@@ -242,6 +602,16 @@ class NelsonMDB(WriteableMDB):
             self.create_relationship(entity_1, concept, "has_concept")
             self.create_relationship(entity_2, concept, "has_concept")
 
+    @write_txn
+    def _link_synonyms_txn(
+        self,
+        entity_1: Entity,
+        entity_2: Entity,
+        add_missing_ent: bool = False
+        ) -> tuple:
+        """Runs link_synonyms as a single statement; returns counts and Concept"""
+        return link_synonyms_statement(entity_1, entity_2, add_missing_ent, self.make_nano())
+
     def make_nano(self):
         """Generates valid nanoid"""
         return generate(
@@ -249,75 +619,97 @@ class NelsonMDB(WriteableMDB):
             alphabet="abcdefghijkmnopqrstuvwxyzABCDEFGHJKMNPQRSTUVWXYZ0123456789"
         )
 
-    def _get_prop_nano(self, prop: Entity, node_handle: str):
+    def get_entity_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> list:
         """
-        Takes Property and Node entities and returns Property nanoid.
+        Takes an entity and returns its nanoid. If entity requires handles of connected nodes
+        for unique identification (Property or Edge), extra_handle_1 and _2 hold these as str.
+
+        Note: If an entity exists in the MDB with the given properties, but doesn't have an
+        assigned nanoid for some reason, returns [None] instead of [].
 
-        This is used to help uniquely identify a property node in the MDB,
-        which requires a node connected via the has_property relationship.
+        Unique results are cached in nano_cache, so repeat lookups skip the database.
         """
-        qry = (
-            "MATCH (p:property {handle: $prop_handle, model: $prop_model})"
-            "<-[:has_property]-(n:node {handle: $node_handle}) "
-            "RETURN p.nanoid as prop_nano"
-        )
-        parms = {
-            "prop_handle": prop.handle,
-            "prop_model": prop.model,
-            "node_handle": node_handle
-        }
-        return(qry, parms, "prop_nano")
+        key = lookup_key(
+            get_entity_type(entity), entity_attrs(entity), extra_handle_1, extra_handle_2)
+        if key is not None:
+            nano = self.nano_cache.get(key)
+            if nano is not None:
+                return [nano]
+        self._flush_pending_deletes()
+        nano_list = self._get_entity_nano(entity, extra_handle_1, extra_handle_2)
+        if len(nano_list) == 1:
+            self.nano_cache.put(key, nano_list[0])
+        elif (
+            not nano_list and self._write_buffer is not None
+            and get_entity_type(entity) not in ["property", "relationship"]
+        ):
+            # entity may only exist as a pending create in the current batch
+            pending = self._write_buffer.pending_entities(
+                get_entity_type(entity),
+                query_parms(self.get_entity_attrs(entity, output_str=False)))
+            nano_list = [attrs.get("nanoid") for attrs in pending]
+        return nano_list
 
-    def _get_edge_nano(self, edge: Entity, src_handle: str, dst_handle: str):
+    def preload(self, model: str) -> int:
         """
-        Takes Edge, src node handle, and dst Node handle and returns Edge nanoid.
+        Caches nanoids of every node, property and relationship of given model.
 
-        This is used to help uniquely identify an edge node in the MDB,
-        which requires nodes connected via the has_src and has_dst relationships.
+        Uses one query whose records are streamed into nano_cache, so bulk
+        linking jobs can then resolve the model's entities without the database.
+        Keys matching more than one entity are left uncached so lookups still
+        raise the usual non-unique error. Returns number of entries cached.
         """
+        seen = {}
+        ambiguous = set()
+        for record in self._preload_records(model):
+            key = (record["type"], model, record["handle"], tuple(record["extra"]))
+            if key in ambiguous:
+                continue
+            if key in seen and seen[key] != record["nano"] or not record["nano"]:
+                ambiguous.add(key)
+                seen.pop(key, None)
+                self.nano_cache.discard(key)
+                continue
+            seen[key] = record["nano"]
+            self.nano_cache.put(key, record["nano"])
+        return len(seen)
+
+    def _preload_records(self, model: str):
+        """Yields type, handle, extra (handles) and nano of each entity of model (see preload)"""
         qry = (
-            "MATCH (s:node {handle: $src_handle})<-[:has_src]-"
-            "(r:relationship {handle: $edge_handle, model: $edge_model})-"
-            "[:has_dst]->(d:node {handle: $dst_handle}) "
-            "RETURN r.nanoid as edge_nano"
+            "MATCH (n:node {model: $model}) "
+            "RETURN 'node' AS type, n.handle AS handle, [] AS extra, n.nanoid AS nano "
+            "UNION ALL "
+            "MATCH (n:node)-[:has_property]->(p:property {model: $model}) "
+            "RETURN 'property' AS type, p.handle AS handle, [n.handle] AS extra, "
+            "p.nanoid AS nano "
+            "UNION ALL "
+            "MATCH (s:node)<-[:has_src]-(r:relationship {model: $model})-[:has_dst]->(d:node) "
+            "RETURN 'relationship' AS type, r.handle AS handle, [s.handle, d.handle] AS extra, "
+            "r.nanoid AS nano"
         )
-        parms = {
-            "edge_handle": edge.handle,
-            "edge_model": edge.model,
-            "src_handle": src_handle,
-            "dst_handle": dst_handle
-        }
-        return(qry, parms, "edge_nano")
+        with self.driver.session() as session:
+            yield from session.run(qry, {"model": model})
 
     @read_txn_value
-    def get_entity_nano(
+    def _get_entity_nano(
         self,
         entity: Entity,
         extra_handle_1: str = "",
         extra_handle_2: str = ""
         ) -> tuple:
-        """
-        Takes an entity and returns its nanoid. If entity requires handles of connected nodes
-        for unique identification (Property or Edge), extra_handle_1 and _2 hold these as str.
-
-        Note: If an entity exists in the MDB with the given properties, but doesn't have an
-        assigned nanoid for some reason, returns [None] instead of [].
-        """
+        """Queries MDB for nanoid of given entity (see get_entity_nano)"""
         ent_type = get_entity_type(entity)
+        check_extra_handles(ent_type, extra_handle_1, extra_handle_2)
         if ent_type == "property":
-            if not extra_handle_1:
-                raise RuntimeError(
-                    "Property entities require the handle of a node connected via 'has_property' "
-                    "for unique identification. Set 'extra_handle_1' to that node handle str.")
-            return self._get_prop_nano(prop=entity, node_handle=extra_handle_1)
+            return prop_nano_statement(prop=entity, node_handle=extra_handle_1)
         if ent_type == "relationship":
-            if (not extra_handle_1 or not extra_handle_2):
-                raise RuntimeError(
-                    "Edge entities require the handles of a node connected via "
-                    "'has_src' relationship and of a node connected via 'has_dst' "
-                    "relationship for unique identification. Set 'extra_handle_1' to "
-                    "the src handle and 'extra_handle_2' to the dst handle")
-            return self._get_edge_nano(
+            return edge_nano_statement(
                 edge=entity, src_handle=extra_handle_1, dst_handle=extra_handle_2)
 
         ent_count = self.get_entity_count(entity)[0]
@@ -328,23 +720,22 @@ class NelsonMDB(WriteableMDB):
         # if ent_count < 1:
         #     raise RuntimeError("Given entity wasn't found in the MDB")
 
-        ent_attr_str = self.get_entity_attrs(entity)
-        ent_attr_dict = self.get_entity_attrs(entity, output_str=False)
+        qry, parms = entity_statement("nanoid", entity)
 
-        qry = (
-            f"MATCH (e:{ent_type} {ent_attr_str}) "
-            "RETURN e.nanoid as ent_nano"
-        )
-
-        return(qry, ent_attr_dict, "ent_nano")
+        return(qry, parms, "ent_nano")
 
-    def get_or_make_nano(
+    def resolve_nano(
         self,
         entity: Entity,
         extra_handle_1: str = "",
         extra_handle_2: str = ""
-        ) -> str:
-        """Obtains existing entity's nanoid or creates one for new entity."""
+        ) -> tuple:
+        """
+        Returns (nanoid, found) for given entity.
+
+        found is True if the entity is already in the MDB; otherwise nanoid is a
+        newly generated one for creating the entity.
+        """
         nano_list = self.get_entity_nano(entity, extra_handle_1, extra_handle_2)
         if len(nano_list) > 1:
             raise RuntimeError(
@@ -355,51 +746,44 @@ class NelsonMDB(WriteableMDB):
                 "An entity with these properties exists in the MDB but doesn't "
                 "have an assigned nanoid for some reason.")
         elif nano_list:
-            nano = nano_list[0]
-            return nano
-        nano = self.make_nano()
-        return nano
+            return (nano_list[0], True)
+        return (self.make_nano(), False)
+
+    def get_or_make_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> str:
+        """Obtains existing entity's nanoid or creates one for new entity."""
+        return self.resolve_nano(entity, extra_handle_1, extra_handle_2)[0]
 
     @read_txn_value
     def get_term_nanos(self, concept: Concept):
         """Returns list of term nanoids representing given concept"""
         if not concept.nanoid:
             raise RuntimeError("arg 'concept' must have nanoid")
-        entity_attr_str = self.get_entity_attrs(concept)
-        entity_attr_dict = self.get_entity_attrs(concept, output_str=False)
-        qry = (
-            f"MATCH (t:term)-[:represents]->(c:concept {entity_attr_str}) "
-            "RETURN t.nanoid AS term_nano"
-        )
-        return (qry, entity_attr_dict, "term_nano")
+        qry, parms = entity_statement("concept_terms", concept)
+        return (qry, parms, "term_nano")
 
     @read_txn_value
     def get_predicate_nanos(self, concept: Concept):
         """Returns list of predicate nanoids with relationship to given concept"""
         if not concept.nanoid:
             raise RuntimeError("arg 'concept' must have nanoid")
-        entity_attr_str = self.get_entity_attrs(concept)
-        entity_attr_dict = self.get_entity_attrs(concept, output_str=False)
-        qry = (
-            f"MATCH (p:predicate)-[r]->(c:concept {entity_attr_str}) "
-            "RETURN p.nanoid AS pred_nano"
-        )
-        return (qry, entity_attr_dict, "pred_nano")
+        qry, parms = entity_statement("concept_predicates", concept)
+        return (qry, parms, "pred_nano")
 
     @read_txn_value
     def get_predicate_relationship(self, concept: Concept, predicate: Predicate):
         """Returns relationship type between given concept and predicate"""
         if not concept.nanoid or not predicate.nanoid:
             raise RuntimeError("args 'concept' and 'predicate' must have nanoid")
-        qry = (
-            "MATCH (p:predicate {nanoid: $pred_nano})-[r]->(c:concept {nanoid: $con_nano}) "
-            "RETURN TYPE(r) as rel_type"
-        )
         parms = {
             "pred_nano": predicate.nanoid,
             "con_nano": concept.nanoid
         }
-        return(qry, parms, "rel_type")
+        return(PREDICATE_RELATIONSHIP_QRY, parms, "rel_type")
 
     def link_concepts_to_predicate(
         self,
@@ -436,31 +820,39 @@ class NelsonMDB(WriteableMDB):
 
         This function takes two synonymous Concept as bento-meta objects and
         merges them into a single Concept along with any connected Terms and Predicates.
+
+        Every represents, has_concept, has_subject and has_object relationship of
+        concept_2 is moved to concept_1 and concept_2 is deleted in one transaction,
+        so a failure part way leaves both Concepts untouched.
         """
         if not (concept_1.nanoid and concept_2.nanoid):
             raise RuntimeError("args 'concept_1' and 'concept_2' must have nanoid")
-        # get list of terms connected to concept 2
-        c2_term_nanos = self.get_term_nanos(concept_2)
-        c2_terms = []
-        for nano in c2_term_nanos:
-            c2_terms.append(Term({"nanoid": nano}))
-        # get list of predicates w/ relationship type connected to concept 2
-        c2_pred_nanos = self.get_predicate_nanos(concept_2)
-        c2_pred_rels = []
-        for nano in c2_pred_nanos:
-            pred = Predicate({"nanoid": nano})
-            rel = self.get_predicate_relationship(concept_2, pred)[0]
-            c2_pred_rels.append([pred, rel])
-        # delete concept 2
-        self.detach_delete_entity(concept_2)
-        # connect terms from deleted (c2) to remaining concept (c1)
-        for term in c2_terms:
-            self.create_relationship(term, concept_1, "represents")
-        # connect predicates from deleted (c2) to remaining concept (c1)
-        for pred_rel in c2_pred_rels:
-            c2_pred = pred_rel[0]
-            c2_rel = pred_rel[1]
-            self.create_relationship(c2_pred, concept_1, c2_rel)
+        self.merge_concepts([(concept_1.nanoid, concept_2.nanoid)])
+
+    def merge_concepts(self, pairs: list) -> list:
+        """
+        Merges each (keep, drop) pair of Concept nanoids, all in one transaction.
+
+        Chains are resolved first, so [(A, B), (B, C)] merges both B and C into A
+        and a pair whose Concepts were already merged is skipped. Raises an error
+        (and writes nothing) if any Concept isn't in the MDB.
+
+        Returns list of [keep, drop] nanoid pairs that were merged.
+        """
+        resolved = resolve_concept_merges(pairs)
+        if not resolved:
+            return []
+        records = self._merge_concepts_txn(resolved)
+        if len(records) != len(resolved):
+            raise RuntimeError(
+                f"One or more Concepts in {resolved} aren't in the MDB. No Concepts were merged.")
+        logger.info("Merged %d Concepts", len(resolved))
+        return resolved
+
+    @write_txn
+    def _merge_concepts_txn(self, pairs: list) -> tuple:
+        """Moves relationships of each drop Concept to its keep Concept and deletes it"""
+        return (MERGE_CONCEPTS_QRY, {"pairs": pairs})
 
     @read_txn
     def _get_all_terms(self):
@@ -470,50 +862,326 @@ class NelsonMDB(WriteableMDB):
             "RETURN t.value AS term_val, t.origin_name AS term_origin, t.nanoid as term_nano")
         return(qry, {})
 
+    def iter_entities(self, entity_type: str, model: str = None, fetch_size: int = 1000):
+        """
+        Yields attribute dicts of every entity of given type (and model), in nanoid order.
+
+        Entities are read fetch_size at a time with keyset pagination on nanoid,
+        each page in its own short read transaction, so memory stays bounded by
+        fetch_size and the first entities arrive before the last are read.
+        Entities without a nanoid are skipped. Entities written while iterating
+        may or may not be yielded.
+        """
+        if fetch_size < 1:
+            raise RuntimeError("fetch_size must be at least 1")
+        after = ("", -1)
+        while True:
+            page = self._entity_page(entity_type, model, after, fetch_size)
+            for record in page:
+                yield dict(record["props"])
+            if len(page) < fetch_size:
+                return
+            after = (page[-1]["nanoid"], page[-1]["id"])
+
+    @read_txn
+    def _entity_page(self, entity_type: str, model: str, after: tuple, limit: int):
+        """Queries MDB for up to limit entities after (nanoid, id) key (see iter_entities)"""
+        parms = {"after_nano": after[0], "after_id": after[1], "limit": limit}
+        if model:
+            parms["model"] = model
+        return (entity_page_query(entity_type, bool(model)), parms)
+
+    def iter_terms(self, fetch_size: int = 1000):
+        """
+        Yields term_val, term_origin and term_nano dicts (as _get_all_terms) of every Term.
+
+        Terms are paged fetch_size at a time (see iter_entities), so this can
+        feed TermVectorIndex.from_records or TermEmbeddingStore.refresh
+        without holding every record. Terms without a nanoid are skipped.
+        """
+        for attrs in self.iter_entities("term", fetch_size=fetch_size):
+            yield {
+                "term_val": attrs.get("value"),
+                "term_origin": attrs.get("origin_name"),
+                "term_nano": attrs.get("nanoid")
+            }
+
+    def iter_concepts(self, fetch_size: int = 1000):
+        """Yields attribute dicts of every Concept, fetch_size at a time (see iter_entities)"""
+        return self.iter_entities("concept", fetch_size=fetch_size)
+
+    def get_nlp(self):
+        """Returns spaCy model of the similarity backend (or the default), loaded on first use"""
+        if isinstance(self.similarity, SpacyBackend):
+            return self.similarity.nlp
+        return load_spacy_model()
+
+    def set_similarity(self, similarity: SimilarityBackend) -> None:
+        """Switches similarity backend, dropping the TermVectorIndex cached for the old one"""
+        self.similarity = similarity
+        self._term_index = None
+        self._term_blocker = None
+
+    def build_term_index(
+        self,
+        fetch_size: int = 1000,
+        batch_size: int = 256,
+        n_process: int = 1
+        ) -> TermVectorIndex:
+        """
+        Embeds every Term in the database into a TermVectorIndex and caches it.
+
+        Terms are streamed fetch_size at a time (see iter_terms) and embedded
+        by the similarity backend as they arrive; with spaCy, through nlp.pipe
+        in batches of batch_size, on n_process worker processes, with unused
+        pipeline components disabled (see term_index.pipe_vectors). Backends
+        that need fitting (e.g. CharNgramBackend) are fit to every Term value
+        first. The cached index is reused by get_term_synonyms until
+        this is called again or a Term is created/deleted through this object.
+        With a term store, only Terms whose nanoid or value changed since the
+        last refresh are embedded and the index is read back from the
+        memory-mapped store.
+        """
+        backend = self.similarity
+        terms = self.iter_terms(fetch_size=fetch_size)
+        if backend.needs_fit:
+            terms = list(terms)
+            backend.fit(term["term_val"] for term in terms)
+        if self.term_store is None:
+            self._term_index = TermVectorIndex.from_records(
+                terms, backend, batch_size=batch_size, n_process=n_process)
+        else:
+            refresh_counts = self.term_store.refresh(
+                terms, backend, batch_size=batch_size, n_process=n_process)
+            logger.info(
+                "Term store refreshed: %d embedded, %d reused",
+                refresh_counts["embedded"], refresh_counts["reused"])
+            self._term_index = self.term_store.open(backend)
+        self._term_index_stale = False
+        return self._term_index
+
+    def get_term_index(self, refresh: bool = False) -> TermVectorIndex:
+        """
+        Returns cached TermVectorIndex, building it first if needed or refresh is True.
+
+        A term store built with the current similarity backend (e.g. the same
+        spaCy model) is opened as is, without querying the database; pass
+        refresh=True to pick up changed Terms.
+        """
+        if refresh:
+            return self.build_term_index()
+        if self._term_index is None:
+            if (
+                self.term_store is not None
+                and not self._term_index_stale
+                and self.term_store.matches_model(self.similarity)
+            ):
+                self._term_index = self.term_store.open()
+            else:
+                return self.build_term_index()
+        return self._term_index
+
+    def _invalidate_term_index(self):
+        """Drops cached TermVectorIndex after a Term is written through this object"""
+        self._term_index = None
+        self._term_index_stale = True
+
+    def get_term_blocker(self, refresh: bool = False, **blocker_kwargs) -> LexicalBlocker:
+        """
+        Returns LexicalBlocker over the values of the current TermVectorIndex.
+
+        The blocker is rebuilt whenever the index is, or if refresh is True
+        (e.g. to change min_shared or max_key_fraction via blocker_kwargs).
+        """
+        index = self.get_term_index()
+        if refresh or self._term_blocker is None or self._term_blocker[0] is not index:
+            self._term_blocker = (index, LexicalBlocker(index.values, **blocker_kwargs))
+        return self._term_blocker[1]
+
     def get_term_synonyms(
         self,
         term: Term,
-        threshhold: float = 0.8
+        threshhold: float = 0.8,
+        top_k: int = None,
+        refresh_index: bool = False,
+        blocking: bool = False
         ) -> list[dict]:
-        """Returns list of dicts representing Term nodes synonymous to given Term"""
+        """
+        Returns list of dicts representing Term nodes synonymous to given Term
+
+        Similarity is scored by the similarity backend against the cached
+        TermVectorIndex: by default the cosine similarity of spaCy vectors in a
+        single matrix-vector product, or of char n-gram TF-IDF vectors
+        (CharNgramBackend), or the edit similarity of the values
+        (StringDistanceBackend). Results are sorted by similarity; top_k limits
+        how many are returned.
+
+        If blocking is True, only Terms sharing tokens or char trigrams with the
+        given Term are scored (see get_term_blocker and evaluate_term_blocking).
+        """
         if not (term.origin_name and term.value):
             raise RuntimeError("arg 'term' must have both origin_name and value")
-        # load spaCy NER model
-        nlp = en_ner_bionlp13cg_md.load()
-        # get result with all term values, origin_names, and nanoids in the database
-        all_terms_result = self._get_all_terms()
-        # get likely synonyms
-        synonyms = []
-        for record in all_terms_result:
-            # calculate similarity between each Term and input Term
-            term_1 = nlp(term.value)
-            term_2 = nlp(str(record["term_val"])) # type: ignore
-            similarity_score = term_1.similarity(term_2)
-            # if similarity threshold met, add to list of potential synonyms
-            if similarity_score >= threshhold:
-                synonym = {
-                    "value": record["term_val"], # type: ignore
-                    "origin_name": record["term_origin"], # type: ignore
-                    "nanoid": record["term_nano"], # type: ignore
-                    "similarity": similarity_score,
-                    "valid_synonym": 0 # mark 1 if synonym when uploading later
+        index = self.get_term_index(refresh=refresh_index)
+        rows = self.get_term_blocker().candidates(term.value) if blocking else None
+        return [
+            index.synonym(row, similarity)
+            for row, similarity in self.similarity.query(
+                index, term.value, threshhold, top_k, rows)
+        ]
+
+    def iter_term_synonyms(
+        self,
+        terms,
+        threshhold: float = 0.8,
+        top_k: int = 10,
+        refresh_index: bool = False,
+        blocking: bool = False
+        ):
+        """
+        Yields dicts representing Terms synonymous to each of given Terms.
+
+        Each dict is as returned by get_term_synonyms, plus the 'term_value'
+        and 'term_origin_name' of the Term it's a synonym of. A Term's matches
+        stream from the similarity backend a tile at a time through a heap of
+        at most top_k (see term_index.heap_top_k) and are yielded most similar
+        first, so memory doesn't grow with the number of matches however low
+        threshhold is. With top_k None every match is yielded, in index order.
+        terms can be a generator; it's read one Term at a time.
+        """
+        index = self.get_term_index(refresh=refresh_index)
+        blocker = self.get_term_blocker() if blocking else None
+        for term in terms:
+            if not (term.origin_name and term.value):
+                raise RuntimeError("arg 'term' must have both origin_name and value")
+            rows = blocker.candidates(term.value) if blocking else None
+            scored = self.similarity.iter_scores(index, term.value, threshhold, top_k, rows)
+            if top_k is not None:
+                scored = heap_top_k(scored, top_k)
+            for row, similarity in scored:
+                yield {
+                    **index.synonym(row, similarity),
+                    "term_value": term.value,
+                    "term_origin_name": term.origin_name
                 }
-                synonyms.append(synonym)
-        synonyms_sorted = sorted(synonyms, key=lambda d: d["similarity"], reverse=True)
-        return synonyms_sorted
+
+    def evaluate_term_blocking(self, terms: list, threshhold: float = 0.8) -> dict:
+        """
+        Returns recall and candidate reduction of blocking for given Terms.
+
+        Recall is measured against exhaustive scoring at the same threshhold, so
+        blocker settings can be tuned before using get_term_synonyms(blocking=True).
+        """
+        if not self.similarity.vectorized:
+            raise RuntimeError("evaluate_term_blocking needs a vector similarity backend")
+        index = self.get_term_index()
+        values = [term.value for term in terms]
+        queries = list(zip(values, self.similarity.embed(values)))
+        return self.get_term_blocker().evaluate(index, queries, threshhold)
+
+    def iter_synonym_pairs(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        origin_a: str,
+        origin_b: str,
+        threshhold: float = 0.8,
+        k: int = 5,
+        tile_size: int = 1024,
+        refresh_index: bool = False
+        ):
+        """
+        Yields likely synonymous Term pairs between two origins as dicts.
+
+        Every Term of origin_a is scored against every Term of origin_b with a
+        tiled matrix-matrix product (see iter_similar_pairs), keeping at most k
+        matches per origin_a Term (all matches if k is None). If origin_a is
+        origin_b, Terms aren't matched to themselves and each pair is yielded
+        once. Each dict is one row of the CSV format read by link-ents with
+        entity_type 'term', plus the similarity score for review. Needs a
+        vector similarity backend.
+        """
+        if not self.similarity.vectorized:
+            raise RuntimeError("iter_synonym_pairs needs a vector similarity backend")
+        index = self.get_term_index(refresh=refresh_index)
+        rows_a = index.origin_rows(origin_a)
+        rows_b = index.origin_rows(origin_b)
+        symmetric = origin_a == origin_b
+        matrix_a = index.matrix[rows_a]
+        pairs = iter_similar_pairs(
+            matrix_a, matrix_a if symmetric else index.matrix[rows_b],
+            threshhold, k, tile_size, symmetric)
+        for tile_row_a, tile_row_b, similarity in pairs:
+            row_a = rows_a[tile_row_a]
+            row_b = rows_b[tile_row_b]
+            yield {
+                "ent_1_model": index.origins[row_a],
+                "ent_1_handle": index.values[row_a],
+                "ent_1_extra_handles": [],
+                "ent_2_model": index.origins[row_b],
+                "ent_2_handle": index.values[row_b],
+                "ent_2_extra_handles": [],
+                "similarity": similarity
+            }
+
+    def find_synonym_pairs(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        origin_a: str,
+        origin_b: str,
+        threshhold: float = 0.8,
+        k: int = 5,
+        output_path: str = "",
+        tile_size: int = 1024
+        ) -> int:
+        """
+        Writes likely synonymous Term pairs between two origins to CSV at output_path.
+
+        Rows are streamed to the file as they're found, in the format link-ents
+        reads for entity_type 'term' (not the potential_synonyms_to_csv format
+        read by link_term_synonyms_csv). Remove rows that aren't valid synonyms
+        before linking. Returns number of pairs written.
+        """
+        if not output_path:
+            raise RuntimeError("arg 'output_path' must be set")
+        count = 0
+        with open(output_path, "w", encoding="utf8", newline="") as output_file:
+            dict_writer = csv.DictWriter(
+                output_file,
+                fieldnames=[
+                    "ent_1_model", "ent_1_handle", "ent_1_extra_handles",
+                    "ent_2_model", "ent_2_handle", "ent_2_extra_handles", "similarity"
+                ])
+            dict_writer.writeheader()
+            for pair in self.iter_synonym_pairs(origin_a, origin_b, threshhold, k, tile_size):
+                dict_writer.writerow(pair)
+                count += 1
+        return count
 
     def potential_synonyms_to_csv(
         self,
-        input_data: list[dict],
+        input_data,
         output_path: str
-        ) -> None:
-        """Given a list of synonymous Terms as dicts, outputs to CSV file at given output path"""
+        ) -> int:
+        """
+        Given synonymous Terms as dicts, outputs to CSV file at given output path.
+
+        input_data can be a list or a generator such as iter_term_synonyms;
+        rows are written as they're read. Columns are the keys of the first
+        dict, or those of get_term_synonyms results if there are none. Returns
+        number of rows written.
+        """
+        rows = iter(input_data)
+        first = next(rows, None)
+        count = 0
         with open(output_path, "w", encoding="utf8", newline="") as output_file:
             dict_writer = csv.DictWriter(
                 output_file,
-                fieldnames=input_data[0].keys())
+                fieldnames=list(first.keys()) if first is not None else SYNONYM_FIELDS)
             dict_writer.writeheader()
-            dict_writer.writerows(input_data)
+            if first is not None:
+                dict_writer.writerow(first)
+                count += 1
+            for row in rows:
+                dict_writer.writerow(row)
+                count += 1
+        return count
 
     def link_term_synonyms_csv(self, term: Term, csv_path: str) -> None:
         """Given a CSV of syonymous Terms, links each via a Concept node to given Term"""
@@ -0,0 +1,690 @@
+"""
+In-memory MDB backend with the NelsonMDB API.
+
+MemoryMDB keeps the graph in Python dicts, indexed by label, nanoid and
+(model, handle), so mdb_tools can be tested, benchmarked or used to stage a
+curation job without Neo4j. Changes are tracked so they can be written to a
+real MDB afterwards in one transaction (see MemoryMDB.sync).
+"""
+
+import bisect
+import gzip
+import inspect
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from bento_meta.entity import Entity
+from bento_meta.objects import Concept, Predicate
+
+from .mdb_tools import NelsonMDB
+from .nano_cache import KEY_ATTRS
+from .queries import check_extra_handles, get_entity_type, query_parms
+from .similarity import SimilarityBackend
+from .write_buffer import WriteBuffer
+
+
+class MemoryGraph:
+    """
+    Labeled property graph with ordered adjacency and lookup indexes.
+
+    Nodes have an integer id, one label and a dict of properties. Each
+    relationship (src_id, type, dst_id) exists at most once, like the
+    relationships NelsonMDB MERGEs. Nodes are indexed by label, nanoid and
+    (label, model, handle) ((label, origin_name, value) for terms).
+
+    Changes since the graph was loaded (or last marked synced) are kept as
+    created node ids, deleted nodes (label and properties), and created and
+    deleted relationships.
+
+    Changes are made holding lock (a reentrant lock), so several threads can
+    write to the graph; hold it yourself to make several calls atomic.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.labels = {}
+        self.props = {}
+        self.next_id = 0
+        self.by_label = defaultdict(dict)
+        self.by_nanoid = defaultdict(dict)
+        self.by_key = defaultdict(dict)
+        self.out_rels = defaultdict(lambda: defaultdict(dict))
+        self.in_rels = defaultdict(lambda: defaultdict(dict))
+        self.mark_synced()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def mark_synced(self) -> None:
+        """Forgets tracked changes, e.g. after they were written to Neo4j"""
+        with self.lock:
+            self.created = {}
+            self.deleted = []
+            self.rels_created = {}
+            self.rels_deleted = {}
+
+    def has_changes(self) -> bool:
+        """True if there are changes since the graph was loaded or synced"""
+        return bool(self.created or self.deleted or self.rels_created or self.rels_deleted)
+
+    def _index_keys(self, node_id: int) -> list:
+        label = self.labels[node_id]
+        props = self.props[node_id]
+        keys = [(self.by_label, label)]
+        if props.get("nanoid"):
+            keys.append((self.by_nanoid, props["nanoid"]))
+        if label in KEY_ATTRS:
+            model_attr, handle_attr = KEY_ATTRS[label]
+            if props.get(model_attr) is not None and props.get(handle_attr) is not None:
+                keys.append((self.by_key, (label, props[model_attr], props[handle_attr])))
+        return keys
+
+    def create(self, label: str, props: dict, track: bool = True) -> int:
+        """Adds node with given label and properties; returns its id"""
+        with self.lock:
+            node_id = self.next_id
+            self.next_id += 1
+            self.labels[node_id] = label
+            self.props[node_id] = dict(props)
+            for index, key in self._index_keys(node_id):
+                index[key][node_id] = None
+            if track:
+                self.created[node_id] = None
+            return node_id
+
+    def delete(self, node_id: int) -> None:
+        """Removes node and all its relationships (DETACH DELETE)"""
+        with self.lock:
+            for rel, dsts in list(self.out_rels.get(node_id, {}).items()):
+                for dst in list(dsts):
+                    self.delete_relationship(node_id, rel, dst, track=False)
+            for rel, srcs in list(self.in_rels.get(node_id, {}).items()):
+                for src in list(srcs):
+                    self.delete_relationship(src, rel, node_id, track=False)
+            for rel_key in [key for key in self.rels_deleted if node_id in (key[0], key[2])]:
+                del self.rels_deleted[rel_key]
+            for index, key in self._index_keys(node_id):
+                index[key].pop(node_id, None)
+                if not index[key]:
+                    del index[key]
+            if node_id in self.created:
+                del self.created[node_id]
+            else:
+                self.deleted.append((self.labels[node_id], self.props[node_id]))
+            self.out_rels.pop(node_id, None)
+            self.in_rels.pop(node_id, None)
+            del self.labels[node_id]
+            del self.props[node_id]
+
+    def match(self, label: str, attrs: dict) -> list:
+        """
+        Returns ids of nodes with label whose properties equal attrs.
+
+        Like a Cypher pattern with parameters, a None value matches nothing.
+        """
+        if any(val is None for val in attrs.values()):
+            return []
+        model_attr, handle_attr = KEY_ATTRS.get(label, (None, None))
+        if attrs.get("nanoid"):
+            candidates = self.by_nanoid.get(attrs["nanoid"], {})
+        elif model_attr in attrs and handle_attr in attrs:
+            candidates = self.by_key.get((label, attrs[model_attr], attrs[handle_attr]), {})
+        else:
+            candidates = self.by_label.get(label, {})
+        return [
+            node_id for node_id in candidates
+            if self.labels[node_id] == label and all(
+                self.props[node_id].get(key) == val for key, val in attrs.items())
+        ]
+
+    def merge(self, label: str, attrs: dict) -> list:
+        """Returns ids of nodes matching attrs, creating one if there are none (MERGE)"""
+        with self.lock:
+            return self.match(label, attrs) or [self.create(label, attrs)]
+
+    def neighbors(self, node_id: int, relationship: str = None, incoming: bool = False) -> list:
+        """Returns ids of nodes related to node by given (or any) relationship type"""
+        rels = (self.in_rels if incoming else self.out_rels).get(node_id, {})
+        if relationship is not None:
+            return list(rels.get(relationship, {}))
+        return list(dict.fromkeys(other for others in rels.values() for other in others))
+
+    def relationship_types(self, src_id: int, dst_id: int) -> list:
+        """Returns types of relationships from src to dst node"""
+        return [
+            rel for rel, dsts in self.out_rels.get(src_id, {}).items() if dst_id in dsts
+        ]
+
+    def merge_relationship(self, src_id: int, relationship: str, dst_id: int) -> None:
+        """Adds relationship if it doesn't already exist (MERGE)"""
+        with self.lock:
+            if dst_id in self.out_rels[src_id][relationship]:
+                return
+            self.out_rels[src_id][relationship][dst_id] = None
+            self.in_rels[dst_id][relationship][src_id] = None
+            rel_key = (src_id, relationship, dst_id)
+            if rel_key in self.rels_deleted:
+                del self.rels_deleted[rel_key]
+            else:
+                self.rels_created[rel_key] = None
+
+    def delete_relationship(
+        self,
+        src_id: int,
+        relationship: str,
+        dst_id: int,
+        track: bool = True
+        ) -> None:
+        """Removes relationship if it exists"""
+        with self.lock:
+            dsts = self.out_rels.get(src_id, {}).get(relationship, {})
+            if dst_id not in dsts:
+                return
+            del dsts[dst_id]
+            del self.in_rels[dst_id][relationship][src_id]
+            rel_key = (src_id, relationship, dst_id)
+            if rel_key in self.rels_created:
+                del self.rels_created[rel_key]
+            elif track:
+                self.rels_deleted[rel_key] = None
+
+    def dump(self, path: str) -> None:
+        """
+        Writes graph and its tracked changes to a JSON snapshot (gzipped if path ends in .gz).
+
+        Node ids are renumbered from 0 in the snapshot.
+        """
+        with self.lock:
+            self._dump(path)
+
+    def _dump(self, path: str) -> None:
+        new_ids = {node_id: num for num, node_id in enumerate(self.labels)}
+        snapshot = {
+            "nodes": [[self.labels[node_id], self.props[node_id]] for node_id in self.labels],
+            "relationships": [
+                [new_ids[src], rel, new_ids[dst]]
+                for src, rels in self.out_rels.items()
+                for rel, dsts in rels.items()
+                for dst in dsts
+            ],
+            "changes": {
+                "created": [new_ids[node_id] for node_id in self.created],
+                "deleted": self.deleted,
+                "relationships_created": [
+                    [new_ids[src], rel, new_ids[dst]] for src, rel, dst in self.rels_created],
+                "relationships_deleted": [
+                    [new_ids[src], rel, new_ids[dst]] for src, rel, dst in self.rels_deleted],
+            }
+        }
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "wt", encoding="UTF-8") as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str):
+        """Returns graph read from a snapshot written by dump"""
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "rt", encoding="UTF-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        graph = cls()
+        for label, props in snapshot["nodes"]:
+            graph.create(label, props, track=False)
+        for src, rel, dst in snapshot["relationships"]:
+            graph.merge_relationship(src, rel, dst)
+        changes = snapshot.get("changes", {})
+        graph.created = dict.fromkeys(changes.get("created", []))
+        graph.deleted = [tuple(node) for node in changes.get("deleted", [])]
+        graph.rels_created = dict.fromkeys(
+            tuple(rel) for rel in changes.get("relationships_created", []))
+        graph.rels_deleted = dict.fromkeys(
+            tuple(rel) for rel in changes.get("relationships_deleted", []))
+        return graph
+
+    @classmethod
+    def from_records(cls, nodes, relationships):
+        """
+        Returns graph of (key, label, props) nodes and (src_key, type, dst_key) relationships.
+
+        Keys can be any hashable node identifiers, e.g. Neo4j ids. The graph
+        starts with no tracked changes.
+        """
+        graph = cls()
+        ids = {}
+        for key, label, props in nodes:
+            ids[key] = graph.create(label, props, track=False)
+        for src, rel, dst in relationships:
+            if src in ids and dst in ids:
+                graph.merge_relationship(ids[src], rel, ids[dst])
+        graph.mark_synced()
+        return graph
+
+
+def _statement(method):
+    """
+    Wraps MemoryMDB method standing in for one Cypher statement so it runs holding the graph lock.
+
+    Like a Neo4j transaction, the statement then sees and makes its changes
+    atomically when several threads (e.g. apply_parallel workers) share the
+    MemoryMDB. Generators are read to the end while the lock is held.
+    """
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.graph.lock:
+            result = method(self, *args, **kwargs)
+            return list(result) if inspect.isgenerator(result) else result
+    return locked
+
+
+def _group_key(row: tuple) -> tuple:
+    """Returns WriteBuffer group of a (src_type, src_attrs, rel, dst_type, dst_attrs) row"""
+    src_type, src_attrs, relationship, dst_type, dst_attrs = row
+    return (src_type, sorted(src_attrs), relationship, dst_type, sorted(dst_attrs))
+
+
+class MemoryMDB(NelsonMDB):
+    """
+    NelsonMDB backed by a MemoryGraph instead of Neo4j.
+
+    Every NelsonMDB method is available with the same semantics (MERGE
+    behavior, uniqueness errors, Concept linking): only the methods that
+    would run Cypher are replaced by lookups in the graph. Writes happen
+    immediately, so batch() doesn't buffer anything.
+
+    mdbm = MemoryMDB(snapshot_path="mdb.json.gz")  # or MemoryMDB.from_mdb(mdbn)
+    mdbm.link_synonyms(term_1, term_2, add_missing_ent=True)
+    mdbm.dump("mdb.json.gz")
+    mdbm.sync(mdbn)  # writes the changes to Neo4j
+    """
+    # methods that stand in for one Cypher statement (one round trip) each
+    QUERY_METHODS = [
+        "_detach_delete_entity", "_get_entity_count", "_create_entity", "_get_concepts",
+        "_merge_checked_relationship", "get_concepts_bulk", "merge_entities_bulk",
+        "merge_relationships_bulk", "_link_synonyms_txn", "_get_entity_nano",
+        "get_term_nanos", "get_predicate_nanos", "get_predicate_relationship",
+        "_merge_concepts_txn", "_get_all_terms", "_entity_page", "_preload_records"
+    ]
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self,
+        snapshot_path: str = None,
+        graph: MemoryGraph = None,
+        term_store_path: str = None,
+        nano_cache_size: int = 100000,
+        similarity: SimilarityBackend = None
+        ):
+        # no WriteableMDB.__init__, as there's no database to connect to
+        self._init_tools(term_store_path, nano_cache_size, similarity)
+        self._page_keys = {}
+        if graph is None:
+            graph = MemoryGraph.load(snapshot_path) if snapshot_path else MemoryGraph()
+        self.graph = graph
+
+    @classmethod
+    def from_mdb(cls, mdbn, **kwargs):
+        """Returns MemoryMDB holding a copy of every node and relationship of a NelsonMDB"""
+        with mdbn.driver.session() as session:
+            nodes = [
+                (record["id"], record["label"], record["props"])
+                for record in session.run(
+                    "MATCH (n) RETURN id(n) AS id, labels(n)[0] AS label, "
+                    "properties(n) AS props")
+            ]
+            relationships = [
+                (record["src"], record["rel"], record["dst"])
+                for record in session.run(
+                    "MATCH (s)-[r]->(d) RETURN id(s) AS src, type(r) AS rel, id(d) AS dst")
+            ]
+        return cls(graph=MemoryGraph.from_records(nodes, relationships), **kwargs)
+
+    def dump(self, path: str) -> None:
+        """Writes snapshot of the graph (see MemoryGraph.dump)"""
+        self.graph.dump(path)
+
+    def sync(self, mdbn) -> dict:
+        """
+        Writes changes since the graph was loaded (or synced) to a NelsonMDB in one transaction.
+
+        Deleted nodes and relationships are removed first, then created nodes
+        and relationships are merged, each with a few UNWIND statements.
+        Nodes are matched on all their properties. Returns number of each
+        kind of change written. The graph is locked until it's done.
+        """
+        with self.graph.lock:
+            return self._sync(mdbn)
+
+    def _sync(self, mdbn) -> dict:
+        graph = self.graph
+        buffer = WriteBuffer(mdbn, flush_size=None)
+        # sorted so changes sharing a query template are coalesced into one statement
+        for label, props in sorted(
+            graph.deleted, key=lambda node: (node[0], sorted(query_parms(node[1])))
+        ):
+            buffer.add_delete(label, query_parms(props))
+        for row in sorted(
+            (self._relationship_row(*rel) for rel in graph.rels_deleted), key=_group_key
+        ):
+            buffer.add_relationship_delete(*row)
+        for label, props in sorted(
+            ((graph.labels[node_id], query_parms(graph.props[node_id]))
+             for node_id in graph.created),
+            key=lambda node: (node[0], sorted(node[1]))
+        ):
+            buffer.add_entity(label, props)
+        for row in sorted(
+            (self._relationship_row(*rel) for rel in graph.rels_created), key=_group_key
+        ):
+            buffer.add_relationship(*row)
+        changes = {
+            "nodes_deleted": len(graph.deleted),
+            "relationships_deleted": len(graph.rels_deleted),
+            "nodes_created": len(graph.created),
+            "relationships_created": len(graph.rels_created)
+        }
+        buffer.flush()
+        graph.mark_synced()
+        return changes
+
+    def _relationship_row(self, src: int, rel: str, dst: int) -> tuple:
+        graph = self.graph
+        return (
+            graph.labels[src], query_parms(graph.props[src]), rel,
+            graph.labels[dst], query_parms(graph.props[dst])
+        )
+
+    def _match(self, entity: Entity) -> list:
+        """Returns ids of graph nodes matching all attributes of entity"""
+        return self.graph.match(
+            get_entity_type(entity), query_parms(self.get_entity_attrs(entity, output_str=False)))
+
+    def _nano(self, node_id: int):
+        return self.graph.props[node_id].get("nanoid")
+
+    @contextmanager
+    def batch(self, flush_size: int = 1000):
+        """Writes to the graph are immediate, so this is only for NelsonMDB compatibility"""
+        yield None
+
+    def flush(self) -> int:
+        """Nothing to flush; returns 0"""
+        return 0
+
+    def ensure_indexes(self, await_seconds: int = 300) -> list:
+        """MemoryGraph always indexes nanoid and KEY_ATTRS, so there's nothing to create"""
+        return []
+
+    def explain_lookups(self) -> list:
+        """There are no query plans in memory; returns []"""
+        return []
+
+    def _detach_delete_entity(self, entity: Entity) -> list:
+        for node_id in self._match(entity):
+            self.graph.delete(node_id)
+        return []
+
+    def _get_entity_count(self, entity: Entity) -> list:
+        return [len(self._match(entity))]
+
+    def _create_entity(self, entity: Entity) -> list:
+        self.graph.merge(
+            get_entity_type(entity), query_parms(self.get_entity_attrs(entity, output_str=False)))
+        return []
+
+    def _get_concepts(self, entity: Entity) -> list:
+        relationship = "represents" if get_entity_type(entity) == "term" else "has_concept"
+        return [
+            self._nano(concept)
+            for node_id in self._match(entity)
+            for concept in self.graph.neighbors(node_id, relationship)
+            if self.graph.labels[concept] == "concept"
+        ]
+
+    def _merge_checked_relationship(
+        self,
+        src_entity: Entity,
+        dst_entity: Entity,
+        relationship: str
+        ) -> list:
+        srcs = self._match(src_entity)
+        dsts = self._match(dst_entity)
+        if len(srcs) == 1 and len(dsts) == 1:
+            self.graph.merge_relationship(srcs[0], relationship, dsts[0])
+        return [{"src_count": len(srcs), "dst_count": len(dsts)}]
+
+    def get_concepts_bulk(self, entity_type: str, nanoids: list) -> list:
+        relationship = "represents" if entity_type == "term" else "has_concept"
+        records = {}
+        for nano in nanoids:
+            for node_id in self.graph.match(entity_type, {"nanoid": nano}):
+                for concept in self.graph.neighbors(node_id, relationship):
+                    if self.graph.labels[concept] == "concept":
+                        records.setdefault(nano, []).append(self._nano(concept))
+        return [{"nanoid": nano, "concepts": concepts} for nano, concepts in records.items()]
+
+    def merge_entities_bulk(self, entity_type: str, rows: list) -> list:
+        for row in rows:
+            if not self.graph.match(entity_type, {"nanoid": row["nanoid"]}):
+                self.graph.create(entity_type, query_parms(row))
+        return []
+
+    def merge_relationships_bulk(
+        self,
+        src_type: str,
+        relationship: str,
+        dst_type: str,
+        pairs: list
+        ) -> list:
+        for src_nano, dst_nano in pairs:
+            for src in self.graph.match(src_type, {"nanoid": src_nano}):
+                for dst in self.graph.match(dst_type, {"nanoid": dst_nano}):
+                    self.graph.merge_relationship(src, relationship, dst)
+        return []
+
+    def _link_synonyms_txn(
+        self,
+        entity_1: Entity,
+        entity_2: Entity,
+        add_missing_ent: bool = False
+        ) -> list:
+        """Does what the link_synonyms statement does (see queries.link_synonyms_query)"""
+        graph = self.graph
+        type_1 = get_entity_type(entity_1)
+        type_2 = get_entity_type(entity_2)
+        parms_1 = query_parms(self.get_entity_attrs(entity_1, output_str=False))
+        parms_2 = query_parms(self.get_entity_attrs(entity_2, output_str=False))
+        relationship = "represents" if type_1 == "term" else "has_concept"
+        count_1 = len(graph.match(type_1, parms_1))
+        count_2 = len(graph.match(type_2, parms_2))
+        create_1 = bool(add_missing_ent and entity_1.nanoid)
+        create_2 = bool(add_missing_ent and entity_2.nanoid)
+        ok = (
+            count_1 <= 1 and count_2 <= 1
+            and (count_1 == 1 or create_1) and (count_2 == 1 or create_2)
+        )
+        if ok and count_1 == 0:
+            graph.create(type_1, parms_1)
+        if ok and count_2 == 0:
+            # merged, as the second entity may be the first one just created
+            graph.merge(type_2, parms_2)
+        new_concept = self.make_nano()
+        records = []
+        for node_1 in graph.match(type_1, parms_1) or [None]:
+            for node_2 in graph.match(type_2, parms_2) or [None]:
+                concepts_1 = self._concept_nanos(node_1, relationship)
+                concepts_2 = self._concept_nanos(node_2, relationship)
+                shared = [nano for nano in concepts_1 if nano in concepts_2]
+                concept = (concepts_1 or concepts_2 or [new_concept])[0]
+                if ok and not shared:
+                    concept_id = graph.merge("concept", {"nanoid": concept})[0]
+                    graph.merge_relationship(node_1, relationship, concept_id)
+                    graph.merge_relationship(node_2, relationship, concept_id)
+                records.append({
+                    "count_1": count_1,
+                    "count_2": count_2,
+                    "ok": ok,
+                    "concept": shared[0] if shared else concept,
+                    "already_linked": bool(shared)
+                })
+        return records
+
+    def _concept_nanos(self, node_id, relationship: str) -> list:
+        if node_id is None:
+            return []
+        return [
+            self._nano(concept) for concept in self.graph.neighbors(node_id, relationship)
+            if self.graph.labels[concept] == "concept"
+        ]
+
+    def _get_entity_nano(
+        self,
+        entity: Entity,
+        extra_handle_1: str = "",
+        extra_handle_2: str = ""
+        ) -> list:
+        ent_type = get_entity_type(entity)
+        check_extra_handles(ent_type, extra_handle_1, extra_handle_2)
+        if ent_type == "property":
+            return [
+                self._nano(prop)
+                for prop in self.graph.match(
+                    "property", {"handle": entity.handle, "model": entity.model})
+                for node in self.graph.neighbors(prop, "has_property", incoming=True)
+                if self._is_node(node, extra_handle_1)
+            ]
+        if ent_type == "relationship":
+            return [
+                self._nano(edge)
+                for edge in self.graph.match(
+                    "relationship", {"handle": entity.handle, "model": entity.model})
+                for src in self.graph.neighbors(edge, "has_src")
+                if self._is_node(src, extra_handle_1)
+                for dst in self.graph.neighbors(edge, "has_dst")
+                if self._is_node(dst, extra_handle_2)
+            ]
+        if self.get_entity_count(entity)[0] > 1:
+            raise RuntimeError(
+                    "Given entities must uniquely identify nodes in the MDB. Please add "
+                    "necesary properties to the entity so that it can be uniquely identified.")
+        return [self._nano(node_id) for node_id in self._match(entity)]
+
+    def _is_node(self, node_id: int, handle: str) -> bool:
+        return (
+            self.graph.labels[node_id] == "node"
+            and self.graph.props[node_id].get("handle") == handle
+        )
+
+    def _preload_records(self, model: str):
+        graph = self.graph
+        for node_id in graph.match("node", {"model": model}):
+            yield {"type": "node", "handle": graph.props[node_id].get("handle"),
+                   "extra": [], "nano": self._nano(node_id)}
+        for prop in graph.match("property", {"model": model}):
+            for node in graph.neighbors(prop, "has_property", incoming=True):
+                if graph.labels[node] == "node":
+                    yield {"type": "property", "handle": graph.props[prop].get("handle"),
+                           "extra": [graph.props[node].get("handle")], "nano": self._nano(prop)}
+        for edge in graph.match("relationship", {"model": model}):
+            for src in graph.neighbors(edge, "has_src"):
+                for dst in graph.neighbors(edge, "has_dst"):
+                    if graph.labels[src] == "node" and graph.labels[dst] == "node":
+                        yield {
+                            "type": "relationship",
+                            "handle": graph.props[edge].get("handle"),
+                            "extra": [graph.props[src].get("handle"),
+                                      graph.props[dst].get("handle")],
+                            "nano": self._nano(edge)
+                        }
+
+    def get_term_nanos(self, concept: Concept) -> list:
+        """Returns list of term nanoids representing given concept"""
+        if not concept.nanoid:
+            raise RuntimeError("arg 'concept' must have nanoid")
+        return [
+            self._nano(term)
+            for node_id in self._match(concept)
+            for term in self.graph.neighbors(node_id, "represents", incoming=True)
+            if self.graph.labels[term] == "term"
+        ]
+
+    def get_predicate_nanos(self, concept: Concept) -> list:
+        """Returns list of predicate nanoids with relationship to given concept"""
+        if not concept.nanoid:
+            raise RuntimeError("arg 'concept' must have nanoid")
+        return [
+            self._nano(pred)
+            for node_id in self._match(concept)
+            for pred in self.graph.neighbors(node_id, incoming=True)
+            if self.graph.labels[pred] == "predicate"
+        ]
+
+    def get_predicate_relationship(self, concept: Concept, predicate: Predicate) -> list:
+        """Returns relationship type between given concept and predicate"""
+        if not concept.nanoid or not predicate.nanoid:
+            raise RuntimeError("args 'concept' and 'predicate' must have nanoid")
+        return [
+            rel
+            for pred in self.graph.match("predicate", {"nanoid": predicate.nanoid})
+            for con in self.graph.match("concept", {"nanoid": concept.nanoid})
+            for rel in self.graph.relationship_types(pred, con)
+        ]
+
+    def _merge_concepts_txn(self, pairs: list) -> list:
+        """Does what queries.MERGE_CONCEPTS_QRY does"""
+        graph = self.graph
+        if any(
+            not graph.match("concept", {"nanoid": keep})
+            or not graph.match("concept", {"nanoid": drop})
+            for keep, drop in pairs
+        ):
+            return []
+        moved_rels = [("represents", "term"), ("has_concept", None),
+                      ("has_subject", "predicate"), ("has_object", "predicate")]
+        records = []
+        for keep, drop in pairs:
+            for concept_1 in graph.match("concept", {"nanoid": keep}):
+                for concept_2 in graph.match("concept", {"nanoid": drop}):
+                    moved = 0
+                    for relationship, label in moved_rels:
+                        for src in graph.neighbors(concept_2, relationship, incoming=True):
+                            if label is None or graph.labels[src] == label:
+                                graph.merge_relationship(src, relationship, concept_1)
+                                moved += 1
+                    graph.delete(concept_2)
+                    records.append({"concept": keep, "dropped": drop, "moved": moved})
+        return records
+
+    def _entity_page(self, entity_type: str, model: str, after: tuple, limit: int) -> list:
+        # (nanoid, id) keys are sorted once per scan, when its first page is read
+        if after == ("", -1) or (entity_type, model) not in self._page_keys:
+            self._page_keys[(entity_type, model)] = sorted(
+                (self.graph.props[node_id]["nanoid"], node_id)
+                for node_id in self.graph.by_label.get(entity_type, {})
+                if self.graph.props[node_id].get("nanoid")
+                and (not model or self.graph.props[node_id].get("model") == model)
+            )
+        keys = self._page_keys[(entity_type, model)]
+        records = []
+        for pos in range(bisect.bisect_right(keys, after), len(keys)):
+            if len(records) == limit:
+                break
+            nanoid, node_id = keys[pos]
+            props = self.graph.props.get(node_id)
+            # skip nodes deleted or renamed since the scan started
+            if props is not None and props.get("nanoid") == nanoid:
+                records.append({"nanoid": nanoid, "id": node_id, "props": dict(props)})
+        return records
+
+    def _get_all_terms(self) -> list:
+        return [
+            {
+                "term_val": self.graph.props[node_id].get("value"),
+                "term_origin": self.graph.props[node_id].get("origin_name"),
+                "term_nano": self._nano(node_id)
+            }
+            for node_id in self.graph.by_label.get("term", {})
+        ]
+
+
+for _name in MemoryMDB.QUERY_METHODS:
+    setattr(MemoryMDB, _name, _statement(getattr(MemoryMDB, _name)))
@@ -0,0 +1,173 @@
+"""
+LRU cache of resolved entity nanoids used by NelsonMDB.
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+
+# attributes that identify each entity type in nanoid lookups
+KEY_ATTRS = {
+    "node": ("model", "handle"),
+    "property": ("model", "handle"),
+    "relationship": ("model", "handle"),
+    "term": ("origin_name", "value"),
+}
+# entity types whose keys hold handles of linked nodes, so new relationships can change them
+LINKED_KEY_TYPES = ("property", "relationship")
+
+
+def nano_cache_key(entity_type: str, attrs: dict, extra_handles=()) -> tuple:
+    """
+    Returns (entity type, model, handle, extra handles) key for a nanoid lookup.
+
+    For terms, origin_name and value stand in for model and handle. Returns
+    None if the lookup can't be cached, i.e. the entity type isn't cacheable or
+    a node/term lookup also filters on attributes besides the identifying ones.
+    """
+    if entity_type not in KEY_ATTRS:
+        return None
+    model_attr, handle_attr = KEY_ATTRS[entity_type]
+    if not (attrs.get(model_attr) and attrs.get(handle_attr)):
+        return None
+    if entity_type in ["node", "term"]:
+        if set(attrs) - {model_attr, handle_attr, "nanoid"}:
+            return None
+    return (entity_type, attrs[model_attr], attrs[handle_attr], tuple(extra_handles))
+
+
+def lookup_key(
+    entity_type: str,
+    attrs: dict,
+    extra_handle_1: str = "",
+    extra_handle_2: str = ""
+    ) -> tuple:
+    """Returns key of a get_entity_nano lookup, or None if it's not cacheable"""
+    extra_handles = ()
+    if entity_type == "property":
+        if not extra_handle_1:
+            return None
+        extra_handles = (extra_handle_1,)
+    elif entity_type == "relationship":
+        if not (extra_handle_1 and extra_handle_2):
+            return None
+        extra_handles = (extra_handle_1, extra_handle_2)
+    if attrs.get("nanoid"):
+        return None
+    return nano_cache_key(entity_type, attrs, extra_handles)
+
+
+class NanoCache:
+    """
+    Least-recently-used map from nano_cache_key keys to nanoids.
+
+    Only lookups that found exactly one entity are cached. Entries can be
+    invalidated by nanoid or by (entity type, model, handle), which covers
+    every extra-handle variant of a Property or Edge. All operations are
+    guarded by a lock, so one cache can be shared by worker threads.
+    """
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.by_nano = defaultdict(set)
+        self.by_handle = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key: tuple):
+        """Returns cached nanoid for key, or None"""
+        with self.lock:
+            if key is None or key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key: tuple, nanoid: str) -> None:
+        """Caches nanoid for key, evicting least recently used entries when full"""
+        if key is None or not nanoid or not self.max_size:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = nanoid
+            self.by_nano[nanoid].add(key)
+            self.by_handle[key[:3]].add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def discard(self, key: tuple) -> None:
+        """Drops entry for key if cached"""
+        with self.lock:
+            self._remove(key)
+
+    def discard_type(self, entity_type: str) -> None:
+        """Drops every entry of given entity type"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == entity_type]:
+                self._remove(key)
+
+    def invalidate(self, entity_type: str, attrs: dict) -> None:
+        """
+        Drops entries that may refer to an entity with given attributes.
+
+        Uses nanoid if present, then (entity type, model, handle). Clears the
+        whole cache if attrs have neither.
+        """
+        model_attr, handle_attr = KEY_ATTRS.get(entity_type, ("model", "handle"))
+        with self.lock:
+            keys = set()
+            if attrs.get("nanoid"):
+                keys.update(self.by_nano.get(attrs["nanoid"], ()))
+            if attrs.get(model_attr) and attrs.get(handle_attr):
+                keys.update(self.by_handle.get(
+                    (entity_type, attrs[model_attr], attrs[handle_attr]), ()))
+            elif not attrs.get("nanoid"):
+                self.clear()
+                return
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_linked(self, entity_type: str, attrs: dict) -> None:
+        """
+        Drops entries of a Property or Edge that was just linked.
+
+        Their lookups match on handles of linked nodes (e.g. a Property's node
+        via has_property), so a new relationship can change what they resolve to.
+        Entities given without model and handle (e.g. by nanoid) drop every
+        entry of their type, as any cached lookup may now match them.
+        """
+        if entity_type not in LINKED_KEY_TYPES:
+            return
+        if attrs.get("model") and attrs.get("handle"):
+            self.invalidate(entity_type, attrs)
+        else:
+            self.discard_type(entity_type)
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        with self.lock:
+            self.entries.clear()
+            self.by_nano.clear()
+            self.by_handle.clear()
+
+    def stats(self) -> dict:
+        """Returns size, hits and misses of the cache"""
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key: tuple) -> None:
+        nanoid = self.entries.pop(key, None)
+        if nanoid is None:
+            return
+        self.by_nano[nanoid].discard(key)
+        if not self.by_nano[nanoid]:
+            del self.by_nano[nanoid]
+        self.by_handle[key[:3]].discard(key)
+        if not self.by_handle[key[:3]]:
+            del self.by_handle[key[:3]]
@@ -0,0 +1,488 @@
+"""
+Parameterized Cypher templates used by NelsonMDB and AsyncNelsonMDB.
+
+Entity property values are always passed as $parameters, never rendered into
+the query text, so every entity with the same type and set of attribute keys
+shares one query string (and one Neo4j query plan). Rendered templates are
+cached per (template, entity type, attribute keys). The *_statement functions
+bind a template to given entities, returning (qry, parms) for either client.
+"""
+
+from functools import lru_cache
+
+from bento_meta.entity import Entity
+
+# {e} is replaced by the parameterized pattern of the entity bound to variable e
+ENTITY_TEMPLATES = {
+    "count": "MATCH {e} RETURN COUNT(e) as entity_count",
+    "merge": "MERGE {e}",
+    "detach_delete": "MATCH {e} DETACH DELETE e",
+    "nanoid": "MATCH {e} RETURN e.nanoid as ent_nano",
+    "term_concepts": "MATCH {e}-[:represents]->(c:concept) RETURN c.nanoid AS concept",
+    "concepts": "MATCH {e}-[:has_concept]->(c:concept) RETURN c.nanoid AS concept",
+    "concept_terms": "MATCH (t:term)-[:represents]->{e} RETURN t.nanoid AS term_nano",
+    "concept_predicates": "MATCH (p:predicate)-[r]->{e} RETURN p.nanoid AS pred_nano",
+}
+
+# rewires every relationship into each dropped Concept onto its kept Concept,
+# then deletes the dropped Concept; $pairs is a list of [keep_nanoid, drop_nanoid].
+# Nothing is written (and no rows returned) unless every Concept exists.
+MERGE_CONCEPTS_QRY = (
+    "UNWIND $pairs AS pair "
+    "OPTIONAL MATCH (k:concept {nanoid: pair[0]}) "
+    "OPTIONAL MATCH (d:concept {nanoid: pair[1]}) "
+    "WITH collect(CASE WHEN k IS NULL OR d IS NULL THEN pair END) AS missing "
+    "UNWIND CASE WHEN size(missing) = 0 THEN $pairs ELSE [] END AS pair "
+    "MATCH (c1:concept {nanoid: pair[0]}) "
+    "MATCH (c2:concept {nanoid: pair[1]}) "
+    "OPTIONAL MATCH (t:term)-[:represents]->(c2) "
+    "WITH c1, c2, collect(t) AS terms "
+    "OPTIONAL MATCH (e)-[:has_concept]->(c2) "
+    "WITH c1, c2, terms, collect(e) AS ents "
+    "OPTIONAL MATCH (s:predicate)-[:has_subject]->(c2) "
+    "WITH c1, c2, terms, ents, collect(s) AS subjects "
+    "OPTIONAL MATCH (o:predicate)-[:has_object]->(c2) "
+    "WITH c1, c2, terms, ents, subjects, collect(o) AS objects "
+    "FOREACH (t IN terms | MERGE (t)-[:represents]->(c1)) "
+    "FOREACH (e IN ents | MERGE (e)-[:has_concept]->(c1)) "
+    "FOREACH (s IN subjects | MERGE (s)-[:has_subject]->(c1)) "
+    "FOREACH (o IN objects | MERGE (o)-[:has_object]->(c1)) "
+    "WITH c1, c2, size(terms) + size(ents) + size(subjects) + size(objects) AS moved, "
+    "c2.nanoid AS dropped "
+    "DETACH DELETE c2 "
+    "RETURN c1.nanoid AS concept, dropped, moved"
+)
+
+# relationship type between predicate $pred_nano and concept $con_nano
+PREDICATE_RELATIONSHIP_QRY = (
+    "MATCH (p:predicate {nanoid: $pred_nano})-[r]->(c:concept {nanoid: $con_nano}) "
+    "RETURN TYPE(r) as rel_type"
+)
+
+# attribute values that can be sent as Cypher parameters
+PARAM_TYPES = (str, int, float, bool)
+
+# (label, properties, unique) of the indexes behind NelsonMDB lookups. Concept,
+# predicate and term nanoids are unique; node, property and relationship
+# nanoids may repeat across model versions, so those only get plain indexes.
+LOOKUP_INDEXES = (
+    ("concept", ("nanoid",), True),
+    ("predicate", ("nanoid",), True),
+    ("term", ("nanoid",), True),
+    ("node", ("nanoid",), False),
+    ("property", ("nanoid",), False),
+    ("relationship", ("nanoid",), False),
+    ("node", ("handle", "model"), False),
+    ("property", ("handle", "model"), False),
+    ("relationship", ("handle", "model"), False),
+    ("term", ("value", "origin_name"), False),
+)
+
+# plan operators that read every node of a label (or of the graph)
+SCAN_OPERATORS = ("AllNodesScan", "NodeByLabelScan")
+
+
+def get_entity_type(entity: Entity):
+    """returns type of entity"""
+    if entity.__class__.__name__.lower() == "edge":
+        return "relationship"
+    return entity.__class__.__name__.lower()
+
+
+def entity_attrs(entity: Entity) -> dict:
+    """Returns dict of entity's set attributes (see NelsonMDB.get_entity_attrs)"""
+    return {
+        key: val for key, val in vars(entity).items()
+        if val and val is not None and key != "pvt"
+    }
+
+
+def query_parms(attrs: dict, prefix: str = "") -> dict:
+    """Returns attributes usable as query parameters, with keys prefixed by prefix"""
+    return {
+        f"{prefix}{key}": val for key, val in attrs.items()
+        if isinstance(val, PARAM_TYPES)
+    }
+
+
+@lru_cache(maxsize=None)
+def entity_pattern(var: str, entity_type: str, keys: tuple, prefix: str = "") -> str:
+    """
+    Returns parameterized node pattern for an entity.
+
+    e.g. entity_pattern("e", "node", ("handle", "model")) returns
+    "(e:node {handle: $handle, model: $model})".
+    """
+    if not keys:
+        return f"({var}:{entity_type})"
+    props = ", ".join(f"{key}: ${prefix}{key}" for key in keys)
+    return f"({var}:{entity_type} {{{props}}})"
+
+
+@lru_cache(maxsize=None)
+def row_pattern(var: str, entity_type: str, keys: tuple, row: str = "row") -> str:
+    """
+    Returns node pattern taking attribute values from an UNWIND row map.
+
+    e.g. row_pattern("e", "node", ("handle", "model")) returns
+    "(e:node {handle: row.handle, model: row.model})".
+    """
+    if not keys:
+        return f"({var}:{entity_type})"
+    props = ", ".join(f"{key}: {row}.{key}" for key in keys)
+    return f"({var}:{entity_type} {{{props}}})"
+
+
+@lru_cache(maxsize=1024)
+def unwind_entity_query(template: str, entity_type: str, keys: tuple) -> str:
+    """Returns ENTITY_TEMPLATES query applied to every attribute map in $rows"""
+    return (
+        "UNWIND $rows AS row "
+        + ENTITY_TEMPLATES[template].format(e=row_pattern("e", entity_type, keys))
+    )
+
+
+@lru_cache(maxsize=1024)
+def unwind_relationship_query(
+    src_type: str,
+    src_keys: tuple,
+    relationship: str,
+    dst_type: str,
+    dst_keys: tuple
+    ) -> str:
+    """Returns query merging relationship for every {src: {...}, dst: {...}} map in $rows"""
+    return (
+        "UNWIND $rows AS row "
+        f"MATCH {row_pattern('s', src_type, src_keys, 'row.src')} "
+        f"MATCH {row_pattern('d', dst_type, dst_keys, 'row.dst')} "
+        f"MERGE (s)-[:{relationship}]->(d)"
+    )
+
+
+@lru_cache(maxsize=None)
+def concepts_bulk_query(entity_type: str) -> str:
+    """Returns query listing Concept nanoids of each entity of given type in $nanoids"""
+    relationship = "represents" if entity_type == "term" else "has_concept"
+    return (
+        f"UNWIND $nanoids AS nano MATCH (e:{entity_type} {{nanoid: nano}})"
+        f"-[:{relationship}]->(c:concept) "
+        "RETURN nano AS nanoid, collect(c.nanoid) AS concepts"
+    )
+
+
+@lru_cache(maxsize=None)
+def merge_entities_bulk_query(entity_type: str) -> str:
+    """Returns query merging an entity of given type on nanoid for every attribute map in $rows"""
+    return (
+        f"UNWIND $rows AS row MERGE (e:{entity_type} {{nanoid: row.nanoid}}) "
+        "ON CREATE SET e += row"
+    )
+
+
+@lru_cache(maxsize=None)
+def merge_relationships_bulk_query(src_type: str, relationship: str, dst_type: str) -> str:
+    """Returns query merging relationship for every [src_nanoid, dst_nanoid] pair in $pairs"""
+    return (
+        f"UNWIND $pairs AS pair MATCH (s:{src_type} {{nanoid: pair[0]}}) "
+        f"MATCH (d:{dst_type} {{nanoid: pair[1]}}) "
+        f"MERGE (s)-[:{relationship}]->(d)"
+    )
+
+
+@lru_cache(maxsize=None)
+def entity_page_query(entity_type: str, by_model: bool = False) -> str:
+    """
+    Returns keyset pagination query for entities of given type, ordered by nanoid.
+
+    Each page holds up to $limit entities after the ($after_nano, $after_id)
+    key of the previous page's last entity; the node id breaks ties between
+    repeated nanoids. If by_model, only entities with model $model are read.
+    Entities without a nanoid are skipped.
+    """
+    model_filter = "AND e.model = $model " if by_model else ""
+    return (
+        f"MATCH (e:{entity_type}) "
+        "WHERE e.nanoid >= $after_nano AND (e.nanoid > $after_nano OR id(e) > $after_id) "
+        f"{model_filter}"
+        "RETURN e.nanoid AS nanoid, id(e) AS id, properties(e) AS props "
+        "ORDER BY e.nanoid, id(e) LIMIT $limit"
+    )
+
+
+@lru_cache(maxsize=1024)
+def unwind_delete_relationship_query(
+    src_type: str,
+    src_keys: tuple,
+    relationship: str,
+    dst_type: str,
+    dst_keys: tuple
+    ) -> str:
+    """Returns query deleting relationship for every {src: {...}, dst: {...}} map in $rows"""
+    return (
+        "UNWIND $rows AS row "
+        f"MATCH {row_pattern('s', src_type, src_keys, 'row.src')}"
+        f"-[r:{relationship}]->{row_pattern('d', dst_type, dst_keys, 'row.dst')} "
+        "DELETE r"
+    )
+
+
+@lru_cache(maxsize=4096)
+def entity_query(template: str, entity_type: str, keys: tuple) -> str:
+    """Returns query for a named ENTITY_TEMPLATES template and entity type/attribute keys"""
+    return ENTITY_TEMPLATES[template].format(e=entity_pattern("e", entity_type, keys))
+
+
+@lru_cache(maxsize=1024)
+def checked_relationship_query(
+    src_type: str,
+    src_keys: tuple,
+    dst_type: str,
+    dst_keys: tuple,
+    relationship: str
+    ) -> str:
+    """
+    Returns query merging relationship between two entities only if both are unique.
+
+    Entities are matched on all their attributes (parameters prefixed src_ and
+    dst_). Returns src_count and dst_count; the relationship is only merged if
+    both are 1, so callers can raise on other counts knowing nothing was written.
+    """
+    return (
+        f"OPTIONAL MATCH {entity_pattern('s', src_type, src_keys, 'src_')} "
+        "WITH collect(s) AS srcs "
+        f"OPTIONAL MATCH {entity_pattern('d', dst_type, dst_keys, 'dst_')} "
+        "WITH srcs, collect(d) AS dsts "
+        "FOREACH (s IN CASE WHEN size(srcs) = 1 AND size(dsts) = 1 THEN srcs ELSE [] END | "
+        f"FOREACH (d IN dsts | MERGE (s)-[:{relationship}]->(d))) "
+        "RETURN size(srcs) AS src_count, size(dsts) AS dst_count"
+    )
+
+
+@lru_cache(maxsize=1024)
+def link_synonyms_query(
+    type_1: str,
+    keys_1: tuple,
+    type_2: str,
+    keys_2: tuple,
+    relationship: str
+    ) -> str:
+    """
+    Returns query linking two entities to a shared Concept in one statement.
+
+    Entities are matched on all their attributes (parameters prefixed e1_ and
+    e2_). Writes only happen if each entity is unique, or missing with
+    $create_1/$create_2 true, in which case it's created from $e1_props/$e2_props.
+    The second entity is merged rather than created, so it isn't created twice
+    when both entities are the same missing one. If the entities already share
+    a Concept nothing is written; otherwise both are linked to the first
+    entity's Concept, else the second's, else a new Concept with nanoid
+    $new_concept.
+
+    Returns count_1, count_2 (matches before any write), concept and already_linked.
+    """
+    pattern_1 = entity_pattern("e1", type_1, keys_1, "e1_")
+    pattern_2 = entity_pattern("e2", type_2, keys_2, "e2_")
+    return (
+        f"OPTIONAL MATCH {pattern_1} WITH collect(e1) AS ones "
+        f"OPTIONAL MATCH {pattern_2} WITH ones, collect(e2) AS twos "
+        "WITH size(ones) AS count_1, size(twos) AS count_2 "
+        "WITH count_1, count_2, count_1 <= 1 AND count_2 <= 1 AND "
+        "(count_1 = 1 OR $create_1) AND (count_2 = 1 OR $create_2) AS ok "
+        "FOREACH (x IN CASE WHEN ok AND count_1 = 0 THEN [1] ELSE [] END | "
+        f"CREATE (:{type_1} $e1_props)) "
+        "FOREACH (x IN CASE WHEN ok AND count_2 = 0 THEN [1] ELSE [] END | "
+        f"MERGE {entity_pattern('new_2', type_2, keys_2, 'e2_')}) "
+        "WITH count_1, count_2, ok "
+        f"OPTIONAL MATCH {pattern_1} "
+        f"OPTIONAL MATCH {pattern_2} "
+        f"OPTIONAL MATCH (e1)-[:{relationship}]->(c1:concept) "
+        "WITH count_1, count_2, ok, e1, e2, collect(c1.nanoid) AS concepts_1 "
+        f"OPTIONAL MATCH (e2)-[:{relationship}]->(c2:concept) "
+        "WITH count_1, count_2, ok, e1, e2, concepts_1, collect(c2.nanoid) AS concepts_2 "
+        "WITH count_1, count_2, ok, e1, e2, "
+        "[nano IN concepts_1 WHERE nano IN concepts_2] AS shared, "
+        "CASE WHEN size(concepts_1) > 0 THEN concepts_1[0] "
+        "WHEN size(concepts_2) > 0 THEN concepts_2[0] ELSE $new_concept END AS concept "
+        "FOREACH (x IN CASE WHEN ok AND size(shared) = 0 THEN [1] ELSE [] END | "
+        "MERGE (c:concept {nanoid: concept}) "
+        f"MERGE (e1)-[:{relationship}]->(c) "
+        f"MERGE (e2)-[:{relationship}]->(c)) "
+        "RETURN count_1, count_2, ok, "
+        "CASE WHEN size(shared) > 0 THEN shared[0] ELSE concept END AS concept, "
+        "size(shared) > 0 AS already_linked"
+    )
+
+
+def entity_statement(template: str, entity: Entity) -> tuple:
+    """
+    Returns (qry, parms) for named template in ENTITY_TEMPLATES.
+
+    Entity attributes are passed as parameters, so the query string only
+    depends on the entity type and attribute keys.
+    """
+    parms = query_parms(entity_attrs(entity))
+    qry = entity_query(template, get_entity_type(entity), tuple(sorted(parms)))
+    return (qry, parms)
+
+
+def checked_relationship_statement(
+    src_entity: Entity,
+    dst_entity: Entity,
+    relationship: str
+    ) -> tuple:
+    """Returns (qry, parms) merging relationship if both entities are unique"""
+    src_parms = query_parms(entity_attrs(src_entity))
+    dst_parms = query_parms(entity_attrs(dst_entity))
+    qry = checked_relationship_query(
+        get_entity_type(src_entity),
+        tuple(sorted(src_parms)),
+        get_entity_type(dst_entity),
+        tuple(sorted(dst_parms)),
+        relationship
+    )
+    parms = {
+        **query_parms(src_parms, prefix="src_"),
+        **query_parms(dst_parms, prefix="dst_")
+    }
+    return (qry, parms)
+
+
+def link_synonyms_statement(
+    entity_1: Entity,
+    entity_2: Entity,
+    add_missing_ent: bool,
+    new_concept: str
+    ) -> tuple:
+    """Returns (qry, parms) of the single link_synonyms statement"""
+    parms_1 = query_parms(entity_attrs(entity_1))
+    parms_2 = query_parms(entity_attrs(entity_2))
+    entity_type_1 = get_entity_type(entity_1)
+    qry = link_synonyms_query(
+        entity_type_1,
+        tuple(sorted(parms_1)),
+        get_entity_type(entity_2),
+        tuple(sorted(parms_2)),
+        "represents" if entity_type_1 == "term" else "has_concept"
+    )
+    parms = {
+        **query_parms(parms_1, prefix="e1_"),
+        **query_parms(parms_2, prefix="e2_"),
+        "e1_props": parms_1,
+        "e2_props": parms_2,
+        "create_1": bool(add_missing_ent and entity_1.nanoid),
+        "create_2": bool(add_missing_ent and entity_2.nanoid),
+        "new_concept": new_concept
+    }
+    return (qry, parms)
+
+
+def check_extra_handles(ent_type: str, extra_handle_1: str, extra_handle_2: str) -> None:
+    """Raises error if a Property or Edge lookup lacks the handles needed to identify it"""
+    if ent_type == "property" and not extra_handle_1:
+        raise RuntimeError(
+            "Property entities require the handle of a node connected via 'has_property' "
+            "for unique identification. Set 'extra_handle_1' to that node handle str.")
+    if ent_type == "relationship" and (not extra_handle_1 or not extra_handle_2):
+        raise RuntimeError(
+            "Edge entities require the handles of a node connected via "
+            "'has_src' relationship and of a node connected via 'has_dst' "
+            "relationship for unique identification. Set 'extra_handle_1' to "
+            "the src handle and 'extra_handle_2' to the dst handle")
+
+
+def prop_nano_statement(prop: Entity, node_handle: str) -> tuple:
+    """
+    Returns (qry, parms, "prop_nano") looking up Property nanoid by its Node's handle.
+
+    This is used to help uniquely identify a property node in the MDB,
+    which requires a node connected via the has_property relationship.
+    """
+    qry = (
+        "MATCH (p:property {handle: $prop_handle, model: $prop_model})"
+        "<-[:has_property]-(n:node {handle: $node_handle}) "
+        "RETURN p.nanoid as prop_nano"
+    )
+    parms = {
+        "prop_handle": prop.handle,
+        "prop_model": prop.model,
+        "node_handle": node_handle
+    }
+    return (qry, parms, "prop_nano")
+
+
+def edge_nano_statement(edge: Entity, src_handle: str, dst_handle: str) -> tuple:
+    """
+    Returns (qry, parms, "edge_nano") looking up Edge nanoid by src and dst Node handles.
+
+    This is used to help uniquely identify an edge node in the MDB,
+    which requires nodes connected via the has_src and has_dst relationships.
+    """
+    qry = (
+        "MATCH (s:node {handle: $src_handle})<-[:has_src]-"
+        "(r:relationship {handle: $edge_handle, model: $edge_model})-"
+        "[:has_dst]->(d:node {handle: $dst_handle}) "
+        "RETURN r.nanoid as edge_nano"
+    )
+    parms = {
+        "edge_handle": edge.handle,
+        "edge_model": edge.model,
+        "src_handle": src_handle,
+        "dst_handle": dst_handle
+    }
+    return (qry, parms, "edge_nano")
+
+
+def index_name(label: str, properties: tuple, unique: bool = False) -> str:
+    """Returns name of a LOOKUP_INDEXES index, e.g. term_value_origin_name"""
+    return "_".join([label, *properties, *(["unique"] if unique else [])])
+
+
+def index_statement(label: str, properties: tuple, unique: bool = False) -> str:
+    """
+    Returns idempotent statement creating a LOOKUP_INDEXES index or uniqueness constraint.
+    """
+    name = index_name(label, properties, unique)
+    if unique:
+        return (
+            f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (e:{label}) "
+            f"REQUIRE e.{properties[0]} IS UNIQUE"
+        )
+    props = ", ".join(f"e.{prop}" for prop in properties)
+    return f"CREATE INDEX {name} IF NOT EXISTS FOR (e:{label}) ON ({props})"
+
+
+def plan_operators(plan: dict) -> list:
+    """Returns operator names of an EXPLAIN/PROFILE plan (ResultSummary.plan) and its children"""
+    if not plan:
+        return []
+    operators = [plan.get("operatorType", "").split("@")[0]]
+    for child in plan.get("children", []):
+        operators.extend(plan_operators(child))
+    return operators
+
+
+def template_cache_stats() -> dict:
+    """
+    Returns hits, misses and hit rate of rendered query templates.
+
+    Misses equal the number of distinct query strings sent to Neo4j, so the hit
+    rate is the share of entity queries that could reuse a cached query plan.
+    """
+    hits = 0
+    misses = 0
+    for cached in [
+        entity_query, checked_relationship_query, link_synonyms_query,
+        unwind_entity_query, unwind_relationship_query, unwind_delete_relationship_query,
+        concepts_bulk_query, entity_page_query,
+        merge_entities_bulk_query, merge_relationships_bulk_query
+    ]:
+        # pylint can't see that lru_cache wraps each template, so it thinks
+        # cache_info is the template itself, called without its arguments
+        info = cached.cache_info()  # pylint: disable=no-value-for-parameter
+        hits += info.hits
+        misses += info.misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+    }
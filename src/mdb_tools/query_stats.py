@@ -0,0 +1,324 @@
+"""
+Opt-in instrumentation of the queries NelsonMDB sends to Neo4j.
+
+QueryStats counts calls, wall time and rows returned per NelsonMDB method
+and per Cypher template. Queries are seen through a proxy of the driver
+(InstrumentedDriver), so every transaction decorator, write buffer flush and
+streamed read is covered without changing them. See NelsonMDB.enable_stats.
+"""
+
+import threading
+import time
+from functools import wraps
+
+# statements that can't be (or already are) run with PROFILE
+UNPROFILED_PREFIXES = ("EXPLAIN", "PROFILE", "SHOW", "CALL", "CREATE CONSTRAINT", "CREATE INDEX")
+
+# public NelsonMDB methods recorded per call by QueryStats.instrument
+INSTRUMENTED_METHODS = (
+    "detach_delete_entity", "get_entity_count", "create_entity", "get_concepts",
+    "create_relationship", "get_concepts_bulk", "merge_entities_bulk",
+    "merge_relationships_bulk", "link_synonyms", "get_entity_nano", "resolve_nano",
+    "get_or_make_nano", "preload", "get_term_nanos", "get_predicate_nanos",
+    "get_predicate_relationship", "link_concepts_to_predicate", "merge_two_concepts",
+    "merge_concepts", "build_term_index", "get_term_synonyms", "flush",
+    "ensure_indexes", "explain_lookups"
+)
+
+
+def template_label(qry: str, width: int = 80) -> str:
+    """Returns query collapsed to one line and cut to width characters, for display"""
+    label = " ".join(qry.split())
+    return label if len(label) <= width else label[:width - 3] + "..."
+
+
+def profile_db_hits(profile: dict) -> int:
+    """Returns total db hits of a PROFILE plan (ResultSummary.profile) and its children"""
+    if not profile:
+        return 0
+    hits = profile.get("dbHits", 0)
+    for child in profile.get("children", []):
+        hits += profile_db_hits(child)
+    return hits
+
+
+class QueryStats:
+    """
+    Per-method and per-template counts of calls, wall time and rows returned.
+
+    methods maps NelsonMDB method name -> {calls, seconds, queries, rows}, where
+    seconds includes nested calls and queries/rows count every query run
+    during the call. templates maps Cypher template -> {calls, seconds, rows,
+    db_hits}. With profile set, queries are run with PROFILE and db_hits holds
+    the total db hits of their plans (None otherwise). Safe to share between
+    worker threads.
+    """
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.methods = {}
+        self.templates = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def instrument(self, mdbn, methods: tuple = INSTRUMENTED_METHODS) -> None:
+        """Wraps given methods of mdbn (on the instance) so their calls are recorded"""
+        for name in methods:
+            setattr(mdbn, name, self._wrap(name, getattr(mdbn, name)))
+
+    @staticmethod
+    def uninstrument(mdbn, methods: tuple = INSTRUMENTED_METHODS) -> None:
+        """Removes wrappers added by instrument"""
+        for name in methods:
+            mdbn.__dict__.pop(name, None)
+
+    def _wrap(self, name: str, method):
+        @wraps(method)
+        def recorded(*args, **kwargs):
+            stack = self._stack()
+            stack.append(name)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                stack.pop()
+                with self.lock:
+                    entry = self.methods.setdefault(
+                        name, {"calls": 0, "seconds": 0.0, "queries": 0, "rows": 0})
+                    entry["calls"] += 1
+                    entry["seconds"] += seconds
+        return recorded
+
+    def record_query(self, qry: str, seconds: float, rows: int, db_hits: int = None) -> None:
+        """Adds one run of query to its template and to the methods that ran it"""
+        with self.lock:
+            entry = self.templates.setdefault(
+                qry, {"calls": 0, "seconds": 0.0, "rows": 0, "db_hits": None})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+            if db_hits is not None:
+                entry["db_hits"] = (entry["db_hits"] or 0) + db_hits
+            for name in set(self._stack()):
+                method_entry = self.methods.setdefault(
+                    name, {"calls": 0, "seconds": 0.0, "queries": 0, "rows": 0})
+                method_entry["queries"] += 1
+                method_entry["rows"] += rows
+
+    def reset(self) -> None:
+        """Drops everything recorded so far"""
+        with self.lock:
+            self.methods.clear()
+            self.templates.clear()
+
+    def as_dict(self) -> dict:
+        """Returns copy of methods and templates, e.g. to save as JSON"""
+        with self.lock:
+            return {
+                "methods": {name: dict(entry) for name, entry in self.methods.items()},
+                "templates": {qry: dict(entry) for qry, entry in self.templates.items()}
+            }
+
+    def summary(self, limit: int = 20) -> list:
+        """
+        Returns lines summarizing methods and the limit slowest templates.
+
+        Methods and templates are sorted by total wall time.
+        """
+        stats = self.as_dict()
+        queries = sum(entry["calls"] for entry in stats["templates"].values())
+        lines = [f"{queries} queries from {len(stats['templates'])} templates"]
+        lines.append("Methods (calls, seconds, queries, rows):")
+        for name, entry in sorted(
+            stats["methods"].items(), key=lambda item: item[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                f"  {name}: {entry['calls']}, {entry['seconds']:.3f}s, "
+                f"{entry['queries']}, {entry['rows']}")
+        lines.append("Templates (calls, seconds, rows, db hits):")
+        templates = sorted(
+            stats["templates"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for qry, entry in templates[:limit]:
+            db_hits = "-" if entry["db_hits"] is None else entry["db_hits"]
+            lines.append(
+                f"  {entry['calls']}, {entry['seconds']:.3f}s, {entry['rows']}, {db_hits}: "
+                f"{template_label(qry)}")
+        if len(templates) > limit:
+            lines.append(f"  ... {len(templates) - limit} more templates")
+        return lines
+
+
+class InstrumentedResult:
+    """Proxy of a neo4j Result that records its query with QueryStats once it's consumed"""
+    def __init__(self, result, stats: QueryStats, qry: str, start: float):
+        self._result = result
+        self._stats = stats
+        self._qry = qry
+        self._start = start
+        self._rows = 0
+        self.recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        for record in self._result:
+            self._rows += 1
+            yield record
+        self._finish()
+
+    def value(self, *args, **kwargs) -> list:
+        """Returns Result.value, recording query"""
+        values = self._result.value(*args, **kwargs)
+        self._rows += len(values)
+        self._finish()
+        return values
+
+    def values(self, *args, **kwargs) -> list:
+        """Returns Result.values, recording query"""
+        values = self._result.values(*args, **kwargs)
+        self._rows += len(values)
+        self._finish()
+        return values
+
+    def data(self, *args, **kwargs) -> list:
+        """Returns Result.data, recording query"""
+        data = self._result.data(*args, **kwargs)
+        self._rows += len(data)
+        self._finish()
+        return data
+
+    def single(self, *args, **kwargs):
+        """Returns Result.single, recording query"""
+        record = self._result.single(*args, **kwargs)
+        self._rows += record is not None
+        self._finish()
+        return record
+
+    def consume(self):
+        """Returns Result.consume, recording query"""
+        summary = self._result.consume()
+        self._finish(summary)
+        return summary
+
+    def _finish(self, summary=None) -> None:
+        if self.recorded:
+            return
+        self.recorded = True
+        db_hits = None
+        if self._stats.profile:
+            summary = summary or self._result.consume()
+            db_hits = profile_db_hits(getattr(summary, "profile", None))
+        self._stats.record_query(
+            self._qry, time.perf_counter() - self._start, self._rows, db_hits)
+
+
+class InstrumentedTransaction:
+    """Proxy of a neo4j transaction whose run results are recorded with QueryStats"""
+    def __init__(self, tx, stats: QueryStats):
+        self._tx = tx
+        self._stats = stats
+        self._results = []
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+    def __enter__(self):
+        self._tx.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.finish()
+        return self._tx.__exit__(*exc_info)
+
+    def run(self, query: str, parameters: dict = None, **kwargs) -> InstrumentedResult:
+        """Runs query (with PROFILE if profiling), returning recording result"""
+        result = _run(self._tx, self._stats, query, parameters, **kwargs)
+        self._results.append(result)
+        return result
+
+    def commit(self):
+        """Records results not consumed yet, then commits"""
+        self.finish()
+        return self._tx.commit()
+
+    def finish(self) -> None:
+        """Consumes (and so records) every result not read by the caller"""
+        for result in self._results:
+            if not result.recorded:
+                result.consume()
+        self._results = []
+
+
+class InstrumentedSession:
+    """Proxy of a neo4j Session whose queries are recorded with QueryStats"""
+    def __init__(self, session, stats: QueryStats):
+        self._session = session
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._session.__exit__(*exc_info)
+
+    def run(self, query: str, parameters: dict = None, **kwargs) -> InstrumentedResult:
+        """Runs auto-commit query (with PROFILE if profiling), returning recording result"""
+        return _run(self._session, self._stats, query, parameters, **kwargs)
+
+    def begin_transaction(self, *args, **kwargs) -> InstrumentedTransaction:
+        """Begins explicit transaction whose queries are recorded"""
+        return InstrumentedTransaction(
+            self._session.begin_transaction(*args, **kwargs), self._stats)
+
+    def execute_read(self, transaction_function, *args, **kwargs):
+        """Runs transaction function in a read transaction whose queries are recorded"""
+        return self._session.execute_read(
+            self._instrumented(transaction_function), *args, **kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        """Runs transaction function in a write transaction whose queries are recorded"""
+        return self._session.execute_write(
+            self._instrumented(transaction_function), *args, **kwargs)
+
+    def _instrumented(self, transaction_function):
+        def instrumented(tx, *args, **kwargs):
+            instrumented_tx = InstrumentedTransaction(tx, self._stats)
+            result = transaction_function(instrumented_tx, *args, **kwargs)
+            instrumented_tx.finish()
+            return result
+        return instrumented
+
+
+class InstrumentedDriver:
+    """Proxy of a neo4j Driver whose sessions record their queries with QueryStats"""
+    def __init__(self, driver, stats: QueryStats):
+        self.driver = driver
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def session(self, *args, **kwargs) -> InstrumentedSession:
+        """Returns recording proxy of driver session"""
+        return InstrumentedSession(self.driver.session(*args, **kwargs), self.stats)
+
+
+def _run(runner, stats: QueryStats, query: str, parameters: dict = None, **kwargs):
+    """Runs query on session or transaction, returning InstrumentedResult"""
+    start = time.perf_counter()
+    qry = query
+    if stats.profile and not query.lstrip().upper().startswith(UNPROFILED_PREFIXES):
+        qry = f"PROFILE {query}"
+    result = runner.run(qry, parameters=parameters, **kwargs)
+    return InstrumentedResult(result, stats, query, start)
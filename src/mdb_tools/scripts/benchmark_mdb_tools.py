@@ -0,0 +1,89 @@
+"""Command line interface for python script to benchmark mdb_tools on synthetic MDBs"""
+
+import json
+from pathlib import Path
+
+import click
+from mdb_tools.benchmark import BENCHMARKS, run_benchmarks
+
+
+@click.command()
+@click.option(
+    "--scales",
+    default="1000,10000,100000",
+    type=str,
+    help="comma-separated numbers of Terms (and Properties) in each synthetic MDB, "
+    "e.g. 1000,1000000.")
+@click.option(
+    "--benchmarks",
+    default=",".join(BENCHMARKS),
+    type=str,
+    help=f"comma-separated benchmarks to run, from: {', '.join(BENCHMARKS)}.")
+@click.option(
+    "--ops",
+    default=1000,
+    type=click.IntRange(min=1),
+    help="number of operations (or CSV rows, for CLI benchmarks) per benchmark.")
+@click.option(
+    "--seed",
+    default=0,
+    type=int,
+    help="random seed for synthetic data.")
+@click.option(
+    "--output",
+    default="benchmark_results.json",
+    type=str,
+    help="file path of JSON report.")
+@click.option(
+    "--in_process",
+    "--in-process",
+    is_flag=True,
+    default=False,
+    help="run every benchmark in this process instead of one process each (no peak RSS).")
+def main(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    scales: str,
+    benchmarks: str,
+    ops: int = 1000,
+    seed: int = 0,
+    output: str = "benchmark_results.json",
+    in_process: bool = False
+    ) -> None:
+    """
+    Benchmarks mdb_tools hot paths on synthetic in-memory MDBs of increasing scale.
+
+    Reports throughput, p50/p99 latency, Neo4j round trips per operation and
+    peak RSS of each benchmark (each runs in its own process), and saves them
+    as JSON to compare versions.
+
+    scales: comma-separated numbers of Terms (and Properties) in each synthetic MDB.
+    benchmarks: comma-separated benchmarks to run.
+    ops: number of operations (or CSV rows, for CLI benchmarks) per benchmark.
+    seed: random seed for synthetic data.
+    output: file path of JSON report.
+    in_process: if set, runs benchmarks in this process, without peak RSS.
+    """
+    report = run_benchmarks(
+        [int(scale) for scale in scales.split(",")],
+        [name.strip() for name in benchmarks.split(",")],
+        ops=ops,
+        seed=seed,
+        isolate=not in_process)
+    for result in report["results"]:
+        latency = ""
+        if result["p50_ms"] is not None:
+            latency = f", p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms"
+        round_trips = ""
+        if result["round_trips_per_op"] is not None:
+            round_trips = f", {result['round_trips_per_op']:.2f} round trips/op"
+        rss = ""
+        if result["peak_rss_mb"] is not None:
+            rss = f", peak RSS {result['peak_rss_mb']:.1f} MB"
+        click.echo(
+            f"{result['benchmark']} @ {result['scale']}: {result['ops']} ops in "
+            f"{result['seconds']:.3f}s ({result['ops_per_second']:.1f} ops/s{latency}"
+            f"{round_trips}){rss}")
+    Path(output).write_text(json.dumps(report, indent=2), encoding="UTF-8")
+    click.echo(f"Benchmark results now at {output}")
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
@@ -1,10 +1,7 @@
 """Command line interface for python script to format CDA mapping excel file"""
 
-from pathlib import Path
-
 import click
-import numpy as np
-import pandas as pd
+from mdb_tools.cda_mapping import find_workbooks, process_workbooks
 
 
 @click.command()
@@ -13,115 +10,71 @@ import pandas as pd
     required=True,
     type=str,
     prompt=True,
-    help="Path to input spreadsheet file; each sheet contains mappings for different endpoint.")
+    help=(
+        "Path to input spreadsheet file; each sheet contains mappings for different endpoint. "
+        "Can also be a directory or glob pattern (e.g. 'mappings/*.xlsx') of spreadsheets."))
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="number of worker processes cleaning spreadsheets in parallel.")
+@click.option(
+    "--parquet",
+    is_flag=True,
+    default=False,
+    help="also write each output as Parquet next to its CSV (needs pyarrow or fastparquet).")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help=(
+        "cache cleaned sheets by content hash so only changed sheets are recomputed, and "
+        "write _added and _removed CSVs of mapping rows that changed since the last _clean "
+        "CSV. Link the _added CSV with link-ents to only link new mappings."))
+@click.option(
+    "--cache_dir",
+    "--cache-dir",
+    type=str,
+    default=None,
+    help=(
+        "directory of the --incremental sheet cache; can be shared by all workbooks. "
+        "Defaults to .clean_cda_cache next to each spreadsheet."))
 def main(
-    input_filepath: str
+    input_filepath: str,
+    workers: int = 1,
+    parquet: bool = False,
+    incremental: bool = False,
+    cache_dir: str = None
 ) -> None:
     """
     Formats Cancer Data Aggregator mappings input spreadsheet to CSVs for entity synonym linking.
 
     Args:
         input_filepath: Path to input spreadsheet file; each sheet has mappings for a CDA endpoint.
+            Can also be a directory or glob pattern of spreadsheets.
+        workers: number of worker processes cleaning spreadsheets in parallel.
+        parquet: if set, also writes each output as Parquet next to its CSV.
+        incremental: if set, reuses cleaned sheets cached by content hash and writes
+            the rows added to and removed from the last _clean CSV to _added and
+            _removed CSVs, so only the _added CSV needs linking.
+        cache_dir: directory of the sheet cache, by default .clean_cda_cache next to
+            each spreadsheet.
 
     Returns:
-        Creates two CSV files in same directory as input spreadsheet.
+        Creates two CSV files in same directory as each input spreadsheet.
         _cleaned CSV contains output with formatted synonyms.
         _other CSV contains other mappings that aren't 1-1 synonyms for further processing.
+        CSVs whose content didn't change aren't rewritten.
     """
-    # set file paths for output and other files based on input directory
-    input_path = Path(input_filepath)
-    if not input_path.exists():
-        raise RuntimeError(f"Filepath {input_path} not found.")
-    output_path = Path(input_path.with_name(f"{input_path.stem}_clean.csv"))
-    other_path = Path(input_path.with_name(f"{input_path.stem}_other.csv"))
-
-    endpoints = []
-    mapping_dfs = []
-    for sheet in pd.read_excel(input_filepath, None).keys():
-        endpoint = sheet.split(" ")[0] # type: ignore
-        endpoints.append(endpoint)
-        df = pd.read_excel(input_filepath, sheet_name=sheet)
-        df.name = endpoint
-        mapping_dfs.append(df)
-    models = list(col for col in mapping_dfs[0].columns if col != "field")
-
-    cda_mapping_df = pd.DataFrame(
-        columns=[
-            "ent_1_model", "ent_1_handle", "ent_1_extra_handles",
-            "ent_2_model", "ent_2_handle", "ent_2_extra_handles"
-        ]
-    )
-
-    for df in mapping_dfs:
-        df_ent_1_handle = np.tile(df.iloc[:, 0], len(models))
-        df_ent_1_model = np.repeat("CDA", len(df_ent_1_handle))
-        df_ent_2_model = np.repeat(models, len(df.iloc[:, 0]))
-        df_ent_1_extra_handle = np.repeat(df.name, len(df_ent_1_handle))
-        ent_2_extra_handles_list = []
-        for model in models:
-            ent_2_extra_handles_list.extend(df[model].tolist())
-        ent_2_handle_list = []
-        for handle in ent_2_extra_handles_list:
-            if not "." in handle or "{" in handle:
-                ent_2_handle_list.append(handle)
-            else:
-                ent_2_handle_list.append(handle.split(".")[-1])
-
-        formatted_df = pd.DataFrame({
-            "ent_1_model": df_ent_1_model,
-            "ent_1_handle": df_ent_1_handle,
-            "ent_1_extra_handles": df_ent_1_extra_handle,
-            "ent_2_model": df_ent_2_model,
-            "ent_2_handle": ent_2_handle_list,
-            "ent_2_extra_handles": ent_2_extra_handles_list
-            })
-        cda_mapping_df = pd.concat([cda_mapping_df, formatted_df], ignore_index=True)
-
-    # remove unmapped entities
-    cda_mapping_df = cda_mapping_df[cda_mapping_df.ent_2_extra_handles != "NOT CURRENTLY MAPPED"]
-    cda_mapping_df = cda_mapping_df[cda_mapping_df.ent_2_extra_handles != "NOT APPLICABLE"]
-
-    # move special cases (i.e., fields w/o 1-1 mapping) to other df
-    cda_mapping_other_df = cda_mapping_df[
-        cda_mapping_df["ent_2_extra_handles"] == cda_mapping_df["ent_2_handle"]]
-    cda_mapping_df = cda_mapping_df.drop(cda_mapping_other_df.index) # type: ignore
-
-    # clean up ent_1_handle identifier fields
-    cda_mapping_df["ent_1_handle"].mask(cda_mapping_df["ent_1_handle"] == "identifier.value",
-                                        "identifier", inplace=True)
-
-    # File off ent 2 handle and extraneous handles from node handle 2.
-    # This is because extra handles should be lists of 1-2 strings of handles needed to
-    # uniquely identify property and relaitonship nodes in the database.
-    cda_mapping_df["ent_2_extra_handles"] = cda_mapping_df[
-        "ent_2_extra_handles"].str.rsplit(".", n=1).str[0]
-    cda_mapping_df["ent_2_extra_handles"] = cda_mapping_df[
-        "ent_2_extra_handles"].str.split(".").str[-1]
-
-    # match MDB naming for ent 1 & 2 extra handles
-    cda_mapping_df["ent_1_extra_handles"].replace(
-        to_replace=["subject", "researchsubject", "diagnosis", "treatment", "specimen", "file"],
-        value=["Subject", "ResearchSubject", "Diagnosis", "Treatment", "Specimen", "File"],
-        inplace=True
-    )
-    cda_mapping_df["ent_2_extra_handles"].replace(
-        to_replace=[
-            "files", "cases", "demographics", "projects", "diagnoses", "treatments", "samples"],
-        value=[
-            "file", "case", "demographic", "project", "diagnosis", "treatment", "sample"],
-        inplace=True
-    )
-
-    # format extra handles for both entities to lists
-    # since ent could be relationship, 2 handles may be needed to uniquely id node
-    cda_mapping_df["ent_1_extra_handles"] = [[l] for l in cda_mapping_df["ent_1_extra_handles"]]
-    cda_mapping_df["ent_2_extra_handles"] = [[l] for l in cda_mapping_df["ent_2_extra_handles"]]
-
-    cda_mapping_df.to_csv(output_path, index=False)
-    cda_mapping_other_df.to_csv(other_path, index=False)
-
-    click.echo(f"Cleaned CDA file now at {output_path}")
-    click.echo(f"Other CDA file now at {other_path}")
+    workbooks = find_workbooks(input_filepath)
+    for _, summary in process_workbooks(workbooks, parquet, workers, incremental, cache_dir):
+        click.echo(f"Cleaned CDA file now at {summary['clean']}")
+        click.echo(f"Other CDA file now at {summary['other']}")
+        if summary["added"] is not None:
+            click.echo(
+                f"Recomputed {summary['recomputed']} of {summary['sheets']} sheets; "
+                f"{summary['added_rows']} rows added (now at {summary['added']}) and "
+                f"{summary['removed_rows']} removed (now at {summary['removed']})")
 
 if __name__ == "__main__":
     main() # pylint: disable=no-value-for-parameter
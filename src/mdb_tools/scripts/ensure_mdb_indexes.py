@@ -0,0 +1,67 @@
+"""Command line interface for python script to create indexes behind mdb_tools lookups"""
+
+import click
+from mdb_tools import NelsonMDB
+
+
+@click.command()
+@click.option(
+    "--mdb_uri",
+    required=True,
+    type=str,
+    prompt=True,
+    help="metamodel database URI")
+@click.option(
+    "--mdb_user",
+    required=True,
+    type=str,
+    prompt=True,
+    help="metamodel database username")
+@click.option(
+    "--mdb_pass",
+    required=True,
+    type=str,
+    prompt=True,
+    help="metamodel database password")
+@click.option(
+    "--explain_only",
+    "--explain-only",
+    is_flag=True,
+    default=False,
+    help="only report which lookup queries fall back to scans, without creating indexes.")
+@click.option(
+    "--await_seconds",
+    default=300,
+    type=click.IntRange(min=0),
+    help="maximum number of seconds to wait for new indexes to come online.")
+def main(
+    mdb_uri,
+    mdb_user,
+    mdb_pass,
+    explain_only: bool = False,
+    await_seconds: int = 300
+    ) -> None:
+    """
+    Creates indexes and uniqueness constraints backing mdb_tools lookups, then reports
+    which lookup queries still fall back to label scans according to EXPLAIN.
+
+    Safe to rerun: indexes that already exist are left as they are.
+
+    explain_only: if set, only reports query plans.
+    await_seconds: maximum number of seconds to wait for new indexes to come online.
+    """
+    mdbn = NelsonMDB(uri=mdb_uri, user=mdb_user, password=mdb_pass)
+    if not explain_only:
+        for index in mdbn.ensure_indexes(await_seconds=await_seconds):
+            click.echo(f"{index['name']}: {index['status']}")
+    scanning = 0
+    for lookup in mdbn.explain_lookups():
+        if lookup["scans"]:
+            scanning += 1
+            click.echo(f"{lookup['name']}: scans ({', '.join(lookup['scans'])})")
+        else:
+            click.echo(f"{lookup['name']}: {' > '.join(lookup['operators'])}")
+    click.echo(f"{scanning} lookup queries fall back to scans")
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
@@ -1,12 +1,11 @@
 """Command line interface for python script to format CDA mapping excel file"""
 
 import csv
-from ast import literal_eval
+import logging
 from pathlib import Path
 
 import click
-from bento_meta.objects import Edge, Node, Property, Term
-from mdb_tools import NelsonMDB, get_entity_type
+from mdb_tools import LinkJournal, MemoryMDB, NelsonMDB, apply_parallel, compile_link_plan
 
 
 @click.command()
@@ -16,15 +15,17 @@ from mdb_tools import NelsonMDB, get_entity_type
     type=str,
     prompt=True,
     help=(
-        "file path to CSV with entities to be linked. Each line should contain data "
-        "needed to uniquely identify two synonymous entities.")
+        "file path to CSV (or Parquet, by .parquet suffix) with entities to be linked. "
+        "Each line should contain data needed to uniquely identify two synonymous entities.")
     )
 @click.option(
     "--mdb_uri",
     required=True,
     type=str,
     prompt=True,
-    help="metamodel database URI")
+    help=(
+        "metamodel database URI, or memory:<snapshot path> to link entities in an "
+        "in-memory MDB snapshot (see MemoryMDB), which is saved back when done."))
 @click.option(
     "--mdb_user",
     required=True,
@@ -49,123 +50,258 @@ from mdb_tools import NelsonMDB, get_entity_type
     type=bool,
     prompt=True,
     help="if set to true, will add entities not already in the database.")
-def main(
+@click.option(
+    "--merge_concepts",
+    is_flag=True,
+    default=False,
+    help=(
+        "if set, existing Concepts that end up in the same group of synonyms are merged "
+        "into the one with the lowest nanoid so each group has exactly one Concept. "
+        "Otherwise a group is linked to the existing Concept of ent_1 (else ent_2) of "
+        "its first row with one."))
+@click.option(
+    "--dry_run",
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="print the compiled mutation plan and its size without writing to the database.")
+@click.option(
+    "--preload",
+    is_flag=True,
+    default=False,
+    help="cache nanoids of every entity of the models in the CSV before linking.")
+@click.option(
+    "--batch_size",
+    default=1000,
+    type=int,
+    help="maximum number of rows in each UNWIND write batch.")
+@click.option(
+    "--chunk_rows",
+    "--chunk-rows",
+    default=100000,
+    type=click.IntRange(min=1),
+    help=(
+        "number of rows read, compiled into a plan and applied at a time. The whole "
+        "file is validated before the first chunk is linked."))
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help=(
+        "number of worker threads resolving entities and applying the plan. Work is "
+        "partitioned so no two workers write to the same entity or Concept."))
+@click.option(
+    "--journal",
+    type=str,
+    default=None,
+    help=(
+        "file path of a journal recording entity lookups and the status of each row, "
+        "used by --resume. Defaults to the CSV path with a .journal.jsonl suffix "
+        "when --resume is set."))
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="skip rows the journal has as done and reuse its entity lookups.")
+@click.option(
+    "--reject_csv",
+    "--reject-csv",
+    type=str,
+    default=None,
+    help=(
+        "file path of a CSV to write rows that fail (with their row number and error) to, "
+        "instead of aborting the run."))
+@click.option(
+    "--stats",
+    is_flag=True,
+    default=False,
+    help="print calls, time and rows per MDB method and per query template when done.")
+@click.option(
+    "--profile_queries",
+    "--profile-queries",
+    is_flag=True,
+    default=False,
+    help="run queries with PROFILE and add their db hits to --stats (slow; implies --stats).")
+@click.option(
+    "--log_level",
+    "--log-level",
+    default="WARNING",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False),
+    help="level of mdb_tools log messages to print, e.g. INFO for each bulk write.")
+def main(  # pylint: disable=too-many-arguments,too-many-positional-arguments
     csv_filepath: str,
     mdb_uri,
     mdb_user,
     mdb_pass,
     entity_type: str,
-    add_missing_ent: bool = False
+    add_missing_ent: bool = False,
+    merge_concepts: bool = False,
+    dry_run: bool = False,
+    preload: bool = False,
+    batch_size: int = 1000,
+    chunk_rows: int = 100000,
+    workers: int = 1,
+    journal: str = None,
+    resume: bool = False,
+    reject_csv: str = None,
+    stats: bool = False,
+    profile_queries: bool = False,
+    log_level: str = "WARNING"
     ) -> None:
     """
     Given CSV file of synonymous entities, links them in MDB via Concept.
 
-    csv_filepath: file path to CSV with entities to be linked. Each line should contain data
-        needed to uniquely identify two synonymous entities.
+    Every row is first checked against entity_type, so a malformed file is
+    reported before anything is written. Rows are then read chunk_rows at a
+    time and each chunk is compiled into a deduplicated plan of entities,
+    structural relationships and Concept links, which is applied with a
+    handful of UNWIND batches before the next chunk is read. Linked entities
+    are grouped into connected components first, so each group of synonyms
+    shares one Concept (groups spanning chunks join the Concept the earlier
+    chunk gave them; with dry_run, chunks are planned independently).
+
+    csv_filepath: file path to CSV or Parquet file with entities to be linked. Each line
+        should contain data needed to uniquely identify two synonymous entities.
     mdbn: metamodel database object
     entity_type: type of entity to be linked (node, property, relationship, term)
     add_missing_ent: if set to true, will add entities not found in the database.
+    merge_concepts: if set, merges existing Concepts within a group of synonyms.
+    dry_run: if set, prints the plan and its size instead of applying it.
+    preload: if set, caches nanoids of the CSV's models up front (node, property,
+        relationship only) so entities are resolved without per-entity queries.
+    batch_size: maximum number of rows in each UNWIND write batch.
+    chunk_rows: number of rows read, compiled and applied at a time.
+    workers: number of worker threads sharing the database driver. Transactions
+        failing with transient errors (e.g. deadlocks) are retried.
+    journal: file path of a journal of entity lookups and row status.
+    resume: if set, continues the run recorded in the journal, skipping rows
+        already written and reusing lookups.
+    reject_csv: if set, rows that fail are written to this CSV with their
+        row number and error and the run continues without them.
+    stats: if set, prints per-method and per-query-template stats when done.
+    profile_queries: if set, queries are run with PROFILE and stats include db hits.
+    log_level: level of mdb_tools log messages to print.
     """
-    mdbn = NelsonMDB(uri=mdb_uri, user=mdb_user, password=mdb_pass)
+    # imported here, as reading mapping files needs pandas
+    from mdb_tools.link_input import (  # pylint: disable=import-outside-toplevel
+        iter_link_batches, validate_link_file
+    )
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("mdb_tools").setLevel(log_level.upper())
+    snapshot_path = None
+    if mdb_uri.startswith("memory:"):
+        snapshot_path = Path(mdb_uri.removeprefix("memory:"))
+        mdbn = MemoryMDB(snapshot_path=snapshot_path if snapshot_path.exists() else None)
+    else:
+        mdbn = NelsonMDB(uri=mdb_uri, user=mdb_user, password=mdb_pass)
+    run_stats = None
+    if stats or profile_queries:
+        run_stats = mdbn.enable_stats(profile=profile_queries)
     csv_path = Path(csv_filepath)
-    with open(csv_path, encoding="UTF-8") as csvfile:
-        syn_reader = csv.DictReader(csvfile)
-        for row in syn_reader:
-            ent_type = entity_type.lower()
-            # get entity models and handles (used by all ent types)
-            ent_1_model = row["ent_1_model"]
-            ent_1_handle = row["ent_1_handle"]
-            ent_2_model = row["ent_2_model"]
-            ent_2_handle = row["ent_2_handle"]
-            ent_1_extra_handles = literal_eval(row["ent_1_extra_handles"])
-            ent_2_extra_handles = literal_eval(row["ent_2_extra_handles"])
-            row_extra_ents = [] # collects any extra entities for creation in mdb later
-            if ent_type in ["relationship", "edge"]:
-                if len(ent_1_extra_handles) != 2 or len(ent_2_extra_handles) != 2:
-                    raise RuntimeError(
-                        "Relationship entities must have two extra handles "
-                        "for unique id. Format: [src_handle, dst_handle]")
-                # get extra handles from row
-                ent_1_src_handle = ent_1_extra_handles[0]
-                ent_1_dst_handle = ent_1_extra_handles[1]
-                ent_2_src_handle = ent_2_extra_handles[0]
-                ent_2_dst_handle = ent_2_extra_handles[1]
-                # instantiate bento-meta entities
-                ent_1 = Edge({"handle": ent_1_handle, "model": ent_1_model})
-                ent_2 = Edge({"handle": ent_2_handle, "model": ent_2_model})
-                ent_1_src = Node({"handle": ent_1_src_handle, "model": ent_1_model})
-                ent_1_dst = Node({"handle": ent_1_dst_handle, "model": ent_1_model})
-                ent_2_src = Node({"handle": ent_2_src_handle, "model": ent_2_model})
-                ent_2_dst = Node({"handle": ent_2_dst_handle, "model": ent_2_model})
-                # add nanoid to entities (needed to id them for creation and linking)
-                ent_1.nanoid = mdbn.get_or_make_nano(ent_1, ent_1_src_handle, ent_1_dst_handle)
-                ent_2.nanoid = mdbn.get_or_make_nano(ent_2, ent_2_src_handle, ent_2_dst_handle)
-                ent_1_src.nanoid = mdbn.get_or_make_nano(ent_1_src)
-                ent_1_dst.nanoid = mdbn.get_or_make_nano(ent_1_dst)
-                ent_2_src.nanoid = mdbn.get_or_make_nano(ent_2_src)
-                ent_2_dst.nanoid = mdbn.get_or_make_nano(ent_2_dst)
-                row_extra_ents.extend([ent_1_src, ent_1_dst, ent_2_src, ent_2_dst])
-            elif ent_type == "property":
-                if len(ent_1_extra_handles) != 1 or len(ent_2_extra_handles) != 1:
-                    raise RuntimeError(
-                        "Property entities must have one extra handle "
-                        "for unique id. Format: [node_handle]")
-                # get extra handles from row
-                ent_1_node_handle = ent_1_extra_handles[0]
-                ent_2_node_handle = ent_2_extra_handles[0]
-                # instantiate bento-meta entities
-                ent_1 = Property({"handle": ent_1_handle, "model": ent_1_model})
-                ent_2 = Property({"handle": ent_2_handle, "model": ent_2_model})
-                ent_1_node = Node({"handle": ent_1_node_handle, "model": ent_1_model})
-                ent_2_node = Node({"handle": ent_2_node_handle, "model": ent_2_model})
-                # add nanoid to entities (needed to id them for creation and linking)
-                ent_1.nanoid = mdbn.get_or_make_nano(ent_1, ent_1_node_handle)
-                ent_2.nanoid = mdbn.get_or_make_nano(ent_2, ent_2_node_handle)
-                ent_1_node.nanoid = mdbn.get_or_make_nano(ent_1_node)
-                ent_2_node.nanoid = mdbn.get_or_make_nano(ent_2_node)
-                row_extra_ents.extend([ent_1_node, ent_2_node])
-            elif ent_type == "node":
-                # instantiate bento-meta entities
-                ent_1 = Node({"handle": ent_1_handle, "model": ent_1_model})
-                ent_2 = Node({"handle": ent_2_handle, "model": ent_2_model})
-                # add nanoid to entities (needed to id them for creation and linking)
-                ent_1.nanoid = mdbn.get_or_make_nano(ent_1)
-                ent_2.nanoid = mdbn.get_or_make_nano(ent_2)
-            elif ent_type == "term":
-                # instantiate bento-meta entities
-                ent_1 = Term({"value": ent_1_handle, "origin_name": ent_1_model})
-                ent_2 = Term({"value": ent_2_handle, "origin_name": ent_2_model})
-                # add nanoid to entities (needed to id them for creation and linking)
-                ent_1.nanoid = mdbn.get_or_make_nano(ent_1)
-                ent_2.nanoid = mdbn.get_or_make_nano(ent_2)
-            else:
-                raise RuntimeError(
-                    "entity_type must be node, property, relationship, or term")
+    if resume and not journal:
+        journal = str(csv_path.with_suffix(".journal.jsonl"))
+    run_journal = None
+    if journal:
+        run_journal = LinkJournal(
+            journal,
+            resume=resume,
+            run_info={
+                "csv_filepath": str(csv_path.resolve()),
+                "entity_type": entity_type.lower(),
+                "add_missing_ent": add_missing_ent,
+                "merge_concepts": merge_concepts
+            })
+        if resume:
+            click.echo(
+                f"Resuming from {journal}: {len(run_journal.done_rows)} rows done, "
+                f"{len(run_journal.resolutions)} entity lookups reused")
+    reject_file = None
+    reject_writer = None
+    rejected = []
+
+    def on_error(row_id, row, err):
+        nonlocal reject_file, reject_writer
+        if reject_writer is None:
+            reject_file = open(reject_csv, "w", encoding="UTF-8", newline="")
+            reject_writer = csv.DictWriter(reject_file, fieldnames=["row", *row, "error"])
+            reject_writer.writeheader()
+        reject_writer.writerow({"row": row_id, **row, "error": str(err)})
+        rejected.append(row_id)
+
+    invalid = []
+
+    def on_invalid(row_id, row, err):
+        if reject_csv:
+            if run_journal is not None:
+                run_journal.record_reject(row_id, str(err))
+            on_error(row_id, row, err)
+        elif len(invalid) < 5:
+            invalid.append(f"Row {row_id}: {err}")
+
+    linked = 0
+    try:
+        validation = validate_link_file(csv_path, entity_type, chunk_rows, on_error=on_invalid)
+        if validation["invalid"] and not reject_csv:
+            raise RuntimeError(
+                f"{len(validation['invalid'])} of {validation['rows']} rows in {csv_path} "
+                f"are invalid for entity type {entity_type}, nothing was linked. "
+                + " ".join(invalid))
+        if preload and entity_type.lower() != "term":
+            for model in sorted(validation["models"]):
+                click.echo(f"Preloaded {mdbn.preload(model)} {model} nanoids")
+        batches = iter_link_batches(
+            csv_path, entity_type, chunk_rows, skip_rows=validation["invalid"])
+        for row_ids, rows in batches:
+            if not rows:
+                continue
+            if validation["rows"] > chunk_rows:
+                click.echo(f"Rows {row_ids[0]}-{row_ids[-1]} of {validation['rows']}:")
+            plan = compile_link_plan(
+                rows, entity_type, mdbn, add_missing_ent,
+                merge_existing=merge_concepts, workers=workers, journal=run_journal,
+                on_error=on_error if reject_csv else None, row_ids=row_ids)
+            _apply_plan(plan, mdbn, dry_run, batch_size, workers)
+            linked += plan.rows
+        if rejected:
+            click.echo(f"Rejected {len(rejected)} rows, written to {reject_csv}")
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+        if run_journal is not None:
+            run_journal.close()
+        if run_stats is not None:
+            for line in run_stats.summary():
+                click.echo(line)
+    if not dry_run:
+        click.echo(f"Linked {linked} rows from {csv_path}")
+        if snapshot_path is not None:
+            mdbn.dump(snapshot_path)
+            click.echo(f"Saved in-memory MDB to {snapshot_path}")
 
-            row_ents = [ent_1, ent_2]
-            row_ents.extend(row_extra_ents)
 
-            if add_missing_ent:
-                # add entities if not in MDB
-                for ent in row_ents:
-                    ent_count = mdbn.get_entity_count(ent)[0]
-                    if not ent_count:
-                        mdbn.create_entity(ent)
-                    else:
-                        print(
-                            f"{get_entity_type(ent).capitalize()} entity with properties: "
-                            f"{mdbn.get_entity_attrs(ent)} already exists in the database.")
-                # add relationships between relevant entities if not in MDB
-                if ent_type in ["relationship", "edge"]:
-                    mdbn.create_relationship(ent_1, ent_1_src, "has_src") # type: ignore
-                    mdbn.create_relationship(ent_1, ent_1_dst, "has_dst") # type: ignore
-                    mdbn.create_relationship(ent_2, ent_2_src, "has_src") # type: ignore
-                    mdbn.create_relationship(ent_2, ent_2_dst, "has_dst") # type: ignore
-                elif ent_type == "property":
-                    mdbn.create_relationship(ent_1_node, ent_1, "has_property") # type: ignore
-                    mdbn.create_relationship(ent_2_node, ent_2, "has_property") # type: ignore
+def _apply_plan(plan, mdbn, dry_run: bool, batch_size: int, workers: int) -> None:
+    """Prints plan (if dry_run) and its size, then applies it unless dry_run"""
+    if dry_run:
+        for line in plan.describe():
+            click.echo(line)
+    plan_size = plan.size()
+    click.echo(", ".join(f"{key}: {val}" for key, val in plan_size.items()))
+    if dry_run:
+        return
+    if workers > 1:
+        def report(done_rows, total_rows, seconds):
+            click.echo(
+                f"Applied {done_rows}/{total_rows} rows "
+                f"({done_rows / seconds if seconds else 0.0:.1f} rows/s)")
 
-            mdbn.link_synonyms(ent_1, ent_2, add_missing_ent=add_missing_ent)
+        stats = apply_parallel(
+            plan, mdbn, workers=workers, batch_size=batch_size, progress=report)
+        click.echo(
+            f"Applied {stats['partitions']} partitions with {workers} workers in "
+            f"{stats['seconds']:.1f}s ({stats['rows_per_second']:.1f} rows/s, "
+            f"{stats['retries']} retries)")
+    else:
+        plan.apply(mdbn, batch_size=batch_size)
 
 if __name__ == "__main__":
     main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,259 @@
+"""
+Similarity backends used to score Term values against a TermVectorIndex.
+
+- SpacyBackend: cosine similarity of spaCy document vectors (the default)
+- CharNgramBackend: cosine similarity of hashed char n-gram TF-IDF vectors,
+  computed with numpy alone and far cheaper than running a spaCy pipeline
+- StringDistanceBackend: difflib edit similarity of the values, no vectors
+
+spaCy models are only imported when a SpacyBackend first needs one and are
+shared by the whole process (see load_spacy_model), so importing mdb_tools
+doesn't pay for loading scispaCy.
+"""
+
+import difflib
+import hashlib
+import importlib
+import threading
+import zlib
+
+import numpy as np
+
+from .term_blocking import normalize_value
+from .term_index import heap_top_k, pipe_vectors
+from .term_store import model_tag
+
+DEFAULT_SPACY_MODEL = "en_ner_bionlp13cg_md"  # en_core_sci_lg another potential option
+
+_spacy_models = {}
+_spacy_models_lock = threading.Lock()
+
+
+def load_spacy_model(name: str = DEFAULT_SPACY_MODEL):
+    """
+    Returns spaCy model packaged as module name, importing and loading it on first use.
+
+    Each model is loaded once per process and shared by every caller.
+    """
+    with _spacy_models_lock:
+        if name not in _spacy_models:
+            try:
+                model_module = importlib.import_module(name)
+            except ImportError as err:
+                raise RuntimeError(
+                    f"spaCy model {name} is not installed. Please install it or use a "
+                    "similarity backend that doesn't need spaCy.") from err
+            _spacy_models[name] = model_module.load()
+        return _spacy_models[name]
+
+
+class SimilarityBackend:
+    """
+    Base class of Term value similarity backends.
+
+    Vector backends (vectorized is True) embed values into the rows of a
+    TermVectorIndex, so a query is one matrix-vector product. Other backends
+    embed values into empty vectors and score the index's values directly.
+    Backends with needs_fit set must be fit to the indexed values before
+    embedding them. tag() identifies the vectors in a TermEmbeddingStore.
+    """
+    vectorized = True
+    needs_fit = False
+
+    @property
+    def dimension(self) -> int:
+        """Length of vectors produced by embed"""
+        raise NotImplementedError
+
+    def tag(self) -> dict:
+        """Returns model_name and model_version identifying the vectors produced"""
+        raise NotImplementedError
+
+    def fit(self, values) -> None:
+        """Prepares backend for the indexed Term values; nothing to do by default"""
+
+    def embed(self, values, batch_size: int = 256, n_process: int = 1):
+        """Yields vector of each value, in order"""
+        raise NotImplementedError
+
+    def vector(self, value: str) -> np.ndarray:
+        """Returns vector of one query value"""
+        return next(iter(self.embed([value])))
+
+    def query(
+        self,
+        index,
+        value: str,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None
+        ) -> list:
+        """Returns (row, similarity) of index Terms similar to value (see TermVectorIndex.query)"""
+        return index.query(self.vector(value), threshhold, top_k, rows)
+
+    def iter_scores(
+        self,
+        index,
+        value: str,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None
+        ):
+        """Yields (row, similarity) of Terms >= threshhold (see TermVectorIndex.iter_scores)"""
+        return index.iter_scores(self.vector(value), threshhold, top_k, rows)
+
+
+class SpacyBackend(SimilarityBackend):
+    """
+    Cosine similarity of spaCy document vectors.
+
+    The model is loaded through load_spacy_model on first use, unless an
+    already loaded nlp is given.
+    """
+    def __init__(self, model_name: str = DEFAULT_SPACY_MODEL, nlp=None):
+        self.model_name = model_name
+        self._nlp = nlp
+
+    @property
+    def nlp(self):
+        """spaCy model, loaded on first use"""
+        if self._nlp is None:
+            self._nlp = load_spacy_model(self.model_name)
+        return self._nlp
+
+    @property
+    def dimension(self) -> int:
+        return self.nlp.vocab.vectors_length
+
+    def tag(self) -> dict:
+        return model_tag(self.nlp)
+
+    def embed(self, values, batch_size: int = 256, n_process: int = 1):
+        """Yields document vector of each value through nlp.pipe (see pipe_vectors)"""
+        return pipe_vectors(values, self.nlp, batch_size, n_process)
+
+    def vector(self, value: str) -> np.ndarray:
+        nlp = self.nlp
+        return nlp(str(value)).vector
+
+
+class CharNgramBackend(SimilarityBackend):
+    """
+    Cosine similarity of char n-gram TF-IDF vectors hashed into dimension buckets.
+
+    Values are normalized (see term_blocking.normalize_value) and padded with
+    a space on each side, then every n-gram with length in ngram_range is
+    hashed with crc32, which is stable across processes. fit learns smoothed
+    IDF weights from the indexed values, so n-grams most Terms share count
+    less. Only spelling is compared, not meaning.
+    """
+    needs_fit = True
+
+    def __init__(self, ngram_range: tuple = (2, 4), dimension: int = 1024):
+        self.ngram_range = ngram_range
+        self._dimension = dimension
+        self.idf = np.ones(dimension, dtype=np.float32)
+        self.idf_digest = "unfit"
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def tag(self) -> dict:
+        min_n, max_n = self.ngram_range
+        return {
+            "model_name": f"char_ngram_tfidf_{min_n}_{max_n}",
+            "model_version": f"{self._dimension}-{self.idf_digest}"
+        }
+
+    def buckets(self, value: str) -> np.ndarray:
+        """Returns hashed bucket of each char n-gram of value"""
+        normalized = normalize_value(value)
+        if not normalized:
+            return np.zeros(0, dtype=np.int64)
+        padded = f" {normalized} "
+        min_n, max_n = self.ngram_range
+        return np.array(
+            [
+                zlib.crc32(padded[start:start + size].encode()) % self._dimension
+                for size in range(min_n, max_n + 1)
+                for start in range(len(padded) - size + 1)
+            ],
+            dtype=np.int64)
+
+    def fit(self, values) -> None:
+        """Sets IDF weights to log((1 + n) / (1 + df)) + 1 over given values"""
+        doc_freq = np.zeros(self._dimension, dtype=np.float64)
+        count = 0
+        for value in values:
+            doc_freq[np.unique(self.buckets(value))] += 1
+            count += 1
+        self.idf = (np.log((1 + count) / (1 + doc_freq)) + 1).astype(np.float32)
+        self.idf_digest = hashlib.sha1(self.idf.tobytes()).hexdigest()[:16]
+
+    def embed(self, values, batch_size: int = 256, n_process: int = 1):
+        """Yields TF-IDF vector of each value; batch_size and n_process are unused"""
+        for value in values:
+            counts = np.bincount(self.buckets(value), minlength=self._dimension)
+            yield counts.astype(np.float32) * self.idf
+
+
+class StringDistanceBackend(SimilarityBackend):
+    """
+    difflib.SequenceMatcher ratio of normalized values, without vectors.
+
+    A value's ratio is only computed when its cheap upper bounds
+    (real_quick_ratio, then quick_ratio) reach the threshhold. Every
+    candidate is scored in Python, so use blocking on large indexes.
+    """
+    vectorized = False
+    dimension = 0
+
+    def __init__(self):
+        self._normalized = (None, [])
+
+    def tag(self) -> dict:
+        return {"model_name": "string_distance", "model_version": "difflib"}
+
+    def embed(self, values, batch_size: int = 256, n_process: int = 1):
+        """Yields an empty vector per value"""
+        for _ in values:
+            yield np.zeros(0, dtype=np.float32)
+
+    def normalized_values(self, index) -> list:
+        """Returns normalized values of index, cached for the last index seen"""
+        if self._normalized[0] is not index:
+            self._normalized = (index, [normalize_value(value) for value in index.values])
+        return self._normalized[1]
+
+    def iter_scores(
+        self,
+        index,
+        value: str,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None
+        ):
+        values = self.normalized_values(index)
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        # SequenceMatcher caches details of seq2, so the query goes there
+        matcher.set_seq2(normalize_value(value))
+        for row in range(len(index)) if rows is None else rows:
+            matcher.set_seq1(values[row])
+            if matcher.real_quick_ratio() >= threshhold and matcher.quick_ratio() >= threshhold:
+                similarity = matcher.ratio()
+                if similarity >= threshhold:
+                    yield (int(row), similarity)
+
+    def query(
+        self,
+        index,
+        value: str,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None
+        ) -> list:
+        hits = self.iter_scores(index, value, threshhold, rows=rows)
+        if top_k is not None:
+            return heap_top_k(hits, top_k)
+        return sorted(hits, key=lambda hit: (-hit[1], hit[0]))
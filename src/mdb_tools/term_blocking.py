@@ -0,0 +1,119 @@
+"""
+Lexical candidate blocking for Term synonym search.
+"""
+
+import re
+from collections import defaultdict
+
+import numpy as np
+
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_value(value) -> str:
+    """Lowercases value and collapses any run of non-alphanumeric characters to one space"""
+    return NON_ALNUM.sub(" ", str(value).lower()).strip()
+
+
+def lexical_keys(value) -> set:
+    """
+    Returns blocking keys for a Term value: its normalized tokens and char trigrams.
+
+    Token keys are prefixed 't:' and trigram keys 'g:' so they never collide.
+    Trigrams are taken over the space-padded normalized value, so short values
+    and word boundaries still produce keys.
+    """
+    normalized = normalize_value(value)
+    if not normalized:
+        return set()
+    keys = {f"t:{token}" for token in normalized.split(" ")}
+    padded = f" {normalized} "
+    keys.update(f"g:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return keys
+
+
+class LexicalBlocker:
+    """
+    Inverted index from lexical keys to rows of a TermVectorIndex.
+
+    candidates() returns only the rows sharing at least min_shared keys with the
+    query value, so embedding similarity is scored on a fraction of the Terms.
+    Rows are the same as those of the values list the blocker was built from.
+
+    Keys present in more than max_key_fraction of rows (e.g. the trigram ' ca'
+    in a cancer vocabulary) carry little signal and are dropped when building.
+    """
+    def __init__(self, values: list, min_shared: int = 2, max_key_fraction: float = 0.5):
+        self.size = len(values)
+        self.min_shared = min_shared
+        postings = defaultdict(list)
+        for row, value in enumerate(values):
+            for key in lexical_keys(value):
+                postings[key].append(row)
+        max_rows = max(1, int(max_key_fraction * self.size))
+        self.postings = {
+            key: np.array(rows, dtype=np.int64)
+            for key, rows in postings.items() if len(rows) <= max_rows
+        }
+        self.queries = 0
+        self.candidates_total = 0
+
+    @classmethod
+    def from_records(cls, records, **kwargs) -> "LexicalBlocker":
+        """Builds blocker from records returned by NelsonMDB._get_all_terms()"""
+        return cls([record["term_val"] for record in records], **kwargs)
+
+    def candidates(self, value) -> np.ndarray:
+        """Returns sorted array of rows sharing at least min_shared keys with value"""
+        key_rows = [self.postings[key] for key in lexical_keys(value) if key in self.postings]
+        if key_rows:
+            shared = np.bincount(np.concatenate(key_rows), minlength=self.size)
+            rows = np.flatnonzero(shared >= min(self.min_shared, len(key_rows)))
+        else:
+            rows = np.zeros(0, dtype=np.int64)
+        self.queries += 1
+        self.candidates_total += len(rows)
+        return rows
+
+    def stats(self) -> dict:
+        """
+        Returns blocking stats for queries made so far.
+
+        'candidate_reduction' is the fraction of scoring work saved compared to
+        scoring every Term (0 = no saving, 1 = nothing scored).
+        """
+        mean_candidates = self.candidates_total / self.queries if self.queries else 0.0
+        return {
+            "terms": self.size,
+            "keys": len(self.postings),
+            "queries": self.queries,
+            "mean_candidates": mean_candidates,
+            "candidate_reduction": 1 - mean_candidates / self.size if self.size else 0.0
+        }
+
+    def evaluate(self, index, queries: list, threshhold: float = 0.8) -> dict:
+        """
+        Measures blocking recall against exhaustive scoring on a TermVectorIndex.
+
+        queries is a list of (value, query_vector) tuples. Recall is the share of
+        Terms scoring >= threshhold exhaustively that are also blocking candidates.
+        Doesn't add to the running stats().
+        """
+        found = 0
+        expected = 0
+        candidates_total = 0
+        for value, query_vector in queries:
+            exhaustive = {row for row, _ in index.query(query_vector, threshhold)}
+            key_rows = self.candidates(value)
+            candidates_total += len(key_rows)
+            expected += len(exhaustive)
+            found += len(exhaustive.intersection(key_rows.tolist()))
+        self.queries -= len(queries)
+        self.candidates_total -= candidates_total
+        mean_candidates = candidates_total / len(queries) if queries else 0.0
+        return {
+            "queries": len(queries),
+            "recall": found / expected if expected else 1.0,
+            "mean_candidates": mean_candidates,
+            "candidate_reduction": 1 - mean_candidates / self.size if self.size else 0.0
+        }
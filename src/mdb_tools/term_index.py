@@ -0,0 +1,361 @@
+"""
+Vector index of MDB Term values used to find likely synonyms quickly.
+"""
+
+import heapq
+from itertools import islice
+
+import numpy as np
+
+# columns of the dicts returned by TermVectorIndex.synonym
+SYNONYM_FIELDS = ["value", "origin_name", "nanoid", "similarity", "valid_synonym"]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Returns float32 copy of matrix with each row scaled to unit L2 norm.
+
+    Rows with zero norm (e.g. values with no known word vectors) are left as
+    zeros, so their cosine similarity to anything is 0 (same as spaCy's).
+    """
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def iter_chunks(iterable, size: int):
+    """Yields lists of up to size consecutive items of iterable"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def pipe_vectors(
+    values,
+    nlp,
+    batch_size: int = 256,
+    n_process: int = 1,
+    keep_pipes: tuple = ()
+    ):
+    """
+    Yields spaCy document vector of each value, in order.
+
+    Values are parsed in batches with nlp.pipe, with every pipeline component
+    except keep_pipes disabled: document vectors only need the tokenizer and
+    the model's static word vectors, not e.g. its NER component. With
+    n_process > 1, spaCy spreads batches over that many worker processes (on
+    platforms that spawn processes, call this under if __name__ == "__main__").
+    values can be a generator; it's read only as far as the pipe needs.
+    nlp can also be a SimilarityBackend, whose embed is used instead.
+    """
+    if hasattr(nlp, "embed"):
+        yield from nlp.embed(values, batch_size, n_process)
+        return
+    if not hasattr(nlp, "pipe"):
+        for value in values:
+            yield nlp(str(value)).vector
+        return
+    disable = [name for name in getattr(nlp, "pipe_names", []) if name not in keep_pipes]
+    docs = nlp.pipe(
+        (str(value) for value in values),
+        batch_size=batch_size,
+        n_process=n_process,
+        disable=disable)
+    for doc in docs:
+        yield doc.vector
+
+
+def vector_length(nlp) -> int:
+    """Returns length of vectors produced by spaCy model or SimilarityBackend"""
+    return nlp.dimension if hasattr(nlp, "embed") else nlp.vocab.vectors_length
+
+
+def embed_values(values: list, nlp, batch_size: int = 256, n_process: int = 1) -> np.ndarray:
+    """Returns matrix of spaCy document vectors (one row per value), see pipe_vectors"""
+    vectors = list(pipe_vectors(values, nlp, batch_size, n_process))
+    if not vectors:
+        return np.zeros((0, vector_length(nlp)), dtype=np.float32)
+    return np.vstack(vectors).astype(np.float32)
+
+
+def top_scores(
+    scores: np.ndarray,
+    threshhold: float = 0.8,
+    top_k: int = None,
+    rows: np.ndarray = None
+    ) -> list:
+    """
+    Returns (row, similarity) tuples of scores (one per index row) >= threshhold.
+
+    Tuples are ordered from most to least similar (ties keep row order). If
+    top_k is set, at most top_k are returned. If rows is given, only those
+    rows are considered.
+    """
+    if rows is None:
+        hits = np.flatnonzero(scores >= threshhold)
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        hits = rows[scores[rows] >= threshhold]
+    if top_k is not None and len(hits) > top_k:
+        # partial selection first so only the top k rows get fully sorted
+        keep = np.argpartition(-scores[hits], top_k - 1)[:top_k]
+        hits = np.sort(hits[keep])
+    hits = hits[np.argsort(-scores[hits], kind="stable")]
+    return [(int(row), float(scores[row])) for row in hits]
+
+
+def heap_top_k(scored, top_k: int) -> list:
+    """
+    Returns the top_k most similar of (row, similarity) tuples, most similar first.
+
+    scored can be a generator; only a heap of top_k tuples is kept while it's
+    read. Ties keep row order.
+    """
+    heap = []
+    for row, similarity in scored:
+        item = (similarity, -row)
+        if len(heap) < top_k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [(-neg_row, similarity) for similarity, neg_row in sorted(heap, reverse=True)]
+
+
+def iter_similar_pairs(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    matrix_a: np.ndarray,
+    matrix_b: np.ndarray,
+    threshhold: float = 0.8,
+    top_k: int = None,
+    tile_size: int = 1024,
+    symmetric: bool = False
+    ):
+    """
+    Yields (row_a, row_b, similarity) for row pairs of two normalized matrices.
+
+    The similarity product is computed one tile_size x tile_size block at a
+    time, so memory stays bounded no matter how many rows either matrix has.
+    Only pairs with similarity >= threshhold are yielded. If top_k is set,
+    only the top_k most similar rows of matrix_b are kept for each row of
+    matrix_a; pairs are then yielded grouped by row_a, most similar first.
+
+    If symmetric is set, matrix_b must be matrix_a: a row is never paired
+    with itself, so it doesn't use up a top_k slot, and each unordered pair
+    is yielded once, as row_a < row_b. With top_k, a pair is kept if either
+    row has the other among its top_k; pairs found from row_b are yielded
+    with that row's group, and those already yielded from row_a are
+    remembered until then.
+    """
+    yielded = set()
+    for start_a in range(0, len(matrix_a), tile_size):
+        tile_a = np.asarray(matrix_a[start_a:start_a + tile_size])
+        if top_k is not None:
+            best_scores = np.full((len(tile_a), top_k), -np.inf, dtype=np.float32)
+            best_rows = np.full((len(tile_a), top_k), -1, dtype=np.int64)
+        for start_b in range(0, len(matrix_b), tile_size):
+            if symmetric and top_k is None and start_b + tile_size <= start_a:
+                # every pair of this tile has row_b < row_a
+                continue
+            tile_scores = tile_a @ np.asarray(matrix_b[start_b:start_b + tile_size]).T
+            if symmetric:
+                tile_rows_a = np.arange(start_a, start_a + tile_scores.shape[0])[:, None]
+                tile_rows_b = np.arange(start_b, start_b + tile_scores.shape[1])[None, :]
+                if top_k is None:
+                    excluded = tile_rows_a >= tile_rows_b
+                else:
+                    excluded = tile_rows_a == tile_rows_b
+                tile_scores[excluded] = -np.inf
+            if top_k is None:
+                for row_a, row_b in zip(*np.nonzero(tile_scores >= threshhold)):
+                    yield (
+                        start_a + int(row_a), start_b + int(row_b),
+                        float(tile_scores[row_a, row_b]))
+                continue
+            # merge tile into running top k of each row
+            tile_scores[tile_scores < threshhold] = -np.inf
+            tile_rows = np.broadcast_to(
+                np.arange(start_b, start_b + tile_scores.shape[1]), tile_scores.shape)
+            scores = np.hstack([best_scores, tile_scores])
+            rows = np.hstack([best_rows, tile_rows])
+            if scores.shape[1] > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+        if top_k is None:
+            continue
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        for row_a in range(len(tile_a)):
+            for score, row_b in zip(best_scores[row_a], best_rows[row_a]):
+                if score == -np.inf:
+                    break
+                pair = (start_a + row_a, int(row_b))
+                if symmetric:
+                    if pair[0] > pair[1]:
+                        pair = (pair[1], pair[0])
+                        if pair in yielded:
+                            yielded.discard(pair)
+                            continue
+                    else:
+                        yielded.add(pair)
+                yield (*pair, float(score))
+
+
+class TermVectorIndex:
+    """
+    Contiguous, L2-normalized matrix of Term vectors keyed by Term nanoid.
+
+    Row i of the matrix is the embedding of values[i], which belongs to the
+    Term with origins[i] as origin_name and nanoids[i] as nanoid. Because rows
+    are unit length, a matrix-vector product gives the cosine similarity of a
+    query to every Term at once.
+    """
+    def __init__(
+        self,
+        nanoids: list,
+        values: list,
+        origins: list,
+        vectors: np.ndarray,
+        normalized: bool = False
+        ):
+        """
+        If normalized is True, vectors must already be a float32 matrix of unit
+        rows and is used as is (e.g. a read-only memmap shared between processes).
+        """
+        if not len(nanoids) == len(values) == len(origins) == len(vectors):
+            raise RuntimeError("nanoids, values, origins and vectors must have the same length")
+        self.nanoids = list(nanoids)
+        self.values = list(values)
+        self.origins = list(origins)
+        self.matrix = vectors if normalized else normalize_rows(vectors)
+        self.rows = {nano: row for row, nano in enumerate(self.nanoids) if nano}
+
+    def __len__(self):
+        return len(self.nanoids)
+
+    @classmethod
+    def from_records(
+        cls,
+        records,
+        nlp,
+        chunk_size: int = 10000,
+        batch_size: int = 256,
+        n_process: int = 1
+        ) -> "TermVectorIndex":
+        """
+        Embeds records returned by NelsonMDB._get_all_terms() (or iter_terms) into a new index.
+
+        nlp is a spaCy model or a SimilarityBackend (already fit, if it needs it).
+
+        Records are embedded as they're read, through one nlp.pipe stream with
+        given batch_size and n_process (see pipe_vectors), and normalized
+        chunk_size rows at a time.
+        """
+        nanoids, values, origins = [], [], []
+
+        def record_values():
+            for record in records:
+                values.append(record["term_val"])
+                origins.append(record["term_origin"])
+                nanoids.append(record["term_nano"])
+                yield record["term_val"]
+
+        matrices = [
+            normalize_rows(np.vstack(chunk))
+            for chunk in iter_chunks(
+                pipe_vectors(record_values(), nlp, batch_size, n_process), chunk_size)
+        ]
+        if not matrices:
+            return cls([], [], [], embed_values([], nlp))
+        return cls(nanoids, values, origins, np.vstack(matrices), normalized=True)
+
+    def origin_rows(self, origin_name: str) -> np.ndarray:
+        """Returns rows of Terms with given origin_name"""
+        return np.array(
+            [row for row, origin in enumerate(self.origins) if origin == origin_name],
+            dtype=np.int64)
+
+    def vector(self, nanoid: str) -> np.ndarray:
+        """Returns normalized vector of the Term with given nanoid"""
+        return self.matrix[self.rows[nanoid]]
+
+    def scores(self, query_vector: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Returns cosine similarity of query vector to every Term in the index.
+
+        If rows is given, only those rows are scored and the result lines up with rows.
+        """
+        query = normalize_rows(query_vector)[0]
+        if rows is None:
+            return self.matrix @ query
+        return self.matrix[rows] @ query
+
+    def iter_scores(
+        self,
+        query_vector: np.ndarray,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None,
+        tile_size: int = 65536
+        ):
+        """
+        Yields (row, similarity) for Terms scoring >= threshhold, in row order.
+
+        Rows (or only the given rows) are scored tile_size at a time, so memory
+        doesn't grow with the number of matches. If top_k is set, only the
+        top_k matches of each tile (and any tied with the last of them) are
+        yielded, which is all heap_top_k needs.
+        """
+        query = normalize_rows(query_vector)[0]
+        total = len(self) if rows is None else len(rows)
+        for start in range(0, total, tile_size):
+            if rows is None:
+                tile_rows = np.arange(start, min(start + tile_size, total))
+                scores = self.matrix[start:start + tile_size] @ query
+            else:
+                tile_rows = np.asarray(rows[start:start + tile_size], dtype=np.int64)
+                scores = self.matrix[tile_rows] @ query
+            hits = np.flatnonzero(scores >= threshhold)
+            if top_k is not None and len(hits) > top_k:
+                # keep ties with the k-th best too, so heap_top_k can break them by row
+                kth_score = np.partition(scores[hits], len(hits) - top_k)[len(hits) - top_k]
+                hits = hits[scores[hits] >= kth_score]
+            for hit in hits:
+                yield (int(tile_rows[hit]), float(scores[hit]))
+
+    def query(
+        self,
+        query_vector: np.ndarray,
+        threshhold: float = 0.8,
+        top_k: int = None,
+        rows: np.ndarray = None
+        ) -> list:
+        """
+        Returns (row, similarity) tuples for Terms similar to query vector.
+
+        Only rows with similarity >= threshhold are kept, ordered from most to
+        least similar (ties keep index order). If top_k is set, at most top_k
+        rows are returned. If rows is given (e.g. blocking candidates), only
+        those rows are scored.
+        """
+        if not len(self):
+            return []
+        if rows is None:
+            scores = self.scores(query_vector)
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            scores = np.zeros(len(self), dtype=np.float32)
+            scores[rows] = self.scores(query_vector, rows)
+        return top_scores(scores, threshhold, top_k, rows)
+
+    def synonym(self, row: int, similarity: float) -> dict:
+        """Returns dict representing Term at given row, as used by potential_synonyms_to_csv"""
+        return {
+            "value": self.values[row],
+            "origin_name": self.origins[row],
+            "nanoid": self.nanoids[row],
+            "similarity": similarity,
+            "valid_synonym": 0 # mark 1 if synonym when uploading later
+        }
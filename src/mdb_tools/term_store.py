@@ -0,0 +1,188 @@
+"""
+Persistent, memory-mapped store of Term vectors shared between processes.
+"""
+
+import json
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from .term_index import TermVectorIndex, normalize_rows, pipe_vectors, vector_length
+
+
+def model_tag(nlp) -> dict:
+    """Returns name and version of spaCy model (or SimilarityBackend), used to tag stored vectors"""
+    if hasattr(nlp, "embed"):
+        return nlp.tag()
+    meta = getattr(nlp, "meta", {}) or {}
+    name = meta.get("name", "")
+    if meta.get("lang") and name and not name.startswith(f"{meta['lang']}_"):
+        name = f"{meta['lang']}_{name}"
+    return {"model_name": name, "model_version": meta.get("version", "")}
+
+
+class TermEmbeddingStore:
+    """
+    Directory holding a float32 matrix of normalized Term vectors plus a JSON sidecar.
+
+    The matrix file is opened read-only with np.memmap, so opening the store
+    doesn't embed or copy anything and processes on the same host share pages.
+    The sidecar lists nanoid, value and origin_name for each row and is tagged
+    with the spaCy model (or similarity backend) name and version that
+    produced the vectors.
+
+    Each refresh writes a new matrix file and then atomically replaces the
+    sidecar, so readers never see a half-written store. Processes still mapping
+    the old matrix keep their (now unlinked) pages until they reopen.
+    """
+    SIDECAR_FILE = "terms.json"
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    @property
+    def sidecar_path(self) -> Path:
+        """Path of JSON sidecar file"""
+        return self.path / self.SIDECAR_FILE
+
+    def exists(self) -> bool:
+        """True if store has been written"""
+        return self.sidecar_path.exists()
+
+    def read_sidecar(self) -> dict:
+        """Returns sidecar contents as dict"""
+        with open(self.sidecar_path, encoding="UTF-8") as sidecar_file:
+            return json.load(sidecar_file)
+
+    def matches_model(self, nlp) -> bool:
+        """True if stored vectors were produced by given spaCy model"""
+        if not self.exists():
+            return False
+        sidecar = self.read_sidecar()
+        tag = model_tag(nlp)
+        return (
+            sidecar["model_name"] == tag["model_name"]
+            and sidecar["model_version"] == tag["model_version"]
+        )
+
+    def open(self, nlp=None) -> TermVectorIndex:
+        """
+        Returns TermVectorIndex backed by the memory-mapped matrix.
+
+        If nlp is given, raises an error if the store was built with a different model.
+        """
+        if not self.exists():
+            raise RuntimeError(f"No term embedding store found at {self.path}")
+        if nlp is not None and not self.matches_model(nlp):
+            raise RuntimeError(
+                f"Term embedding store at {self.path} was built with a different spaCy "
+                "model. Refresh the store with the current model before using it.")
+        sidecar = self.read_sidecar()
+        nanoids, values, origins = zip(*sidecar["terms"]) if sidecar["terms"] else ([], [], [])
+        if sidecar["terms"] and sidecar["dim"]:
+            matrix = np.memmap(
+                self.path / sidecar["vectors_file"],
+                dtype=np.float32,
+                mode="r",
+                shape=(len(sidecar["terms"]), sidecar["dim"])
+            )
+        else:
+            matrix = np.zeros((len(sidecar["terms"]), sidecar["dim"]), dtype=np.float32)
+        return TermVectorIndex(nanoids, values, origins, matrix, normalized=True)
+
+    def refresh(
+        self,
+        records,
+        nlp,
+        chunk_size: int = 10000,
+        batch_size: int = 256,
+        n_process: int = 1
+        ) -> dict:
+        """
+        Brings store up to date with records returned by NelsonMDB._get_all_terms().
+
+        Only Terms whose (nanoid, value) pair isn't already stored are embedded;
+        vectors of unchanged Terms are copied from the current matrix. If the
+        store was built with a different model, every Term is re-embedded.
+
+        Values to embed go through one nlp.pipe stream with given batch_size
+        and n_process (see pipe_vectors), whose vectors come back in order and
+        are appended to the new matrix file chunk_size rows at a time. Records
+        (e.g. the NelsonMDB.iter_terms generator) are read as the pipe needs
+        them, so only a few chunks of vectors are held in memory.
+
+        Returns dict with counts of 'total', 'embedded' and 'reused' rows.
+        """
+        old_rows = {}
+        old_matrix = None
+        # the current vectors file is removed once replaced, even on a full rebuild
+        old_vectors_file = self.read_sidecar().get("vectors_file") if self.exists() else None
+        if self.matches_model(nlp):
+            old_index = self.open()
+            old_matrix = old_index.matrix
+            for row, (nano, value) in enumerate(zip(old_index.nanoids, old_index.values)):
+                old_rows[(nano, value)] = row
+
+        dim = vector_length(nlp)
+        if old_matrix is not None and len(old_matrix):
+            dim = old_matrix.shape[1]
+
+        terms = []
+        # (old row or None) of terms read but not written yet, in record order
+        pending = deque()
+
+        def values_to_embed():
+            for record in records:
+                term = [record["term_nano"], record["term_val"], record["term_origin"]]
+                terms.append(term)
+                old_row = old_rows.get((term[0], term[1]))
+                pending.append(old_row)
+                if old_row is None:
+                    yield term[1]
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        vectors_file = f"vectors-{os.getpid()}-{os.urandom(4).hex()}.f32"
+        embedded = 0
+        with open(self.path / vectors_file, "wb") as vectors_out:
+            chunk = np.zeros((chunk_size, dim), dtype=np.float32)
+            filled = 0
+
+            def add_row(vector) -> None:
+                nonlocal filled
+                chunk[filled] = vector
+                filled += 1
+                if filled == chunk_size:
+                    vectors_out.write(chunk.tobytes())
+                    filled = 0
+
+            for vector in pipe_vectors(values_to_embed(), nlp, batch_size, n_process):
+                # terms read before this one were reused from the old matrix
+                while pending[0] is not None:
+                    add_row(old_matrix[pending.popleft()])
+                pending.popleft()
+                add_row(normalize_rows(vector)[0])
+                embedded += 1
+            while pending:
+                add_row(old_matrix[pending.popleft()])
+            vectors_out.write(chunk[:filled].tobytes())
+
+        sidecar = {
+            **model_tag(nlp),
+            "dim": dim,
+            "vectors_file": vectors_file,
+            "terms": terms
+        }
+        tmp_sidecar = self.sidecar_path.with_suffix(".json.tmp")
+        with open(tmp_sidecar, "w", encoding="UTF-8") as sidecar_file:
+            json.dump(sidecar, sidecar_file)
+        os.replace(tmp_sidecar, self.sidecar_path)
+        if old_vectors_file and old_vectors_file != vectors_file:
+            (self.path / old_vectors_file).unlink(missing_ok=True)
+
+        return {
+            "total": len(terms),
+            "embedded": embedded,
+            "reused": len(terms) - embedded
+        }
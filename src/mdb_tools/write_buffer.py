@@ -0,0 +1,134 @@
+"""
+Write buffer that coalesces NelsonMDB writes into grouped transactions.
+"""
+
+import logging
+
+from .queries import (unwind_delete_relationship_query, unwind_entity_query,
+                      unwind_relationship_query)
+
+logger = logging.getLogger(__name__)
+
+
+def attrs_match(query_attrs: dict, pending_attrs: dict) -> bool:
+    """True if an entity with pending_attrs would be matched by a query on query_attrs"""
+    return all(pending_attrs.get(key) == val for key, val in query_attrs.items())
+
+
+class WriteBuffer:
+    """
+    Queue of pending create_entity, create_relationship and detach_delete_entity writes
+    (and relationship deletes, used by MemoryMDB.sync).
+
+    Consecutive writes of the same kind and query template are coalesced into
+    one parameterized UNWIND statement, and every statement of a flush runs in
+    one transaction. Writes keep their original order across statements. The
+    buffer flushes itself every flush_size ops, unless flush_size is None.
+
+    Pending creates and relationships can be looked up (see pending_entities
+    and pending_concepts), so NelsonMDB reads inside a batch see them.
+    """
+    def __init__(self, mdbn, flush_size: int = 1000):
+        self.mdbn = mdbn
+        self.flush_size = flush_size
+        self.ops = []
+        self.has_deletes = False
+        self.flushed = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add_entity(self, entity_type: str, attrs: dict) -> None:
+        """Queues MERGE of entity with given attributes"""
+        self._add(("merge", entity_type, tuple(sorted(attrs))), attrs)
+
+    def add_delete(self, entity_type: str, attrs: dict) -> None:
+        """Queues DETACH DELETE of entities matching given attributes"""
+        self.has_deletes = True
+        self._add(("detach_delete", entity_type, tuple(sorted(attrs))), attrs)
+
+    def add_relationship(
+        self,
+        src_type: str,
+        src_attrs: dict,
+        relationship: str,
+        dst_type: str,
+        dst_attrs: dict
+        ) -> None:
+        """Queues MERGE of relationship between entities matching given attributes"""
+        group = (
+            "relationship", src_type, tuple(sorted(src_attrs)),
+            relationship, dst_type, tuple(sorted(dst_attrs))
+        )
+        self._add(group, {"src": src_attrs, "dst": dst_attrs})
+
+    def add_relationship_delete(
+        self,
+        src_type: str,
+        src_attrs: dict,
+        relationship: str,
+        dst_type: str,
+        dst_attrs: dict
+        ) -> None:
+        """Queues DELETE of relationship between entities matching given attributes"""
+        self.has_deletes = True
+        group = (
+            "delete_relationship", src_type, tuple(sorted(src_attrs)),
+            relationship, dst_type, tuple(sorted(dst_attrs))
+        )
+        self._add(group, {"src": src_attrs, "dst": dst_attrs})
+
+    def pending_entities(self, entity_type: str, attrs: dict) -> list:
+        """Returns attribute dicts of distinct pending creates matched by attrs"""
+        matches = []
+        for group, row in self.ops:
+            if group[0] == "merge" and group[1] == entity_type and attrs_match(attrs, row):
+                if row not in matches:
+                    matches.append(row)
+        return matches
+
+    def pending_concepts(self, entity_type: str, attrs: dict, relationship: str) -> list:
+        """Returns nanoids of Concepts linked to matching entity by pending relationships"""
+        concepts = []
+        for group, row in self.ops:
+            if (
+                group[0] == "relationship" and group[1] == entity_type
+                and group[3] == relationship and group[4] == "concept"
+                and (attrs_match(attrs, row["src"]) or attrs_match(row["src"], attrs))
+                and row["dst"].get("nanoid") not in concepts
+            ):
+                concepts.append(row["dst"].get("nanoid"))
+        return concepts
+
+    def flush(self) -> int:
+        """Writes every pending op in one transaction; returns number of ops written"""
+        if not self.ops:
+            return 0
+        statements = []
+        for group, row in self.ops:
+            if statements and statements[-1][0] == group:
+                statements[-1][1].append(row)
+            else:
+                statements.append((group, [row]))
+        with self.mdbn.driver.session() as session:
+            with session.begin_transaction() as tx:
+                for group, rows in statements:
+                    if group[0] == "relationship":
+                        qry = unwind_relationship_query(*group[1:])
+                    elif group[0] == "delete_relationship":
+                        qry = unwind_delete_relationship_query(*group[1:])
+                    else:
+                        qry = unwind_entity_query(*group)
+                    tx.run(qry, parameters={"rows": rows})
+                tx.commit()
+        count = len(self.ops)
+        logger.info("Flushed %d writes in %d statements", count, len(statements))
+        self.flushed += count
+        self.ops = []
+        self.has_deletes = False
+        return count
+
+    def _add(self, group: tuple, row: dict) -> None:
+        self.ops.append((group, row))
+        if self.flush_size and len(self.ops) >= self.flush_size:
+            self.flush()
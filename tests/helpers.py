@@ -0,0 +1,36 @@
+"""
+Entity builders and graph comparison shared by the tests.
+"""
+
+from collections import Counter
+
+from bento_meta.objects import Node, Term
+
+
+def node(handle: str, nanoid: str = None, model: str = "M") -> Node:
+    return Node({"model": model, "handle": handle, **({"nanoid": nanoid} if nanoid else {})})
+
+
+def term(value: str, nanoid: str = None, origin_name: str = "O") -> Term:
+    return Term({
+        "origin_name": origin_name, "value": value, **({"nanoid": nanoid} if nanoid else {})
+    })
+
+
+def node_key(graph, node_id) -> tuple:
+    """Returns label and properties of node; Concepts by the entities linked to them"""
+    if graph.labels[node_id] == "concept":
+        return ("concept", tuple(sorted(
+            node_key(graph, src) for src in graph.neighbors(node_id, incoming=True))))
+    return (graph.labels[node_id], tuple(sorted(graph.props[node_id].items())))
+
+
+def graph_shape(graph) -> tuple:
+    """Returns counts of node and relationship keys, ignoring ids and Concept nanoids"""
+    nodes = Counter(node_key(graph, node_id) for node_id in graph.labels)
+    rels = Counter(
+        (node_key(graph, src), rel, node_key(graph, dst))
+        for src, rels_by_type in graph.out_rels.items()
+        for rel, dsts in rels_by_type.items()
+        for dst in dsts)
+    return (nodes, rels)
@@ -0,0 +1,194 @@
+"""
+AsyncNelsonMDB against a fake async driver that answers queries from a responder function.
+"""
+
+import asyncio
+
+import pytest
+from bento_meta.objects import Concept, Property, Term
+
+from mdb_tools import AsyncNelsonMDB, bounded_gather
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def data(self):
+        return self.rows
+
+
+class FakeTx:
+    def __init__(self, driver, mode):
+        self.driver = driver
+        self.mode = mode
+
+    async def run(self, qry, parms):
+        driver = self.driver
+        driver.log.append((self.mode, qry, parms))
+        driver.active += 1
+        driver.peak = max(driver.peak, driver.active)
+        await asyncio.sleep(0.001)
+        driver.active -= 1
+        return FakeResult(driver.respond(qry, parms))
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def execute_read(self, work, *args):
+        return await work(FakeTx(self.driver, "read"), *args)
+
+    async def execute_write(self, work, *args):
+        return await work(FakeTx(self.driver, "write"), *args)
+
+
+class FakeDriver:
+    """Answers each query with respond(qry, parms), logging (mode, qry, parms)"""
+    def __init__(self, respond):
+        self.respond = respond
+        self.log = []
+        self.sessions = []
+        self.active = 0
+        self.peak = 0
+        self.closed = False
+
+    def session(self, **kwargs):
+        self.sessions.append(kwargs)
+        return FakeSession(self)
+
+    async def close(self):
+        self.closed = True
+
+
+def respond_found(qry, parms):
+    """Every entity exists once, with nanoid n_<value or handle>"""
+    if "entity_count" in qry:
+        return [{"entity_count": 1}]
+    if "ent_nano" in qry:
+        return [{"ent_nano": f"n_{parms['value']}"}]
+    if "prop_nano" in qry:
+        return [{"prop_nano": f"n_{parms['prop_handle']}"}]
+    if "src_count" in qry:
+        return [{"src_count": 1, "dst_count": 1}]
+    return []
+
+
+def term(value: str) -> Term:
+    return Term({"origin_name": "O", "value": value})
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_get_or_make_nano_caches_found_entities():
+    driver = FakeDriver(respond_found)
+    mdbn = AsyncNelsonMDB(driver=driver)
+    assert run(mdbn.get_or_make_nano(term("a"))) == "n_a"
+    queries = len(driver.log)
+    assert run(mdbn.get_or_make_nano(term("a"))) == "n_a"
+    assert len(driver.log) == queries
+    assert {mode for mode, *_ in driver.log} == {"read"}
+
+
+def test_get_or_make_nano_makes_nanoid_for_missing_entity():
+    driver = FakeDriver(lambda qry, parms: [{"entity_count": 0}] if "entity_count" in qry else [])
+    mdbn = AsyncNelsonMDB(driver=driver)
+    nano = run(mdbn.get_or_make_nano(term("a")))
+    assert len(nano) == 6
+    assert len(mdbn.nano_cache) == 0
+
+
+def test_get_entity_nano_raises_if_not_unique():
+    driver = FakeDriver(lambda qry, parms: [{"entity_count": 2}])
+    mdbn = AsyncNelsonMDB(driver=driver)
+    with pytest.raises(RuntimeError, match="uniquely identify"):
+        run(mdbn.get_entity_nano(term("a")))
+
+
+def test_gather_limits_concurrency_and_keeps_order():
+    driver = FakeDriver(respond_found)
+    mdbn = AsyncNelsonMDB(driver=driver, max_concurrency=3)
+    values = [f"v{i}" for i in range(12)]
+    nanos = run(mdbn.gather(mdbn.get_or_make_nano(term(value)) for value in values))
+    assert nanos == [f"n_{value}" for value in values]
+    assert 1 < driver.peak <= 3
+
+
+def test_bounded_gather_returns_results_in_order():
+    async def delayed(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    results = run(bounded_gather([delayed(i, 0.001 * (5 - i)) for i in range(5)], 2))
+    assert results == list(range(5))
+
+
+def test_create_relationship_raises_if_entity_missing():
+    driver = FakeDriver(lambda qry, parms: [{"src_count": 0, "dst_count": 1}])
+    mdbn = AsyncNelsonMDB(driver=driver)
+    with pytest.raises(RuntimeError, match="aren't in the MDB"):
+        run(mdbn.create_relationship(term("a"), Concept({"nanoid": "c"}), "represents"))
+    assert driver.log[0][0] == "write"
+
+
+def test_create_relationship_invalidates_cached_property():
+    driver = FakeDriver(respond_found)
+    mdbn = AsyncNelsonMDB(driver=driver)
+    prop = Property({"model": "M", "handle": "p"})
+    assert run(mdbn.get_or_make_nano(prop, "node")) == "n_p"
+    assert len(mdbn.nano_cache) == 1
+    run(mdbn.create_relationship(prop, Concept({"nanoid": "c"}), "has_concept"))
+    assert len(mdbn.nano_cache) == 0
+
+
+def test_link_synonyms_returns_concept_and_invalidates_created_entity():
+    def respond(qry, parms):
+        if "count_1" in qry:
+            return [{
+                "count_1": 1, "count_2": 0, "ok": True, "concept": "c1", "already_linked": False
+            }]
+        return respond_found(qry, parms)
+
+    driver = FakeDriver(respond)
+    mdbn = AsyncNelsonMDB(driver=driver)
+    run(mdbn.get_or_make_nano(term("b")))
+    new_term = Term({"origin_name": "O", "value": "b", "nanoid": "nb"})
+    assert run(mdbn.link_synonyms(term("a"), new_term, add_missing_ent=True)) == "c1"
+    _, _, parms = driver.log[-1]
+    assert parms["create_1"] is False and parms["create_2"] is True
+    assert len(mdbn.nano_cache) == 0
+
+
+def test_link_synonyms_raises_if_missing_and_not_added():
+    driver = FakeDriver(lambda qry, parms: [{
+        "count_1": 1, "count_2": 0, "ok": False, "concept": "c1", "already_linked": False
+    }])
+    mdbn = AsyncNelsonMDB(driver=driver)
+    with pytest.raises(RuntimeError, match="add_missing_ent is False"):
+        run(mdbn.link_synonyms(term("a"), term("b")))
+
+
+def test_injected_driver_isnt_closed():
+    driver = FakeDriver(respond_found)
+
+    async def use():
+        async with AsyncNelsonMDB(driver=driver, database="mdb") as mdbn:
+            await mdbn.get_entity_count(term("a"))
+
+    run(use())
+    assert not driver.closed
+    assert driver.sessions == [{"database": "mdb"}]
+
+
+def test_needs_uri_or_driver():
+    with pytest.raises(RuntimeError, match="needs a uri or a driver"):
+        AsyncNelsonMDB()
@@ -0,0 +1,27 @@
+"""
+clean-cda workbook cleaning (cda_mapping) on small generated workbooks.
+"""
+
+import pandas as pd
+
+from mdb_tools.cda_mapping import clean_workbook, read_workbook
+
+
+def write_workbook(path, sheets: dict) -> None:
+    with pd.ExcelWriter(path) as writer:
+        for sheet, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet, index=False)
+
+
+def test_sheets_of_the_same_endpoint_are_all_cleaned(tmp_path):
+    path = tmp_path / "wb.xlsx"
+    write_workbook(path, {
+        "file endpoint": {"field": ["f1"], "GDC": ["files.file_size"]},
+        "file extra": {"field": ["f2"], "GDC": ["files.md5sum"]},
+    })
+    sheets = read_workbook(path)
+    assert list(sheets) == ["file endpoint", "file extra"]
+    clean_df, _ = clean_workbook(sheets)
+    assert clean_df["ent_1_handle"].tolist() == ["f1", "f2"]
+    assert clean_df["ent_1_extra_handles"].tolist() == [["File"], ["File"]]
+
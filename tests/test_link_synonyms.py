@@ -0,0 +1,76 @@
+"""
+link_synonyms' single statement (MemoryMDB._link_synonyms_txn) against the stepwise path.
+"""
+
+import pytest
+from bento_meta.objects import Concept
+
+from mdb_tools import MemoryMDB
+from mdb_tools.queries import link_synonyms_query
+
+from .helpers import graph_shape, node, term
+
+
+def setup_existing(mdbn) -> None:
+    """Adds nodes a (with Concept ca), b (with Concept cb), c and term t"""
+    for entity in [node("a", "na"), node("b", "nb"), node("c", "nc"), term("t", "nt")]:
+        mdbn.create_entity(entity)
+    for handle, concept in [("a", "ca"), ("b", "cb")]:
+        mdbn.create_entity(Concept({"nanoid": concept}))
+        mdbn.create_relationship(node(handle), Concept({"nanoid": concept}), "has_concept")
+
+
+CASES = {
+    "same missing entity": (node("x", "nx"), node("x", "nx")),
+    "both missing": (node("x", "nx"), node("y", "ny")),
+    "first missing": (node("x", "nx"), node("a")),
+    "second missing": (node("a"), node("x", "nx")),
+    "existing, no Concepts": (node("c"), node("c")),
+    "different Concepts": (node("a"), node("b")),
+    "second has Concept": (node("c"), node("b")),
+    "missing terms": (term("u", "nu"), term("u", "nu")),
+    "term and missing term": (term("t"), term("v", "nv")),
+}
+
+
+@pytest.mark.parametrize("entities", CASES.values(), ids=CASES.keys())
+def test_single_statement_matches_stepwise(entities):
+    single = MemoryMDB()
+    stepwise = MemoryMDB()
+    for mdbn in [single, stepwise]:
+        setup_existing(mdbn)
+    single.link_synonyms(*entities, add_missing_ent=True)
+    stepwise._link_synonyms_stepwise(*entities, add_missing_ent=True)
+    assert graph_shape(single.graph) == graph_shape(stepwise.graph)
+
+
+def test_same_missing_entity_created_once():
+    mdbn = MemoryMDB()
+    mdbn.link_synonyms(node("x", "nx"), node("x", "nx"), add_missing_ent=True)
+    assert mdbn.get_entity_count(node("x"))[0] == 1
+    assert len(mdbn.get_concepts(node("x"))) == 1
+
+
+def test_linking_twice_is_idempotent():
+    mdbn = MemoryMDB()
+    setup_existing(mdbn)
+    mdbn.link_synonyms(node("c"), node("x", "nx"), add_missing_ent=True)
+    shape = graph_shape(mdbn.graph)
+    mdbn.link_synonyms(node("c"), node("x"))
+    assert graph_shape(mdbn.graph) == shape
+
+
+@pytest.mark.parametrize("link", ["link_synonyms", "_link_synonyms_stepwise"])
+def test_missing_entity_without_add_missing_ent_raises(link):
+    mdbn = MemoryMDB()
+    setup_existing(mdbn)
+    with pytest.raises(RuntimeError, match="aren't in the MDB"):
+        getattr(mdbn, link)(node("a"), node("x", "nx"))
+    assert mdbn.get_entity_count(node("x"))[0] == 0
+
+
+def test_query_merges_second_entity():
+    keys = ("handle", "model", "nanoid")
+    qry = link_synonyms_query("node", keys, "node", keys, "has_concept")
+    assert qry.count("CREATE (") == 1
+    assert "MERGE (new_2:node {handle: $e2_handle, model: $e2_model, nanoid: $e2_nanoid})" in qry
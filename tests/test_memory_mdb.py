@@ -0,0 +1,216 @@
+"""
+Core write and link paths of NelsonMDB, run against MemoryMDB.
+"""
+
+import threading
+
+import pytest
+from bento_meta.objects import Concept, Property
+
+from mdb_tools import MemoryGraph, MemoryMDB, apply_parallel, compile_link_plan
+
+from .helpers import graph_shape, node, term
+
+
+def mapping_row(handle_1: str, handle_2: str) -> dict:
+    return {
+        "ent_1_model": "M", "ent_1_handle": handle_1, "ent_1_extra_handles": "[]",
+        "ent_2_model": "M", "ent_2_handle": handle_2, "ent_2_extra_handles": "[]",
+    }
+
+
+def add_property(
+    mdbn, node_handle: str, prop_handle: str, nanoid: str, node_model: str = "M"
+    ) -> Property:
+    prop = Property({"model": "M", "handle": prop_handle, "nanoid": nanoid})
+    mdbn.create_entity(prop)
+    mdbn.create_relationship(node(node_handle, model=node_model), prop, "has_property")
+    return prop
+
+
+@pytest.fixture
+def mdbn():
+    mdbn = MemoryMDB()
+    for handle in "abc":
+        mdbn.create_entity(node(handle, f"n{handle}"))
+    return mdbn
+
+
+def test_create_entity_needs_nanoid(mdbn):
+    with pytest.raises(RuntimeError, match="needs a nanoid"):
+        mdbn.create_entity(node("x"))
+
+
+def test_create_entity_merges(mdbn):
+    mdbn.create_entity(node("a", "na"))
+    assert mdbn.get_entity_count(node("a")) == [1]
+    assert mdbn.get_entity_nano(node("a")) == ["na"]
+
+
+def test_detach_delete_entity(mdbn):
+    mdbn.create_entity(Concept({"nanoid": "c"}))
+    mdbn.create_relationship(node("a"), Concept({"nanoid": "c"}), "has_concept")
+    assert mdbn.get_or_make_nano(node("a")) == "na"
+    mdbn.detach_delete_entity(node("a"))
+    assert mdbn.get_entity_count(node("a")) == [0]
+    assert mdbn.get_entity_nano(node("a")) == []
+    assert not mdbn.graph.neighbors(mdbn.graph.match("concept", {"nanoid": "c"})[0], incoming=True)
+
+
+def test_create_relationship_raises_if_missing_or_not_unique(mdbn):
+    with pytest.raises(RuntimeError, match="aren't in the MDB"):
+        mdbn.create_relationship(node("a"), node("x"), "has_concept")
+    mdbn.graph.create("node", {"model": "M", "handle": "a", "nanoid": "na2"})
+    with pytest.raises(RuntimeError, match="uniquely identify"):
+        mdbn.create_relationship(node("a"), node("b"), "has_concept")
+
+
+def test_property_resolved_by_node_handle(mdbn):
+    add_property(mdbn, "a", "p", "pa")
+    add_property(mdbn, "b", "p", "pb")
+    assert mdbn.get_or_make_nano(Property({"model": "M", "handle": "p"}), "a") == "pa"
+    assert mdbn.get_or_make_nano(Property({"model": "M", "handle": "p"}), "b") == "pb"
+    with pytest.raises(RuntimeError, match="extra_handle_1"):
+        mdbn.get_entity_nano(Property({"model": "M", "handle": "p"}))
+
+
+def test_create_relationship_invalidates_cached_property(mdbn):
+    add_property(mdbn, "a", "p", "p1")
+    mdbn.create_entity(Property({"model": "M", "handle": "p", "nanoid": "p2"}))
+    lookup = Property({"model": "M", "handle": "p"})
+    assert mdbn.get_entity_nano(lookup, "a") == ["p1"]
+    mdbn.create_relationship(node("a"), Property({"nanoid": "p2"}), "has_property")
+    assert sorted(mdbn.get_entity_nano(lookup, "a")) == ["p1", "p2"]
+
+
+def test_get_or_make_nano_caches_and_makes_new(mdbn):
+    assert mdbn.get_or_make_nano(node("a")) == "na"
+    assert mdbn.nano_cache.stats()["size"] == 1
+    nano = mdbn.get_or_make_nano(node("x"))
+    assert len(nano) == 6 and nano != "na"
+
+
+def test_preload_caches_model(mdbn):
+    add_property(mdbn, "a", "p", "pa")
+    assert mdbn.preload("M") == 4
+    assert mdbn.get_entity_nano(Property({"model": "M", "handle": "p"}), "a") == ["pa"]
+
+
+def test_batch_matches_direct_writes():
+    def write(mdbn):
+        mdbn.create_entity(node("a", "na"))
+        mdbn.create_entity(term("t", "nt"))
+        mdbn.create_entity(Concept({"nanoid": "c"}))
+        mdbn.create_relationship(node("a"), Concept({"nanoid": "c"}), "has_concept")
+        mdbn.link_synonyms(term("t"), term("u", "nu"), add_missing_ent=True)
+
+    direct = MemoryMDB()
+    write(direct)
+    batched = MemoryMDB()
+    with batched.batch():
+        write(batched)
+        assert batched.get_entity_count(term("u")) == [1]
+    assert graph_shape(batched.graph) == graph_shape(direct.graph)
+
+
+def test_link_synonyms_reuses_existing_concept(mdbn):
+    mdbn.create_entity(Concept({"nanoid": "c"}))
+    mdbn.create_relationship(node("b"), Concept({"nanoid": "c"}), "has_concept")
+    mdbn.link_synonyms(node("a"), node("b"))
+    assert mdbn.get_concepts(node("a")) == ["c"]
+    mdbn.link_synonyms(node("a"), node("b"))
+    assert mdbn.get_concepts(node("b")) == ["c"]
+
+
+def test_merge_concepts_moves_relationships(mdbn):
+    for handle, concept in [("a", "c1"), ("b", "c2"), ("c", "c3")]:
+        mdbn.create_entity(Concept({"nanoid": concept}))
+        mdbn.create_relationship(node(handle), Concept({"nanoid": concept}), "has_concept")
+    assert mdbn.merge_concepts([("c1", "c2"), ("c2", "c3")]) == [["c1", "c2"], ["c1", "c3"]]
+    assert [mdbn.get_concepts(node(handle)) for handle in "abc"] == [["c1"]] * 3
+    assert mdbn.get_entity_count(Concept({"nanoid": "c2"})) == [0]
+    with pytest.raises(RuntimeError, match="aren't in the MDB"):
+        mdbn.merge_concepts([("c1", "missing")])
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_link_plan_joins_chains_into_one_concept(workers):
+    rows = [mapping_row("a", "b"), mapping_row("c", "d"), mapping_row("b", "c"),
+            mapping_row("x", "y")]
+    mdbn = MemoryMDB()
+    plan = compile_link_plan(rows, "node", mdbn, add_missing_ent=True, workers=workers)
+    assert plan.size()["components"] == 2
+    if workers > 1:
+        apply_parallel(plan, mdbn, workers=workers)
+    else:
+        plan.apply(mdbn)
+    concepts = [mdbn.get_concepts(node(handle)) for handle in "abcdxy"]
+    assert all(len(concept) == 1 for concept in concepts)
+    assert len({concept[0] for concept in concepts[:4]}) == 1
+    assert concepts[4] == concepts[5] != concepts[0]
+
+
+def test_link_plan_matches_link_synonyms():
+    rows = [mapping_row("a", "b"), mapping_row("a", "c"), mapping_row("d", "e")]
+    planned = MemoryMDB()
+    linked = MemoryMDB()
+    for mdbn in [planned, linked]:
+        for handle in "abcde":
+            mdbn.create_entity(node(handle, f"n{handle}"))
+    compile_link_plan(rows, "node", planned).apply(planned)
+    for row in rows:
+        linked.link_synonyms(node(row["ent_1_handle"]), node(row["ent_2_handle"]))
+    assert graph_shape(planned.graph) == graph_shape(linked.graph)
+
+
+def test_link_plan_rejects_missing_without_add_missing_ent():
+    rejected = []
+    plan = compile_link_plan(
+        [mapping_row("a", "b")], "node", MemoryMDB(),
+        on_error=lambda row_id, row, err: rejected.append(row_id))
+    assert rejected == [1]
+    assert plan.rows == 0
+
+
+def test_link_plan_doesnt_create_missing_parent_node():
+    mdbn = MemoryMDB()
+    # properties are matched to their node by handle only, so they're found
+    # although their node isn't in model M
+    mdbn.create_entity(node("a", "na", model="X"))
+    for handle in ["p", "q"]:
+        add_property(mdbn, "a", handle, f"n{handle}", node_model="X")
+    row = {
+        "ent_1_model": "M", "ent_1_handle": "p", "ent_1_extra_handles": "['a']",
+        "ent_2_model": "M", "ent_2_handle": "q", "ent_2_extra_handles": "['a']",
+    }
+    shape = graph_shape(mdbn.graph)
+    rejected = []
+    plan = compile_link_plan(
+        [row], "property", mdbn, on_error=lambda row_id, row, err: rejected.append(row_id))
+    plan.apply(mdbn)
+    assert rejected == [1]
+    assert graph_shape(mdbn.graph) == shape
+    with pytest.raises(RuntimeError, match="aren't in the MDB"):
+        compile_link_plan([row], "property", mdbn)
+
+
+def test_snapshot_round_trip(mdbn, tmp_path):
+    mdbn.link_synonyms(node("a"), node("b"))
+    path = tmp_path / "mdb.json.gz"
+    mdbn.dump(str(path))
+    assert graph_shape(MemoryMDB(snapshot_path=str(path)).graph) == graph_shape(mdbn.graph)
+
+
+def test_graph_merge_is_thread_safe():
+    graph = MemoryGraph()
+
+    def work():
+        for i in range(1000):
+            graph.merge("node", {"model": "M", "handle": f"h{i % 100}", "nanoid": f"n{i % 100}"})
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(graph) == 100
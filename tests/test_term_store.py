@@ -0,0 +1,32 @@
+"""
+TermEmbeddingStore refreshes, embedding with the numpy-only CharNgramBackend.
+"""
+
+from mdb_tools import CharNgramBackend
+from mdb_tools.term_store import TermEmbeddingStore
+
+
+def records(values) -> list:
+    return [
+        {"term_nano": f"n{i}", "term_val": value, "term_origin": "O"}
+        for i, value in enumerate(values)
+    ]
+
+
+def test_refresh_reuses_unchanged_terms(tmp_path):
+    store = TermEmbeddingStore(tmp_path / "store")
+    backend = CharNgramBackend(dimension=32)
+    assert store.refresh(records(["lung", "breast"]), backend)["embedded"] == 2
+    counts = store.refresh(records(["lung", "breast", "liver"]), backend)
+    assert (counts["embedded"], counts["reused"]) == (1, 2)
+    assert store.open().values == ["lung", "breast", "liver"]
+    assert len(list((tmp_path / "store").glob("*.f32"))) == 1
+
+
+def test_model_change_removes_old_vectors_file(tmp_path):
+    store = TermEmbeddingStore(tmp_path / "store")
+    store.refresh(records(["lung", "breast"]), CharNgramBackend(dimension=32))
+    counts = store.refresh(records(["lung", "breast"]), CharNgramBackend(dimension=16))
+    assert counts["embedded"] == 2
+    assert store.open().matrix.shape == (2, 16)
+    assert len(list((tmp_path / "store").glob("*.f32"))) == 1